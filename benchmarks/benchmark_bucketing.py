@@ -0,0 +1,46 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This script compares the time of a training epoch when all the SMILES are padded to the longest one and when the batches
+are made of SMILES of similar length and only padded to their own longest SMILES. A few long molecules are added to the
+example data set, as it happens in real data sets with some macrocycles.
+"""
+
+from molbot import smiles_generator, data_processing, batching
+import os
+import time
+import numpy as np
+
+batch_size = 50
+n_epochs = 2
+
+# Reading the data and adding some long molecules
+current_dir = os.path.dirname(os.path.realpath(__file__))
+data_path = os.path.join(current_dir, "..", "data", "example_data_2.csv")
+molecules = [line.rstrip() for line in open(data_path, 'r')] * 10
+molecules += ["C1CCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCC1O"] * 5
+
+dp = data_processing.Molecules_processing()
+X = dp.onehot_encode(molecules)
+y = np.zeros(X.shape)
+y[:, :-1, :] = X[:, 1:, :]
+y[:, -1, dp.char_to_idx['A']] = 1
+
+batcher = batching.Length_batcher(X, y, dp.char_to_idx['A'], batch_size=batch_size, random_state=0)
+print("Fraction of the timesteps saved: %.2f" % batcher.padding_saved())
+
+estimator = smiles_generator.Smiles_generator(epochs=n_epochs, batch_size=batch_size, validation=0)
+start = time.time()
+estimator.fit(X, y)
+padded_time = (time.time() - start) / n_epochs
+
+estimator = smiles_generator.Smiles_generator(epochs=n_epochs, batch_size=batch_size, validation=0)
+start = time.time()
+estimator.fit_stream(batcher)
+bucketed_time = (time.time() - start) / n_epochs
+
+print("Padded to the longest SMILES: %.1f s/epoch" % padded_time)
+print("Batched by length:            %.1f s/epoch" % bucketed_time)
+print("Speed up:                     %.1fx" % (padded_time / bucketed_time))
@@ -0,0 +1,32 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This script compares the number of valid molecules generated per second with and without the SMILES grammar
+constraints. It requires RDKit and a model trained with example_training.py.
+"""
+
+from molbot import smiles_generator, data_processing, utils
+import time
+
+n_molecules = 1000
+
+estimator = smiles_generator.Smiles_generator()
+estimator.load("../examples/example-model.h5")
+dp = data_processing.Molecules_processing()
+dp.load("../examples/example-dp.pickle")
+
+for constrained in [False, True]:
+    start = time.time()
+    hot_pred = estimator.predict(dp.get_empty(n_molecules), temperature=0.75, data_handler=dp, random_state=0,
+                                 constrained=constrained)
+    smiles = dp.onehot_decode(hot_pred)
+    elapsed = time.time() - start
+
+    perc_valid, perc_unique, _, _ = utils.valid_and_unique_smiles([smiles])
+    n_valid = perc_valid / 100 * n_molecules
+
+    print("Constrained: %s" % constrained)
+    print("    Valid: %.1f %%, unique: %.1f %%" % (perc_valid, perc_unique))
+    print("    Valid molecules per second: %.1f" % (n_valid / elapsed))
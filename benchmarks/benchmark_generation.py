@@ -0,0 +1,49 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This script compares the speed of generating molecules with the single step model used by Smiles_generator.predict and
+with the original approach, where the whole sequence generated so far is fed to the model at every step.
+The model is only trained for one epoch, since only the speed of the generation matters here.
+"""
+
+from molbot import smiles_generator, data_processing, step_model
+import os
+import time
+import numpy as np
+
+n_molecules = 100
+temperature = 0.75
+
+# Reading the data
+current_dir = os.path.dirname(os.path.realpath(__file__))
+data_path = os.path.join(current_dir, "..", "data", "example_data_2.csv")
+molecules = [line.rstrip() for line in open(data_path, 'r')]
+
+# One-hot encode the molecules
+dp = data_processing.Molecules_processing()
+X = dp.onehot_encode(molecules)
+y = np.zeros(X.shape)
+y[:, :-1, :] = X[:, 1:, :]
+y[:, -1, dp.char_to_idx['A']] = 1
+
+estimator = smiles_generator.Smiles_generator(epochs=1, hidden_neurons_1=256, hidden_neurons_2=256)
+estimator.fit(X, y)
+
+X_empty = dp.get_empty(n_molecules)
+reference_model = step_model.whole_sequence_model(estimator.model, temperature)
+
+for max_length in [100, 200]:
+    start = time.time()
+    step_model.whole_sequence_pred(X_empty, reference_model, max_length, np.random.default_rng(0))
+    reference_time = time.time() - start
+
+    start = time.time()
+    estimator.predict(X_empty, temperature=temperature, max_length=max_length)
+    stateful_time = time.time() - start
+
+    print("max_length = %i" % max_length)
+    print("    Whole sequence: %.1f molecules/s" % (n_molecules / reference_time))
+    print("    Single step:    %.1f molecules/s" % (n_molecules / stateful_time))
+    print("    Speed up:       %.1fx" % (reference_time / stateful_time))
@@ -0,0 +1,62 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This script compares the speed of the decoding in Molecules_processing, which looks up the bytes of all the characters at
+once, with the original implementation, which builds each string one character at a time.
+"""
+
+from molbot import data_processing
+import os
+import time
+import numpy as np
+
+n_repeats = 200
+
+def loop_onehot_decode(data_handler, hot_molecules):
+    """
+    The original decoding, one molecule and one character at a time.
+    """
+
+    molecules = []
+
+    for i in range(len(hot_molecules)):
+        mol = ''
+        for j in range(len(hot_molecules[i])):
+            mol += data_handler.idx_to_char[np.argmax(hot_molecules[i][j])]
+        try:
+            e_idx = mol.index("E")
+            molecules.append(mol[1:e_idx])
+        except ValueError:
+            molecules.append(mol)
+
+    return molecules
+
+# Reading the data
+current_dir = os.path.dirname(os.path.realpath(__file__))
+data_path = os.path.join(current_dir, "..", "data", "example_data_2.csv")
+molecules = [line.rstrip() for line in open(data_path, 'r')] * n_repeats
+
+dp = data_processing.Molecules_processing()
+hot_molecules = dp.onehot_encode(molecules)
+
+start = time.time()
+loop_molecules = loop_onehot_decode(dp, hot_molecules)
+loop_time = time.time() - start
+
+start = time.time()
+vectorised_molecules = dp.onehot_decode(hot_molecules)
+vectorised_time = time.time() - start
+
+int_molecules = np.argmax(hot_molecules, axis=-1)
+start = time.time()
+int_vectorised_molecules = dp.onehot_decode(int_molecules)
+int_time = time.time() - start
+
+assert loop_molecules == vectorised_molecules == int_vectorised_molecules
+
+print("%i molecules of up to %i characters" % int_molecules.shape)
+print("    Loop:                 %.3f s" % loop_time)
+print("    Vectorised (one-hot): %.3f s (%.0fx)" % (vectorised_time, loop_time / vectorised_time))
+print("    Vectorised (indices): %.3f s (%.0fx)" % (int_time, loop_time / int_time))
@@ -0,0 +1,58 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This script compares the speed of the one-hot encoding in Molecules_processing, which sets all the characters in a single
+operation, with the original implementation, which loops over the molecules and the characters. The SMILES are turned
+into character indices first, so that only the one-hot encoding is timed.
+"""
+
+from molbot import data_processing
+import os
+import time
+import numpy as np
+
+n_repeats = 200
+
+def loop_onehot_encode(int_molecules, n_feat):
+    """
+    The original one-hot encoding, one molecule and one character at a time.
+    """
+
+    n_samples, max_size = int_molecules.shape
+    hot_molecules = np.zeros((n_samples, max_size, n_feat), dtype=np.int16)
+
+    for n in range(n_samples):
+        input_sequence = np.zeros((max_size, n_feat))
+        for j in range(max_size):
+            input_sequence[j][int_molecules[n][j]] = 1
+        hot_molecules[n] = input_sequence
+
+    return hot_molecules
+
+# Reading the data
+current_dir = os.path.dirname(os.path.realpath(__file__))
+data_path = os.path.join(current_dir, "..", "data", "example_data_2.csv")
+molecules = [line.rstrip() for line in open(data_path, 'r')] * n_repeats
+
+dp = data_processing.Molecules_processing()
+int_molecules = dp.string_to_int(molecules)
+n_feat = len(dp.idx_to_char)
+
+# Replacing the conversion to indices so that only the one-hot encoding is timed
+dp.string_to_int = lambda molecules: int_molecules
+
+start = time.time()
+hot_loop = loop_onehot_encode(int_molecules, n_feat)
+loop_time = time.time() - start
+
+print("%i molecules of up to %i characters" % int_molecules.shape)
+print("    Loop:         %.3f s" % loop_time)
+
+for dtype in [np.int16, bool, np.uint8, np.float32]:
+    start = time.time()
+    hot_vectorised = dp.onehot_encode(molecules, dtype=dtype)
+    vectorised_time = time.time() - start
+    assert np.all(hot_vectorised == hot_loop)
+    print("    %-12s  %.3f s (%.0fx)" % (np.dtype(dtype).name + ":", vectorised_time, loop_time / vectorised_time))
@@ -0,0 +1,54 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This script compares the time taken to write a tokenized data set from a large CSV file by a single process with
+tokenized_dataset.write_dataset and by a pool of processes with tokenized_dataset.write_dataset_parallel.
+"""
+
+from molbot import data_processing, data_streaming, tokenized_dataset
+import os
+import time
+import shutil
+import numpy as np
+
+if __name__ == "__main__":
+
+    # Writing a large file from the example data
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    data_path = os.path.join(current_dir, "..", "data", "example_data_2.csv")
+    example_molecules = [line.rstrip() for line in open(data_path, 'r')]
+
+    molecules = example_molecules * 2000
+    with open("temp_large.csv", "w") as out_file:
+        out_file.write("\n".join(molecules) + "\n")
+
+    dp = data_processing.Molecules_processing()
+    dp.build_vocabulary(data_streaming.read_smiles("temp_large.csv"))
+
+    start = time.time()
+    tokenized_dataset.write_dataset("temp_serial", data_streaming.read_smiles("temp_large.csv"), dp,
+                                    n_samples=len(molecules))
+    serial_time = time.time() - start
+    expected = tokenized_dataset.Tokenized_dataset("temp_serial")
+
+    print("%i molecules, %.1f MB" % (len(molecules), os.path.getsize("temp_large.csv") / 1e6))
+    print("    Single process: %.3f s" % serial_time)
+
+    for n_workers in [1, 2, 4]:
+        start = time.time()
+        tokenized_dataset.write_dataset_parallel("temp_parallel", "temp_large.csv", dp, n_workers=n_workers,
+                                                 chunk_bytes=2**20)
+        parallel_time = time.time() - start
+
+        dataset = tokenized_dataset.Tokenized_dataset("temp_parallel")
+        assert np.all(dataset.tokens == expected.tokens)
+        del dataset
+        shutil.rmtree("temp_parallel")
+
+        print("    %i processes:    %.3f s (%.1fx)" % (n_workers, parallel_time, serial_time / parallel_time))
+
+    del expected
+    shutil.rmtree("temp_serial")
+    os.remove("temp_large.csv")
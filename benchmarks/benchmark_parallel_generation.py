@@ -0,0 +1,56 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This script measures how the generation of molecules with numpy_engine.generate_parallel scales with the number of
+processes. The model is only trained for one epoch, since only the speed of the generation matters here.
+Numpy should use a single thread in each process, so run it as: OMP_NUM_THREADS=1 python benchmark_parallel_generation.py
+"""
+
+from molbot import smiles_generator, data_processing, numpy_engine
+import multiprocessing
+import os
+import time
+import numpy as np
+
+n_molecules = 20000
+chunk_size = 500
+
+if __name__ == "__main__":
+
+    # Reading the data
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    data_path = os.path.join(current_dir, "..", "data", "example_data_2.csv")
+    molecules = [line.rstrip() for line in open(data_path, 'r')]
+
+    # One-hot encode the molecules
+    dp = data_processing.Molecules_processing()
+    X = dp.onehot_encode(molecules)
+    y = np.zeros(X.shape)
+    y[:, :-1, :] = X[:, 1:, :]
+    y[:, -1, dp.char_to_idx['A']] = 1
+
+    estimator = smiles_generator.Smiles_generator(epochs=1, hidden_neurons_1=256, hidden_neurons_2=256)
+    estimator.fit(X, y)
+    estimator.export_weights("benchmark-model.npz")
+
+    n_workers = 1
+    reference_time = None
+    reference_smiles = None
+
+    while n_workers <= multiprocessing.cpu_count():
+        start = time.time()
+        smiles = numpy_engine.generate_parallel("benchmark-model.npz", dp, n_molecules, n_workers=n_workers,
+                                                chunk_size=chunk_size, temperature=0.75, random_state=0)
+        elapsed = time.time() - start
+
+        if reference_time is None:
+            reference_time = elapsed
+            reference_smiles = smiles
+
+        print("%3i processes: %8.1f molecules/s, speed up %5.1fx, same molecules as 1 process: %s" %
+              (n_workers, n_molecules / elapsed, reference_time / elapsed, smiles == reference_smiles))
+        n_workers *= 2
+
+    os.remove("benchmark-model.npz")
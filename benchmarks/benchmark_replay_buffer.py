@@ -0,0 +1,71 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This script compares the time taken to add batches of episodes to the RL experience buffer with the original list of
+tuples, which replaces the episode with the smallest reward one at a time, and with the array-backed Replay_buffer.
+"""
+
+from molbot import replay_buffer
+import time
+import numpy as np
+
+def list_insert(experience, rewards, n_episodes, hot_pred, sequence_log_likelihood, new_rewards):
+    """
+    The original update of the experience buffer in Reinforcement_learning._rl_episodes.
+    """
+
+    if len(experience) < n_episodes:
+        idx_sorted = np.argsort(new_rewards)
+        hot_pred = hot_pred[idx_sorted]
+        sequence_log_likelihood = sequence_log_likelihood[idx_sorted]
+        new_rewards = np.asarray(new_rewards)[idx_sorted]
+
+        for n_ep in range(n_episodes-len(experience)):
+            if n_ep+1 > len(new_rewards):
+                break
+            expanded_hot_pred = np.expand_dims(hot_pred[-(n_ep+1)], axis=0)
+            experience.append((expanded_hot_pred, sequence_log_likelihood[-(n_ep+1)], new_rewards[-(n_ep+1)]))
+            rewards.append(new_rewards[-(n_ep+1)])
+    else:
+        while min(rewards) < max(new_rewards):
+            idx_to_pop = np.argmin(rewards)
+            idx_to_add = np.argmax(new_rewards)
+            del experience[idx_to_pop]
+            del rewards[idx_to_pop]
+            expanded_hot_pred = np.expand_dims(hot_pred[idx_to_add], axis=0)
+            experience.append((expanded_hot_pred, sequence_log_likelihood[idx_to_add], new_rewards[idx_to_add]))
+            rewards.append(new_rewards[idx_to_add])
+            hot_pred = np.delete(hot_pred, idx_to_add, axis=0)
+            sequence_log_likelihood = np.delete(sequence_log_likelihood, idx_to_add, axis=0)
+            new_rewards = np.delete(new_rewards, idx_to_add, axis=0)
+
+    return experience, rewards
+
+rng = np.random.default_rng(0)
+max_length = 80
+n_batches = 5
+
+for buffer_size in [200, 1000]:
+    # Batches of twice as many episodes as the buffer size, as generated in each RL epoch, with increasing rewards
+    batches = [(rng.integers(0, 35, size=(2*buffer_size, max_length)).astype(np.int16),
+                -rng.random(2*buffer_size) * 50, rng.random(2*buffer_size) + 0.1 * i) for i in range(n_batches)]
+
+    experience, rewards = [], []
+    start = time.time()
+    for hot_pred, log_likelihood, new_rewards in batches:
+        experience, rewards = list_insert(experience, rewards, buffer_size, hot_pred, log_likelihood, new_rewards)
+    list_time = time.time() - start
+
+    buffer = replay_buffer.Replay_buffer(buffer_size)
+    start = time.time()
+    for hot_pred, log_likelihood, new_rewards in batches:
+        buffer.insert(hot_pred, log_likelihood, new_rewards)
+    array_time = time.time() - start
+
+    assert np.isclose(np.sum(rewards), np.sum(buffer.rewards), rtol=1e-4)
+
+    print("Buffer of %i episodes, %i batches of %i episodes" % (buffer_size, n_batches, 2*buffer_size))
+    print("    List of tuples: %.3f s" % list_time)
+    print("    Replay_buffer:  %.3f s (%.0fx)" % (array_time, list_time / array_time))
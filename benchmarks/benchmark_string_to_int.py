@@ -0,0 +1,73 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This script compares the speed of Molecules_processing.string_to_int, which maps the bytes of all the SMILES through a
+lookup table, with the original implementation, which builds an array of strings and maps each character through a
+dictionary. Both the first call, which also finds the vocabulary, and the following calls are timed.
+"""
+
+from molbot import data_processing
+import os
+import time
+import numpy as np
+
+def loop_string_to_int(data_handler, molecules):
+    """
+    The original conversion, one character at a time.
+    """
+
+    if data_handler.max_size == 0:
+        data_handler.max_size = len(max(molecules, key=len)) + 2
+
+    padded_molecules = np.tile(np.array('A'), (len(molecules), data_handler.max_size))
+
+    for i in range(len(molecules)):
+        all_char = ['G'] + list(molecules[i]) + ['E']
+        padded_molecules[i][:len(all_char)] = all_char
+
+    all_possible_char = np.unique(padded_molecules)
+    if len(data_handler.char_to_idx) == 0:
+        data_handler.char_to_idx = {char: idx for idx, char in enumerate(all_possible_char)}
+        data_handler.idx_to_char = {idx: char for idx, char in enumerate(all_possible_char)}
+
+    n_samples = padded_molecules.shape[0]
+    int_molecules = np.zeros((n_samples, data_handler.max_size), dtype=np.int16)
+
+    for n in range(n_samples):
+        sample = padded_molecules[n]
+        int_molecules[n] = [data_handler.char_to_idx[char] for char in sample]
+
+    return int_molecules
+
+# Reading the data
+current_dir = os.path.dirname(os.path.realpath(__file__))
+data_path = os.path.join(current_dir, "..", "data", "example_data_2.csv")
+example_molecules = [line.rstrip() for line in open(data_path, 'r')]
+
+for n_repeats in [100, 1000]:
+    molecules = example_molecules * n_repeats
+    n_characters = sum(len(molecule) for molecule in molecules)
+
+    loop_dp = data_processing.Molecules_processing()
+    start = time.time()
+    int_loop = loop_string_to_int(loop_dp, molecules)
+    loop_time = time.time() - start
+
+    dp = data_processing.Molecules_processing()
+    start = time.time()
+    int_table = dp.string_to_int(molecules)
+    first_time = time.time() - start
+
+    start = time.time()
+    dp.string_to_int(molecules)
+    next_time = time.time() - start
+
+    assert np.all(int_loop == int_table)
+    assert loop_dp.char_to_idx == dp.char_to_idx
+
+    print("%i molecules, %i characters" % (len(molecules), n_characters))
+    print("    Loop:                 %.3f s" % loop_time)
+    print("    Lookup table (first): %.3f s (%.0fx)" % (first_time, loop_time / first_time))
+    print("    Lookup table (next):  %.3f s (%.0fx)" % (next_time, loop_time / next_time))
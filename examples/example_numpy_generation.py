@@ -0,0 +1,28 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This example shows how to generate new SMILES using only numpy, once the weights of a trained model have been exported.
+It requires having run example_training.py first.
+"""
+
+from molbot import numpy_engine, data_processing
+
+# The weights can be exported in the environment where Keras is installed with:
+#     estimator = smiles_generator.Smiles_generator()
+#     estimator.load("example-model.h5")
+#     estimator.export_weights("example-model.npz")
+
+# Loading the exported weights and the data processing object (Keras is not imported)
+generator = numpy_engine.Numpy_generator("example-model.npz")
+dp = data_processing.Molecules_processing()
+dp.load("example-dp.pickle")
+
+# Predicting 10 new molecules at a temperature of 0.75
+X_pred_hot = dp.get_empty(10)
+pred_hot = generator.predict(X_pred_hot, temperature=0.75, data_handler=dp)
+pred = dp.onehot_decode(pred_hot)
+
+for smile in pred:
+    print(smile)
@@ -0,0 +1,31 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This example shows how to train an RNN on SMILES that are read from a file one batch at a time, so that the data set does
+not need to fit in memory. The data handler needs to know all the characters and the maximum length of the SMILES before
+streaming starts, which only needs one pass over the file.
+"""
+
+from molbot import smiles_generator, data_processing, data_streaming
+import os
+
+# The file with the SMILES, one per line
+data_dir = os.path.join("..", "data")
+data_path = os.path.join(data_dir, "example_data_2.csv")
+
+# Finding the characters and the maximum length of the SMILES, reading the file one chunk at a time
+dp = data_processing.Molecules_processing()
+dp.build_vocabulary(data_streaming.read_smiles(data_path))
+
+# Streaming the SMILES in shuffled batches that are encoded in the background while the model trains
+stream = data_streaming.Smiles_stream(data_path, dp, batch_size=10, buffer_size=1000, random_state=0)
+
+# Creating and training the model
+estimator = smiles_generator.Smiles_generator(epochs=5, hidden_neurons_1=100, hidden_neurons_2=100)
+estimator.fit_stream(stream)
+
+# Generating some molecules
+for smile in estimator.generate_iter(dp, n_total=10, batch_size=10, temperature=0.75):
+    print(smile)
@@ -0,0 +1,33 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This example shows how to encode a data set of SMILES once and save it on disk, so that the following training runs can
+open it instantly as a memory map instead of encoding the SMILES again.
+"""
+
+from molbot import smiles_generator, data_processing, data_streaming, tokenized_dataset
+import os
+
+# The file with the SMILES, one per line
+data_dir = os.path.join("..", "data")
+data_path = os.path.join(data_dir, "example_data_2.csv")
+
+# Encoding the data set once
+if not os.path.exists("example-dataset"):
+    dp = data_processing.Molecules_processing(unknown_chars="skip", long_molecules="skip")
+    statistics = dp.build_vocabulary(data_streaming.read_smiles(data_path))
+    tokenized_dataset.write_dataset("example-dataset", data_streaming.read_smiles(data_path), dp,
+                                    n_samples=statistics["n_molecules"])
+
+# Opening the data set does not read it into memory
+dataset = tokenized_dataset.Tokenized_dataset("example-dataset")
+print("The data set contains %i molecules." % len(dataset))
+
+# Training on the character indices, reading one batch at a time
+estimator = smiles_generator.Smiles_generator(epochs=5, hidden_neurons_1=100, hidden_neurons_2=100)
+estimator.fit_stream(dataset.batches(batch_size=10, one_hot=False, random_state=0))
+
+for smile in estimator.generate_iter(dataset.data_handler, n_total=10, batch_size=10, temperature=0.75):
+    print(smile)
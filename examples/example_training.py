@@ -45,14 +45,19 @@ estimator.fit(X, y)
 
 # Predicting 10 new molecules from the fitted model at a temperature of 0.75
 X_pred_hot = dp.get_empty(10)
-pred_hot = estimator.predict(X_pred_hot, temperature=0.75)
+pred_hot = estimator.predict(X_pred_hot, temperature=0.75, data_handler=dp)
 pred = dp.onehot_decode(pred_hot)
 
 # Print some predicted SMILES (they will be nonsense here because the model is trained on very few samples)
 for smile in pred:
     print(smile)
 
+# Generating molecules one at a time as they are finished, without keeping all of them in memory
+for smile in estimator.generate_iter(dp, n_total=20, batch_size=10, temperature=0.75):
+    print(smile)
+
 # Saving the estimator for later re-use
 estimator.save("example-model.h5")
+estimator.export_weights("example-model.npz")
 dp.save("example-dp.pickle")
 
@@ -0,0 +1,145 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This module contains a batcher that groups the SMILES of similar length, so that each batch is only padded to its own
+longest SMILES rather than to the longest SMILES of the data set. Since the LSTMs accept sequences of any length, this
+avoids running them over timesteps that only contain the padding character.
+"""
+
+import numpy as np
+
+from . import utils
+
+def sequence_lengths(X, pad_idx):
+    """
+    This function returns the number of characters of each padded SMILES, including the 'G' and 'E' characters.
+
+    :param X: hot-encoded SMILES or their character indices
+    :type X: np.array of shape (n_samples, max_len, n_char) or (n_samples, max_len)
+    :param pad_idx: index of the padding character 'A'
+    :type pad_idx: int
+    :return: length of each SMILES
+    :rtype: np.array of shape (n_samples,)
+    """
+
+    int_X = X if len(X.shape) == 2 else np.argmax(X, axis=-1)
+
+    # Position of the last character that is not padding
+    not_pad = (int_X != pad_idx)
+    last = X.shape[1] - 1 - np.argmax(not_pad[:, ::-1], axis=-1)
+
+    return np.where(np.any(not_pad, axis=-1), last + 1, 0)
+
+class Length_batcher():
+
+    def __init__(self, X, y, pad_idx, batch_size=128, n_char=None, random_state=None):
+        """
+        This function sorts the SMILES by length. The batches are made of SMILES of similar length and are then trimmed
+        to the length of their longest SMILES.
+
+        :param X: Input one-hot-encoded padded smiles strings or their character indices
+        :type X: np.array of shape (n_samples, max_len, n_char) or (n_samples, max_len)
+        :param y: Output one-hot-encoded padded smiles strings or their character indices
+        :type y: np.array of shape (n_samples, max_len, n_char) or (n_samples, max_len)
+        :param pad_idx: index of the padding character 'A'
+        :type pad_idx: int
+        :param batch_size: number of SMILES in each batch
+        :type batch_size: int
+        :param n_char: number of different characters, only used for character indices. If None, it is taken from the
+        largest index in X and y.
+        :type n_char: int or None
+        :param random_state: seed or random number generator used to shuffle the batches
+        :type random_state: None, int or numpy.random.Generator
+        """
+
+        utils.check_X_y_shapes(X, y)
+        utils.check_n_samples(batch_size)
+
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self.one_hot = (len(X.shape) == 3)
+        self.rng = utils.set_random_state(random_state)
+
+        if self.one_hot:
+            self.n_feat = X.shape[-1]
+        elif isinstance(n_char, type(None)):
+            self.n_feat = int(max(np.max(X), np.max(y))) + 1
+        else:
+            self.n_feat = n_char
+
+        self.lengths = sequence_lengths(X, pad_idx)
+
+    def __len__(self):
+        """
+        This function returns the number of batches in one pass over the data set.
+
+        :return: number of batches
+        :rtype: int
+        """
+
+        return int(np.ceil(self.X.shape[0] / self.batch_size))
+
+    def __iter__(self):
+        """
+        This function yields the batches of the data set, passing over it again and again as Keras expects.
+
+        :return: batches of inputs and outputs of the model
+        :rtype: generator of tuples of two numpy arrays
+        """
+
+        while True:
+            for batch in self.epoch():
+                yield batch
+
+    def epoch(self):
+        """
+        This function yields the batches of a single pass over the data set. SMILES of the same length are shuffled
+        among themselves and the order of the batches is shuffled, so that the batches change from one epoch to the next.
+
+        :return: batches of inputs and outputs of the model
+        :rtype: generator of tuples of two numpy arrays
+        """
+
+        for idx in self._batch_indices(shuffle=True):
+            max_len = np.max(self.lengths[idx])
+            yield self.X[idx, :max_len], self.y[idx, :max_len]
+
+    def padding_saved(self):
+        """
+        This function returns the fraction of the timesteps that the LSTMs do not need to process in an epoch, compared
+        to padding all the SMILES to the same length.
+
+        :return: fraction of the timesteps saved
+        :rtype: float
+        """
+
+        full_timesteps = self.X.shape[0] * self.X.shape[1]
+        bucketed_timesteps = sum(len(idx) * np.max(self.lengths[idx]) for idx in self._batch_indices(shuffle=False))
+
+        return 1.0 - float(bucketed_timesteps) / full_timesteps
+
+    def _batch_indices(self, shuffle):
+        """
+        This function splits the SMILES sorted by length in batches.
+
+        :param shuffle: whether to shuffle the SMILES of the same length and the order of the batches
+        :type shuffle: bool
+        :return: indices of the SMILES in each batch
+        :rtype: list of numpy arrays
+        """
+
+        if shuffle:
+            # Adding a random number smaller than 1 only changes the order of the SMILES of the same length
+            order = np.argsort(self.lengths + self.rng.random(self.lengths.shape[0]), kind='stable')
+        else:
+            order = np.argsort(self.lengths, kind='stable')
+
+        batches = [order[i:i+self.batch_size] for i in range(0, order.shape[0], self.batch_size)]
+
+        if shuffle:
+            batches = [batches[i] for i in self.rng.permutation(len(batches))]
+
+        return batches
@@ -4,29 +4,63 @@
 
 """
 This class can be used to turn SMILES representations into one-hot encoded arrays and viceversa.
-The initial character is "G" and the end character is "E", while the padding character is "A".
+The initial character is "G" and the end character is "E", while the padding character is "A". The character "?" stands
+for the characters that are not in the vocabulary, when they are not skipped.
+The SMILES can either be split into single characters or into atom-level tokens, where bracket atoms ('[nH]',
+'[C@@H]'), two-letter halogens ('Cl', 'Br') and two-digit ring closures ('%10') are a single token.
 """
 
 import numpy as np
 import pickle
+import re
+import itertools
+from collections import Counter
+
+from . import utils
+
+# Bracket atoms, two-letter atoms outside brackets and two-digit ring closures, otherwise single characters
+_atom_pattern = re.compile(r"\[[^\[\]]+\]|Br|Cl|%[0-9]{2}|.", re.DOTALL)
 
 class Molecules_processing():
 
-    def __init__(self):
+    def __init__(self, tokenizer="character", unknown_chars="raise", long_molecules="raise"):
+        """
+        This function initialises the dictionaries of the characters, which are filled by the first molecules encoded or
+        by build_vocabulary.
+
+        :param tokenizer: how to split the SMILES: 'character' for single characters or 'atom' for atom-level tokens
+        :type tokenizer: string
+        :param unknown_chars: what to do with the molecules that contain characters which are not in the vocabulary:
+        'raise' an EncodingError, 'skip' the molecules or replace the characters with the 'unknown' character '?'
+        :type unknown_chars: string
+        :param long_molecules: what to do with the molecules longer than max_size: 'raise' an EncodingError, 'skip' the
+        molecules or 'truncate' them, in which case they have no end character
+        :type long_molecules: string
+        """
+
+        self.tokenizer = utils.set_tokenizer(tokenizer)
+        self.unknown_chars = utils.set_encoding_policy(unknown_chars, ["raise", "skip", "unknown"])
+        self.long_molecules = utils.set_encoding_policy(long_molecules, ["raise", "skip", "truncate"])
+
+        # Indices of the molecules skipped the last time some molecules were encoded
+        self.skipped_idx = np.zeros(0, dtype=np.int64)
 
-        # Dictionaries that map characters and their index
+        # Dictionaries that map characters (or tokens) and their index
         self.idx_to_char = {}
         self.char_to_idx = {}
 
-        # Size of largest molecule
+        # Size of largest molecule, in characters (or tokens)
         self.max_size = 0
 
-    def onehot_encode(self, molecules):
+    def onehot_encode(self, molecules, dtype=np.int16):
         """
-        This function takes the unpadded SMILES strings and returns the padded SMILES in one-hot encoding form.
+        This function takes the unpadded SMILES strings and returns the padded SMILES in one-hot encoding form. The
+        molecules that are skipped (see string_to_int) are not in the output.
 
         :param molecules: unpadded SMILES strings
         :type molecules: list of strings
+        :param dtype: type of the output array, for example np.int16, bool, np.uint8 or np.float32
+        :type dtype: numpy data type
         :return: the one hot encoded molecules
         :rtype: np array of shape (n_samples, max_str_len, n_characters)
         """
@@ -34,99 +68,229 @@ class Molecules_processing():
         # Turn every character into a number
         int_molecules = self.string_to_int(molecules)
 
-        # One-hot encode
-        n_samples = int(int_molecules.shape[0])
+        # One-hot encode all the characters at once, setting the element of each character along the last axis
         n_feat = int(len(self.idx_to_char))
 
-        hot_molecules = np.zeros((n_samples, self.max_size, n_feat), dtype=np.int16)
-
-        for n in range(n_samples):
-            try:
-                input_sequence = np.zeros((self.max_size, n_feat))
-                for j in range(self.max_size):
-                    input_sequence[j][int_molecules[n][j]] = 1
-                hot_molecules[n] = input_sequence
-            except KeyError:
-                print("One of the molecules contains a character that was not present in the first round of training.")
-                exit()
+        hot_molecules = np.zeros(int_molecules.shape + (n_feat,), dtype=dtype)
+        np.put_along_axis(hot_molecules, int_molecules[..., np.newaxis].astype(np.intp), 1, axis=-1)
 
         return hot_molecules
 
     def onehot_decode(self, hot_molecules):
         """
-        This function takes in some one-hot encoded padded SMILES and returns a list of unpadded SMILES strings.
+        This function takes in some one-hot encoded padded SMILES and returns a list of unpadded SMILES strings. The
+        SMILES can also be given as the indices of their characters.
 
-        :param hot_molecules: one-hot encoded SMILES
-        :type hot_molecules: np array of shape (n_samples, max_str_len, n_characters)
+        :param hot_molecules: one-hot encoded SMILES or their character indices
+        :type hot_molecules: np array of shape (n_samples, max_str_len, n_characters) or (n_samples, max_str_len)
         :return: unpadded SMILES strings
         :rtype: list of strings
         """
 
-        molecules = []
+        if len(np.shape(hot_molecules)) == 2:
+            int_molecules = np.asarray(hot_molecules)
+        else:
+            int_molecules = np.argmax(hot_molecules, axis=-1)
 
-        for i in range(len(hot_molecules)):
-            # One hot decodeing each molecule one at a time
-            mol = ''
-            for j in range(len(hot_molecules[i])):
-                mol += self.idx_to_char[np.argmax(hot_molecules[i][j])]
-            # Unpadding
-            try:
-                e_idx = mol.index("E")
-                molecules.append(mol[1:e_idx])
-            except ValueError:
-                molecules.append(mol)
+        n_samples, max_len = int_molecules.shape
+        if n_samples == 0:
+            return []
 
-        return molecules
+        # Table with the bytes of each character, padded with null bytes to the longest character
+        chars = [self.idx_to_char[idx].encode('utf-8') for idx in range(len(self.idx_to_char))]
+        char_table = np.array(chars, dtype='S%i' % max(len(char) for char in chars))
+        byte_molecules = char_table[int_molecules]
 
-    def string_to_int(self, molecules):
+        # Unpadding: the molecules with an end character only keep the characters between 'G' and the first 'E'
+        is_end = (int_molecules == self.char_to_idx['E'])
+        has_end = np.any(is_end, axis=-1)
+        first_end = np.where(has_end, np.argmax(is_end, axis=-1), max_len)
+        positions = np.arange(max_len)
+        keep = ~has_end[:, None] | ((positions[None, :] >= 1) & (positions[None, :] < first_end[:, None]))
+        byte_molecules[~keep] = b''
+
+        # Joining all the molecules in a single string, one per line, and removing the null bytes
+        lines = np.full((n_samples, 1), b'\n', dtype=byte_molecules.dtype)
+        all_bytes = np.concatenate([byte_molecules, lines], axis=-1).tobytes().replace(b'\x00', b'')
+
+        return all_bytes.decode('utf-8').split('\n')[:-1]
+
+    def tokenize(self, molecule):
+        """
+        This function splits a SMILES string into the characters or tokens that are turned into integers.
+
+        :param molecule: unpadded SMILES string
+        :type molecule: string
+        :return: characters or tokens
+        :rtype: list of strings
+        """
+
+        if self.tokenizer == "atom":
+            return _atom_pattern.findall(molecule)
+        else:
+            return list(molecule)
+
+    def build_vocabulary(self, molecules, max_length=None, chunk_size=100000):
         """
-        This function takes in some unpadded SMILES strings and returns the padded SMILES where each character is replaced
-        by an integer.
+        This function finds the characters (or tokens) and the maximum length of the molecules, reading them one chunk
+        at a time, so that the molecules can come from a file larger than the memory (for example through
+        data_streaming.read_smiles). Any previous vocabulary is replaced. The padding character 'A' is always part of
+        the vocabulary, and so is the unknown character '?' when the unknown characters are replaced.
 
         :param molecules: unpadded SMILES strings
-        :type molecules: list of strings
-        :return: numeric molecules
-        :rtype: np array of shape (n_samples, max_str_len)
+        :type molecules: iterable of strings
+        :param max_length: the longest molecules that can be encoded. If None, it is the length of the longest molecule.
+        :type max_length: int or None
+        :param chunk_size: number of molecules processed at the same time
+        :type chunk_size: int
+        :return: number of molecules, number of times each character appears and number of molecules of each length
+        :rtype: dictionary with keys 'n_molecules', 'char_counts' and 'length_counts' (np array indexed by the length)
         """
 
-        # Padding the molecules and finding all the unique characters
-        if self.max_size == 0:
-            self.max_size = len(max(molecules, key=len)) + 2  # Length of longest molecule
+        if not isinstance(max_length, type(None)):
+            utils.check_n_samples(max_length)
+        utils.check_n_samples(chunk_size)
+
+        char_counts = Counter()
+        length_counts = np.zeros(1, dtype=np.int64)
+        molecules = iter(molecules)
+
+        while True:
+            chunk = list(itertools.islice(molecules, chunk_size))
+            if len(chunk) == 0:
+                break
+
+            if self.tokenizer == "atom":
+                tokenized_chunk = [self.tokenize(molecule) for molecule in chunk]
+                char_counts.update(itertools.chain.from_iterable(tokenized_chunk))
+                lengths = [len(tokens) for tokens in tokenized_chunk]
+            else:
+                # Counting the bytes is much faster than counting the characters, non ASCII characters are counted apart
+                try:
+                    byte_counts = np.bincount(np.frombuffer("".join(chunk).encode('ascii'), dtype=np.uint8),
+                                              minlength=256)
+                    char_counts.update({chr(byte): int(count) for byte, count in enumerate(byte_counts) if count > 0})
+                except UnicodeEncodeError:
+                    char_counts.update(itertools.chain.from_iterable(chunk))
+                lengths = [len(molecule) for molecule in chunk]
+
+            chunk_length_counts = np.bincount(lengths)
+            if chunk_length_counts.shape[0] > length_counts.shape[0]:
+                length_counts = np.pad(length_counts, (0, chunk_length_counts.shape[0] - length_counts.shape[0]),
+                                       mode='constant')
+            length_counts[:chunk_length_counts.shape[0]] += chunk_length_counts
+
+        n_molecules = int(np.sum(length_counts))
+        if n_molecules == 0:
+            raise utils.InputError("No molecules were given to build the vocabulary.")
+
+        special_chars = {'G', 'E', 'A', '?'} if self.unknown_chars == "unknown" else {'G', 'E', 'A'}
+        self._set_vocabulary(sorted(set(char_counts) | special_chars))
+
+        if isinstance(max_length, type(None)):
+            max_length = length_counts.shape[0] - 1
+        self.max_size = max_length + 2
+
+        return {"n_molecules": n_molecules, "char_counts": dict(char_counts), "length_counts": length_counts}
 
-        padded_molecules = np.tile(np.array('A'), (len(molecules), self.max_size))  # Molecules padded with G, E and A
+    def string_to_int(self, molecules):
+        """
+        This function takes in some unpadded SMILES strings and returns the padded SMILES where each character (or token)
+        is replaced by an integer. When splitting in characters, all the SMILES are turned into a single array of bytes,
+        which is mapped to the indices of the characters through a table with an entry for each possible byte.
 
-        for i in range(len(molecules)):
-            all_char = ['G'] + list(molecules[i]) + ['E']
-            padded_molecules[i][:len(all_char)] = all_char
+        The molecules with characters that are not in the vocabulary and the molecules longer than max_size are dealt
+        with as chosen when the object was created. The indices of the molecules skipped are stored in skipped_idx.
 
-        # Indices of characters so that they can be translated into numbers
-        all_possible_char = np.unique(padded_molecules)
-        if len(self.char_to_idx) == 0:
-            self.char_to_idx = {char: idx for idx, char in enumerate(all_possible_char)}
-            self.idx_to_char = {idx: char for idx, char in enumerate(all_possible_char)}
+        :param molecules: unpadded SMILES strings
+        :type molecules: list of strings
+        :return: numeric molecules
+        :rtype: np array of shape (n_samples, max_str_len)
+        """
 
-        # Turn characters to int
-        n_samples = padded_molecules.shape[0]
+        n_samples = len(molecules)
 
-        int_molecules = np.zeros((n_samples, self.max_size), dtype=np.int16)
+        if self.tokenizer == "atom":
+            tokenized_molecules = [self.tokenize(molecule) for molecule in molecules]
+            lengths = np.fromiter((len(tokens) for tokens in tokenized_molecules), dtype=np.int64, count=n_samples)
+        else:
+            lengths = np.fromiter((len(molecule) for molecule in molecules), dtype=np.int64, count=n_samples)
 
-        for n in range(n_samples):
-            sample = padded_molecules[n]
-            int_molecules[n] = [self.char_to_idx[char] for char in sample]
+        # Padding the molecules with G, E and A
+        if self.max_size == 0:
+            self.max_size = int(np.max(lengths)) + 2  # Length of longest molecule
+
+        special_chars = ['G', 'E'] + (['A'] if np.any(lengths + 2 < self.max_size) else []) + \
+                        (['?'] if self.unknown_chars == "unknown" else [])
+
+        if self.tokenizer == "atom":
+            int_chars = self._tokens_to_int([token for tokens in tokenized_molecules for token in tokens],
+                                            special_chars)
+        else:
+            int_chars = self._chars_to_int(molecules, special_chars)
+
+        # Molecule and position of each character, after the G character
+        rows = np.repeat(np.arange(n_samples), lengths)
+        starts = np.cumsum(lengths) - lengths
+        columns = np.arange(int_chars.shape[0]) - np.repeat(starts, lengths) + 1
+
+        keep = np.ones(n_samples, dtype=bool)
+
+        too_long = (lengths + 2 > self.max_size)
+        if np.any(too_long):
+            if self.long_molecules == "raise":
+                raise utils.EncodingError("The molecule %s is longer than the longest molecule that can be encoded (%i "
+                                          "tokens)." % (molecules[np.argmax(too_long)], self.max_size - 2))
+            elif self.long_molecules == "skip":
+                keep &= ~too_long
+
+        unknown = (int_chars < 0)
+        if np.any(unknown):
+            if self.unknown_chars == "raise":
+                raise utils.EncodingError("The molecule %s contains characters that are not in the vocabulary." %
+                                          (molecules[rows[np.argmax(unknown)]]))
+            elif self.unknown_chars == "skip":
+                keep[rows[unknown]] = False
+            else:
+                int_chars[unknown] = self.char_to_idx['?']
+
+        self.skipped_idx = np.nonzero(~keep)[0]
+
+        # Only the molecules kept are encoded, and the truncated molecules only up to max_size
+        new_rows = np.cumsum(keep) - 1
+        keep_chars = keep[rows] & (columns < self.max_size)
+        lengths = lengths[keep]
+        needs_padding = np.any(lengths + 2 < self.max_size)
+        if needs_padding and 'A' not in self.char_to_idx:
+            raise utils.EncodingError("The padding character 'A' is not in the vocabulary, since all the molecules used "
+                                      "to build it had the same length.")
+
+        pad_idx = self.char_to_idx['A'] if needs_padding else 0
+        int_molecules = np.full((lengths.shape[0], self.max_size), pad_idx, dtype=np.int16)
+
+        int_molecules[:, 0] = self.char_to_idx['G']
+        int_molecules[new_rows[rows[keep_chars]], columns[keep_chars]] = int_chars[keep_chars]
+        has_end = (lengths + 1 < self.max_size)
+        int_molecules[np.nonzero(has_end)[0], lengths[has_end] + 1] = self.char_to_idx['E']
 
         return int_molecules
 
-    def get_empty(self, n):
+    def get_empty(self, n, one_hot=True):
         """
         This function outputs a one hot encoded G character, to be used by the SMILES generator as the initial character
         to generate a new  SMILES string.
 
         :param n: number of empty one-hot encoded smiles to output
         :type n: int
-        :return: One hot-encoded G character
-        :rtype: numpy array of shape (n, 1, n_char)
+        :param one_hot: whether to one-hot encode the G character or to return its index
+        :type one_hot: bool
+        :return: One hot-encoded G character or its index
+        :rtype: numpy array of shape (n, 1, n_char) or (n, 1)
         """
 
+        if not one_hot:
+            return np.full((n, 1), self.char_to_idx['G'], dtype=np.int16)
+
         empty_smiles = [""]*n
 
         hot_empty = self.onehot_encode(empty_smiles)
@@ -134,6 +298,99 @@ class Molecules_processing():
 
         return trim_hot_empty
 
+    def get_fragments(self, fragments, one_hot=True):
+        """
+        This function one-hot encodes some SMILES fragments of different lengths, starting with the G character, so that
+        they can be completed by the SMILES generator in a single batch.
+
+        :param fragments: unpadded SMILES fragments
+        :type fragments: list of strings
+        :param one_hot: whether to one-hot encode the fragments or to return the indices of their characters
+        :type one_hot: bool
+        :return: One hot-encoded fragments (or their character indices) padded to the longest one, and the number of
+        characters of each fragment. The fragments skipped by the encoding policies are left out (see skipped_idx).
+        :rtype: numpy array of shape (n_fragments, max_fragment_len, n_char) or (n_fragments, max_fragment_len) and numpy
+        array of shape (n_fragments,)
+        """
+
+        if one_hot:
+            encoded_fragments = self.onehot_encode(fragments)
+        else:
+            encoded_fragments = self.string_to_int(fragments)
+
+        # The fragments skipped by the encoding policies are left out, and the truncated ones are only as long as a row
+        fragment_lengths = np.array([len(self.tokenize(fragment)) + 1 for fragment in fragments], dtype=np.int64)
+        fragment_lengths = np.delete(fragment_lengths, self.skipped_idx)
+        fragment_lengths = np.minimum(fragment_lengths, encoded_fragments.shape[1])
+        max_fragment_len = np.max(fragment_lengths) if fragment_lengths.shape[0] > 0 else 1
+
+        return encoded_fragments[:, :max_fragment_len], fragment_lengths
+
+    def _chars_to_int(self, molecules, special_chars):
+        """
+        This function turns the characters of all the molecules into integers through a table indexed by their bytes.
+        If the vocabulary is empty, it is made of all the characters found, sorted.
+
+        :param molecules: unpadded SMILES strings
+        :type molecules: list of strings
+        :param special_chars: the padding characters that are added to the vocabulary
+        :type special_chars: list of strings
+        :return: indices of all the characters, one molecule after the other, -1 for the characters not in the vocabulary
+        :rtype: np array of shape (n_characters,)
+        """
+
+        # Each character that is not ASCII is replaced by a '?', which is never a SMILES character
+        byte_molecules = np.frombuffer("".join(molecules).encode('ascii', errors='replace'), dtype=np.uint8)
+
+        # Finding all the unique characters in a single pass, in the same order as sorting them
+        if len(self.char_to_idx) == 0:
+            is_present = np.bincount(byte_molecules, minlength=256) > 0
+            is_present[ord('?')] = False
+            is_present[[ord(char) for char in special_chars]] = True
+            self._set_vocabulary([chr(byte) for byte in np.nonzero(is_present)[0]])
+
+        char_table = np.full(256, -1, dtype=np.int16)
+        for char, idx in self.char_to_idx.items():
+            if len(char) == 1 and ord(char) < 256 and char != '?':
+                char_table[ord(char)] = idx
+
+        return char_table[byte_molecules]
+
+    def _tokens_to_int(self, tokens, special_chars):
+        """
+        This function turns the tokens of all the molecules into integers, looking up each different token only once.
+        If the vocabulary is empty, it is made of all the tokens found, sorted.
+
+        :param tokens: the tokens of all the molecules, one molecule after the other
+        :type tokens: list of strings
+        :param special_chars: the padding characters that are added to the vocabulary
+        :type special_chars: list of strings
+        :return: indices of all the tokens, -1 for the tokens not in the vocabulary
+        :rtype: np array of shape (n_tokens,)
+        """
+
+        unique_tokens, inverse = np.unique(np.array(tokens, dtype=str), return_inverse=True)
+
+        if len(self.char_to_idx) == 0:
+            self._set_vocabulary(sorted((set(unique_tokens.tolist()) - {'?'}) | set(special_chars)))
+
+        token_table = np.array([self.char_to_idx.get(token, -1) if token != '?' else -1
+                                for token in unique_tokens.tolist()], dtype=np.int16)
+
+        return token_table[inverse]
+
+    def _set_vocabulary(self, all_possible_char):
+        """
+        This function sets the dictionaries that map the characters (or tokens) and their indices.
+
+        :param all_possible_char: all the characters, in the order of their indices
+        :type all_possible_char: list of strings
+        :return: None
+        """
+
+        self.char_to_idx = {char: idx for idx, char in enumerate(all_possible_char)}
+        self.idx_to_char = {idx: char for idx, char in enumerate(all_possible_char)}
+
     def save(self, filename='data_proc.pickle'):
         """
         This function saves the data processing object so it can be used at a later stage.
@@ -143,7 +400,8 @@ class Molecules_processing():
         :return: None
         """
 
-        pickle.dump([self.char_to_idx, self.idx_to_char, self.max_size], open(filename, "wb"))
+        pickle.dump([self.char_to_idx, self.idx_to_char, self.max_size, self.tokenizer, self.unknown_chars,
+                     self.long_molecules], open(filename, "wb"))
 
     def load(self, filename='data_proc.pickle'):
         """
@@ -157,4 +415,8 @@ class Molecules_processing():
         loaded_dictionaries = pickle.load(open(filename, "rb"))
         self.char_to_idx = loaded_dictionaries[0]
         self.idx_to_char = loaded_dictionaries[1]
-        self.max_size = loaded_dictionaries[2]
\ No newline at end of file
+        self.max_size = loaded_dictionaries[2]
+
+        # Files saved before the tokenizer and the encoding policies could be chosen use the defaults
+        settings = list(loaded_dictionaries[3:]) + ["character", "raise", "raise"][len(loaded_dictionaries) - 3:]
+        self.tokenizer, self.unknown_chars, self.long_molecules = settings[:3]
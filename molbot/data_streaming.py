@@ -0,0 +1,394 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This module contains the tools to train the SMILES generator on data sets that are too large to be encoded in memory.
+The SMILES are read from the files one line at a time, shuffled through a buffer of fixed size and encoded one batch at
+a time by a background thread, so that the memory used depends on the batch size and not on the size of the data set.
+"""
+
+import csv
+import io
+import itertools
+import os
+import queue
+import threading
+
+import numpy as np
+
+from . import utils
+from . import sampling
+
+def read_smiles(filenames, smiles_column=0, delimiter=',', header=False):
+    """
+    This function reads the SMILES from one or more CSV files, one line at a time. Empty lines are skipped.
+
+    :param filenames: names of the files that contain the SMILES
+    :type filenames: string or list of strings
+    :param smiles_column: index of the column that contains the SMILES
+    :type smiles_column: int
+    :param delimiter: character that separates the columns
+    :type delimiter: string
+    :param header: whether the first line of each file is a header
+    :type header: bool
+    :return: SMILES strings
+    :rtype: generator of strings
+    """
+
+    if isinstance(filenames, str):
+        filenames = [filenames]
+
+    for filename in filenames:
+        with open(filename, 'r', newline='') as in_file:
+            reader = csv.reader(in_file, delimiter=delimiter)
+            if header:
+                next(reader, None)
+            for smile in _smiles_from_rows(reader, smiles_column):
+                yield smile
+
+def split_file(filename, chunk_bytes, header=False):
+    """
+    This function splits a file in ranges of bytes of about chunk_bytes, which start at the beginning of a line, so that
+    they can be read independently (for example by different processes) with read_smiles_range. The SMILES cannot
+    span several lines.
+
+    :param filename: name of the file that contains the SMILES
+    :type filename: string
+    :param chunk_bytes: approximate number of bytes of each range
+    :type chunk_bytes: int
+    :param header: whether the first line of the file is a header, which is not part of any range
+    :type header: bool
+    :return: first and last byte (excluded) of each range
+    :rtype: list of tuples of two ints
+    """
+
+    utils.check_n_samples(chunk_bytes)
+
+    file_size = os.path.getsize(filename)
+    ranges = []
+
+    with open(filename, 'rb') as in_file:
+        if header:
+            in_file.readline()
+        start = in_file.tell()
+
+        while start < file_size:
+            # Moving the end of the range to the beginning of the next line
+            in_file.seek(min(start + chunk_bytes, file_size) - 1)
+            in_file.readline()
+            end = in_file.tell()
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+def read_smiles_range(filename, start, end, smiles_column=0, delimiter=','):
+    """
+    This function reads the SMILES in a range of bytes of a CSV file, as returned by split_file.
+
+    :param filename: name of the file that contains the SMILES
+    :type filename: string
+    :param start: first byte of the range
+    :type start: int
+    :param end: last byte of the range (excluded)
+    :type end: int
+    :param smiles_column: index of the column that contains the SMILES
+    :type smiles_column: int
+    :param delimiter: character that separates the columns
+    :type delimiter: string
+    :return: SMILES strings
+    :rtype: list of strings
+    """
+
+    with open(filename, 'rb') as in_file:
+        in_file.seek(start)
+        text = in_file.read(end - start).decode('utf-8')
+
+    reader = csv.reader(io.StringIO(text, newline=''), delimiter=delimiter)
+
+    return list(_smiles_from_rows(reader, smiles_column))
+
+def _smiles_from_rows(reader, smiles_column):
+    """
+    This function takes the SMILES from the rows of a CSV file, skipping the empty rows.
+
+    :param reader: the rows of the file
+    :type reader: csv reader
+    :param smiles_column: index of the column that contains the SMILES
+    :type smiles_column: int
+    :return: SMILES strings
+    :rtype: generator of strings
+    """
+
+    for row in reader:
+        if len(row) > smiles_column and row[smiles_column].strip():
+            yield row[smiles_column].strip()
+
+def shuffle_buffer(items, buffer_size, rng):
+    """
+    This function shuffles a stream of items through a buffer of fixed size. Each new item takes the place of a random
+    item of the buffer, which is yielded. The larger the buffer, the closer the order is to a full shuffle.
+
+    :param items: the items to shuffle
+    :type items: iterable
+    :param buffer_size: maximum number of items kept in memory
+    :type buffer_size: int
+    :param rng: random number generator
+    :type rng: numpy.random.Generator
+    :return: the shuffled items
+    :rtype: generator
+    """
+
+    buffer = []
+
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        idx = rng.integers(buffer_size)
+        yield buffer[idx]
+        buffer[idx] = item
+
+    for idx in rng.permutation(len(buffer)):
+        yield buffer[idx]
+
+def encode_batch(molecules, data_handler, one_hot=True, dtype=np.float32):
+    """
+    This function turns a batch of SMILES into the input and output of the SMILES generator. The output is the input
+    shifted by one character to the left, with the padding character 'A' at the end.
+
+    :param molecules: unpadded SMILES strings
+    :type molecules: list of strings
+    :param data_handler: the object that contains the indices of the characters
+    :type data_handler: Molecules_processing object
+    :param one_hot: whether to one-hot encode the batch or to return the indices of the characters
+    :type one_hot: bool
+    :param dtype: type of the one-hot encoded arrays
+    :type dtype: numpy data type
+    :return: input and output of the model
+    :rtype: two numpy arrays of shape (n_samples, max_len, n_char) or (n_samples, max_len)
+    """
+
+    return _inputs_and_outputs(data_handler.string_to_int(molecules), data_handler, one_hot, dtype)
+
+def _inputs_and_outputs(X, data_handler, one_hot=True, dtype=np.float32):
+    """
+    This function makes the input and output of the SMILES generator from some encoded SMILES.
+
+    :param X: character indices of the SMILES
+    :type X: numpy array of shape (n_samples, max_len)
+    :param data_handler: the object that contains the indices of the characters
+    :type data_handler: Molecules_processing object
+    :param one_hot: whether to one-hot encode the batch or to return the indices of the characters
+    :type one_hot: bool
+    :param dtype: type of the one-hot encoded arrays
+    :type dtype: numpy data type
+    :return: input and output of the model
+    :rtype: two numpy arrays of shape (n_samples, max_len, n_char) or (n_samples, max_len)
+    """
+
+    y = np.full(X.shape, data_handler.char_to_idx['A'], dtype=X.dtype)
+    y[:, :-1] = X[:, 1:]
+
+    if one_hot:
+        n_feat = len(data_handler.idx_to_char)
+        return sampling.int_to_onehot(X, n_feat, dtype), sampling.int_to_onehot(y, n_feat, dtype)
+    else:
+        return X, y
+
+class Smiles_stream():
+
+    def __init__(self, filenames, data_handler, batch_size=128, buffer_size=10000, one_hot=True, smiles_column=0,
+                 delimiter=',', header=False, queue_size=10, random_state=None):
+        """
+        This function sets up the stream of batches. The data handler needs to already contain the indices of all the
+        characters and the maximum length of the SMILES, for example because it has been loaded from a file or built
+        with Molecules_processing.build_vocabulary. The SMILES that the data handler skips are left out of the batches.
+
+        :param filenames: names of the files that contain the SMILES
+        :type filenames: string or list of strings
+        :param data_handler: the object used to encode the SMILES
+        :type data_handler: Molecules_processing object
+        :param batch_size: number of SMILES in each batch
+        :type batch_size: int
+        :param buffer_size: number of SMILES kept in the shuffle buffer
+        :type buffer_size: int
+        :param one_hot: whether to one-hot encode the batches or to return the indices of the characters
+        :type one_hot: bool
+        :param smiles_column: index of the column that contains the SMILES
+        :type smiles_column: int
+        :param delimiter: character that separates the columns
+        :type delimiter: string
+        :param header: whether the first line of each file is a header
+        :type header: bool
+        :param queue_size: maximum number of encoded batches waiting to be used
+        :type queue_size: int
+        :param random_state: seed or random number generator used to shuffle the SMILES
+        :type random_state: None, int or numpy.random.Generator
+        """
+
+        if len(data_handler.char_to_idx) == 0 or data_handler.max_size == 0:
+            raise utils.InputError("The data handler needs to know the characters and the maximum length of the SMILES "
+                                   "before the data can be streamed.")
+        utils.check_n_samples(batch_size)
+        utils.check_n_samples(buffer_size)
+        utils.check_n_samples(queue_size)
+
+        self.filenames = [filenames] if isinstance(filenames, str) else list(filenames)
+        self.data_handler = data_handler
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.one_hot = one_hot
+        self.smiles_column = smiles_column
+        self.delimiter = delimiter
+        self.header = header
+        self.queue_size = queue_size
+        self.rng = utils.set_random_state(random_state)
+
+        self._n_samples = None
+
+    def __len__(self):
+        """
+        This function returns the number of batches in one pass over the data set. The files are read and encoded once
+        to count the SMILES the first time it is called.
+
+        :return: number of batches
+        :rtype: int
+        """
+
+        return int(np.ceil(self.n_samples / self.batch_size))
+
+    @property
+    def n_samples(self):
+        """
+        The number of SMILES in the files, leaving out those that the data handler skips.
+        """
+
+        if isinstance(self._n_samples, type(None)):
+            self._n_samples = sum(X.shape[0] for X in self._encode(self._read()))
+
+        return self._n_samples
+
+    @property
+    def n_feat(self):
+        """
+        The number of different characters.
+        """
+
+        return len(self.data_handler.idx_to_char)
+
+    def __iter__(self):
+        """
+        This function yields the batches of the data set, passing over the files again and again as Keras expects. The
+        batches are encoded by a background thread while the previous ones are used for training.
+
+        :return: batches of inputs and outputs of the model
+        :rtype: generator of tuples of two numpy arrays
+        """
+
+        batches = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        worker = threading.Thread(target=self._fill_queue, args=(batches, stop), daemon=True)
+        worker.start()
+
+        try:
+            while True:
+                batch = batches.get()
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+
+    def epoch(self):
+        """
+        This function yields the batches of a single pass over the data set.
+
+        :return: batches of inputs and outputs of the model
+        :rtype: generator of tuples of two numpy arrays
+        """
+
+        batches = iter(self)
+        try:
+            for _ in range(len(self)):
+                yield next(batches)
+        finally:
+            batches.close()
+
+    def _read(self):
+        """
+        This function reads the SMILES from the files.
+
+        :return: SMILES strings
+        :rtype: generator of strings
+        """
+
+        return read_smiles(self.filenames, self.smiles_column, self.delimiter, self.header)
+
+    def _encode(self, molecules):
+        """
+        This function encodes the SMILES batch_size at a time. The SMILES that the data handler skips are left out, so
+        the chunks can be smaller than batch_size.
+
+        :param molecules: SMILES strings
+        :type molecules: iterable of strings
+        :return: character indices of the SMILES
+        :rtype: generator of numpy arrays of shape (n_samples, max_len)
+        """
+
+        molecules = iter(molecules)
+        while True:
+            chunk = list(itertools.islice(molecules, self.batch_size))
+            if len(chunk) == 0:
+                return
+            yield self.data_handler.string_to_int(chunk)
+
+    def _fill_queue(self, batches, stop):
+        """
+        This function is run by the background thread. It shuffles and encodes the SMILES and puts the batches in the
+        queue until it is told to stop. An exception is passed on through the queue, so that it is raised in the training
+        loop.
+
+        :param batches: the queue of encoded batches
+        :type batches: queue.Queue
+        :param stop: event set when the batches are no longer needed
+        :type stop: threading.Event
+        :return: None
+        """
+
+        def put_batch(X):
+            return put(_inputs_and_outputs(X, self.data_handler, self.one_hot))
+
+        def put(item):
+            # Waiting for some space in the queue, but checking regularly whether the batches are still needed
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            while not stop.is_set():
+                # Every pass over the files is a new epoch, with the same number of batches. The batches are made of the
+                # molecules kept by the data handler, so that only the last one of each pass is smaller than batch_size.
+                kept = np.zeros((0, self.data_handler.max_size), dtype=np.int16)
+                n_kept = 0
+                for X in self._encode(shuffle_buffer(self._read(), self.buffer_size, self.rng)):
+                    n_kept += X.shape[0]
+                    kept = np.concatenate([kept, X])
+                    if kept.shape[0] >= self.batch_size:
+                        if not put_batch(kept[:self.batch_size]):
+                            return
+                        kept = kept[self.batch_size:]
+                if kept.shape[0] > 0:
+                    if not put_batch(kept):
+                        return
+                if n_kept == 0:
+                    raise utils.InputError("No SMILES that can be encoded were found in the files %s." %
+                                           (str(self.filenames)))
+        except Exception as error:
+            put(error)
@@ -0,0 +1,187 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This module contains the log-likelihood of SMILES under a model, which is used both to score the episodes with the prior
+and in the loss of the agent during reinforcement learning. The log-probabilities of the characters are summed rather
+than multiplying the probabilities, which underflows for long SMILES, and the characters after the end character 'E'
+are left out. The numpy version only depends on numpy, while the Keras backend is only imported by the tensor version.
+The log-likelihoods under a model that does not change, such as the prior, can be kept in a cache.
+"""
+
+import collections
+
+import numpy as np
+
+from . import utils
+from . import sampling
+
+# Smallest probability of a character, as keras.backend.epsilon(), so that the log-likelihood is always finite
+epsilon = 1e-7
+
+def action_mask(int_sequences, end_idx):
+    """
+    This function finds which characters are part of each SMILES. The first character 'G' is not predicted, so the mask
+    refers to the characters from the second one. The characters after the first 'E' are padding.
+
+    :param int_sequences: character indices
+    :type int_sequences: numpy array of shape (n_samples, max_length)
+    :param end_idx: index of the end character 'E'
+    :type end_idx: int
+    :return: whether each of the characters from the second one is part of the SMILES
+    :rtype: numpy array of bools of shape (n_samples, max_length - 1)
+    """
+
+    # A character is padding if an 'E' comes before it
+    ended = np.cumsum(int_sequences[:, :-1] == end_idx, axis=-1) > 0
+
+    return ~ended
+
+def sequence_loglikelihood(prob, sequences, end_idx):
+    """
+    This function calculates the log-likelihood of a batch of SMILES from the probability distributions that a model
+    predicts for each of their characters.
+
+    :param prob: probability of each character at each step, as predicted by a model taking the sequences as input
+    :type prob: numpy array of shape (n_samples, max_length, n_char)
+    :param sequences: hot-encoded SMILES or their character indices
+    :type sequences: numpy array of shape (n_samples, max_length, n_char) or (n_samples, max_length)
+    :param end_idx: index of the end character 'E'
+    :type end_idx: int
+    :return: log-likelihood of each SMILES
+    :rtype: numpy array of shape (n_samples,)
+    """
+
+    int_sequences = sampling._as_int(sequences)
+
+    # Only the characters up to the longest SMILES of the batch are looked at
+    mask = action_mask(int_sequences, end_idx)
+    n_steps = np.max(np.sum(mask, axis=-1)) if mask.shape[0] > 0 else 0
+    mask = mask[:, :n_steps]
+
+    action_prob = np.take_along_axis(prob[:, :n_steps], int_sequences[:, 1:n_steps+1, np.newaxis].astype(np.intp),
+                                     axis=-1)[..., 0]
+    log_prob = np.log(np.clip(action_prob, epsilon, 1.0))
+
+    return np.sum(np.where(mask, log_prob, 0.0), axis=-1)
+
+def sequence_loglikelihood_tensor(prob, sequences, end_idx):
+    """
+    This function is the Keras backend version of sequence_loglikelihood, to be used in the loss functions.
+
+    :param prob: probability of each character at each step, as predicted by a model taking the sequences as input
+    :type prob: tensor of shape (n_samples, max_length, n_char)
+    :param sequences: hot-encoded SMILES or their character indices
+    :type sequences: tensor of shape (n_samples, max_length, n_char) or (n_samples, max_length)
+    :param end_idx: index of the end character 'E'
+    :type end_idx: int
+    :return: log-likelihood of each SMILES
+    :rtype: tensor of shape (n_samples,)
+    """
+
+    import keras.backend as K
+
+    if K.ndim(sequences) == 2:
+        int_sequences = K.cast(sequences, 'int32')
+    else:
+        int_sequences = K.cast(K.argmax(sequences, axis=-1), 'int32')
+
+    n_char = K.int_shape(prob)[-1]
+    action_prob = K.sum(K.one_hot(int_sequences[:, 1:], n_char) * prob[:, :-1], axis=-1)
+    log_prob = K.log(K.clip(action_prob, K.epsilon(), 1.0))
+
+    # A character is padding if an 'E' comes before it
+    is_end = K.cast(K.equal(int_sequences[:, :-1], end_idx), K.floatx())
+    mask = K.cast(K.equal(K.cumsum(is_end, axis=-1), 0), K.floatx())
+
+    return K.sum(mask * log_prob, axis=-1)
+
+class Loglikelihood_cache():
+
+    def __init__(self, max_size=10000):
+        """
+        This function sets up an empty cache of the log-likelihoods of SMILES under a model that does not change. When
+        the cache is full, the SMILES that have been used least recently are removed.
+
+        :param max_size: maximum number of SMILES in the cache
+        :type max_size: int
+        """
+
+        utils.check_n_samples(max_size)
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._cache = collections.OrderedDict()
+
+    def __len__(self):
+        """
+        This function returns the number of SMILES in the cache.
+
+        :return: number of SMILES
+        :rtype: int
+        """
+
+        return len(self._cache)
+
+    def hit_rate(self):
+        """
+        This function returns the fraction of the SMILES whose log-likelihood did not have to be calculated, because it
+        was in the cache or the same SMILES was earlier in the batch.
+
+        :return: fraction of cache hits, or 0 if the cache has not been used
+        :rtype: float
+        """
+
+        n_total = self.hits + self.misses
+        return self.hits / n_total if n_total > 0 else 0.0
+
+    def loglikelihood(self, sequences, end_idx, score_fn):
+        """
+        This function returns the log-likelihood of a batch of SMILES. The SMILES that are not in the cache are scored
+        together, in a single call of score_fn, and added to the cache. The SMILES are identified by their characters
+        up to the first 'E', so the padding after it does not matter.
+
+        :param sequences: hot-encoded SMILES or their character indices
+        :type sequences: numpy array of shape (n_samples, max_length, n_char) or (n_samples, max_length)
+        :param end_idx: index of the end character 'E'
+        :type end_idx: int
+        :param score_fn: function that takes some of the sequences and returns their log-likelihood
+        :type score_fn: function
+        :return: log-likelihood of each SMILES
+        :rtype: numpy array of shape (n_samples,)
+        """
+
+        int_sequences = sampling._as_int(sequences).astype(np.int32)
+        lengths = np.sum(action_mask(int_sequences, end_idx), axis=-1) + 1
+        keys = [int_sequences[i, :lengths[i]].tobytes() for i in range(int_sequences.shape[0])]
+
+        loglikelihoods = np.zeros(len(keys))
+        missing = collections.OrderedDict()
+        for i, key in enumerate(keys):
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                loglikelihoods[i] = self._cache[key]
+                self.hits += 1
+            elif key in missing:
+                # The same SMILES may appear several times in the batch, but it is only scored once
+                missing[key].append(i)
+                self.hits += 1
+            else:
+                missing[key] = [i]
+                self.misses += 1
+
+        if len(missing) > 0:
+            idx_to_score = np.array([idx[0] for idx in missing.values()])
+            scores = np.asarray(score_fn(sequences[idx_to_score]))
+
+            for (key, idx), score in zip(missing.items(), scores):
+                loglikelihoods[idx] = score
+                self._cache[key] = score
+
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+        return loglikelihoods
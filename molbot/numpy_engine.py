@@ -0,0 +1,345 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This module contains a class that generates SMILES from the weights of a trained Smiles_generator model using only
+numpy. The weights have to be exported first with Smiles_generator.export_weights. Since Keras and Tensorflow are never
+imported, the processes that only need to generate molecules start quickly and use little memory.
+"""
+
+import numpy as np
+import multiprocessing
+
+from . import utils
+from . import sampling
+from . import smiles_grammar
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+def _hard_sigmoid(x):
+    return np.clip(0.2 * x + 0.5, 0.0, 1.0)
+
+def _linear(x):
+    return x
+
+_activations = {'tanh': np.tanh, 'sigmoid': _sigmoid, 'hard_sigmoid': _hard_sigmoid, 'linear': _linear}
+
+# Objects loaded once by each process of the pool used in generate_parallel
+_worker_generator = None
+_worker_data_handler = None
+
+def _init_worker(weights_file, data_handler):
+    global _worker_generator, _worker_data_handler
+    _worker_generator = Numpy_generator(weights_file)
+    _worker_data_handler = data_handler
+
+def _generate_chunk(args):
+    n_samples, seed_sequence, temperature, max_length = args
+    # The chunk is generated as character indices, which are decoded directly without a one-hot array
+    X = _worker_data_handler.get_empty(n_samples, one_hot=False)
+    int_pred = _worker_generator.predict(X, temperature=temperature, max_length=max_length,
+                                         random_state=np.random.default_rng(seed_sequence),
+                                         data_handler=_worker_data_handler)
+    return _worker_data_handler.onehot_decode(int_pred)
+
+def generate_parallel(weights_file, data_handler, n_total, n_workers=None, chunk_size=1000, temperature=1.0,
+                      max_length=200, random_state=None):
+    """
+    This function generates new SMILES strings from scratch using a pool of processes, each of which loads the exported
+    weights once. The molecules are split in chunks of fixed size and each chunk has its own random number generator,
+    derived from random_state. So, for a given random_state, the SMILES returned do not depend on the number of processes.
+    When called from a script, the call has to be inside an ``if __name__ == "__main__":`` block.
+
+    :param weights_file: Name of the file in which the weights have been exported.
+    :type weights_file: string
+    :param data_handler: the object used to one-hot encode the SMILES the model was trained on
+    :type data_handler: Molecules_processing object
+    :param n_total: total number of SMILES to generate
+    :type n_total: int
+    :param n_workers: number of processes. If None, the number of CPUs is used.
+    :type n_workers: int or None
+    :param chunk_size: number of SMILES generated at the same time by a process
+    :type chunk_size: int
+    :param temperature: Temperature factor for the modified softmax
+    :type temperature: float
+    :param max_length: maximum length of a smile string to generate
+    :type max_length: int
+    :param random_state: seed from which the random number generators of the chunks are derived
+    :type random_state: None, int or numpy.random.Generator
+    :return: SMILES strings, in the order of the chunks
+    :rtype: list of strings
+    """
+
+    utils.check_temperature(temperature)
+    utils.check_maxlength(max_length)
+    utils.check_n_samples(n_total)
+    utils.check_n_samples(chunk_size)
+    if isinstance(n_workers, type(None)):
+        n_workers = multiprocessing.cpu_count()
+    utils.check_n_samples(n_workers)
+
+    if isinstance(random_state, np.random.Generator):
+        random_state = int(random_state.integers(2**63))
+    seed_sequences = np.random.SeedSequence(random_state).spawn(utils.ceil(n_total, chunk_size))
+
+    chunks = []
+    for i, seed_sequence in enumerate(seed_sequences):
+        n_samples = min(chunk_size, n_total - i*chunk_size)
+        chunks.append((n_samples, seed_sequence, temperature, max_length))
+
+    # The processes are spawned rather than forked, since the parent process may have initialised Tensorflow
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(n_workers, initializer=_init_worker, initargs=(weights_file, data_handler)) as pool:
+        smiles = []
+        for chunk_smiles in pool.imap(_generate_chunk, chunks):
+            smiles += chunk_smiles
+
+    return smiles
+
+class Numpy_generator():
+
+    def __init__(self, filename=None):
+        """
+        This function initialises the generator and loads the exported weights, if a file is given.
+
+        :param filename: Name of the file in which the weights have been exported.
+        :type filename: string or None
+        """
+
+        self.lstm_weights = []
+
+        if not isinstance(filename, type(None)):
+            self.load(filename)
+
+    def load(self, filename='model.npz'):
+        """
+        This function loads the weights exported from a Smiles_generator model.
+
+        :param filename: Name of the file in which the weights have been exported.
+        :type filename: string
+        :return: None
+        """
+
+        weights = np.load(filename)
+
+        self.lstm_weights = []
+        for i in range(int(weights["n_lstm"])):
+            self.lstm_weights.append({
+                "kernel": weights["lstm_%i_kernel" % i].astype(np.float32),
+                "recurrent_kernel": weights["lstm_%i_recurrent_kernel" % i].astype(np.float32),
+                "bias": weights["lstm_%i_bias" % i].astype(np.float32),
+                "activation": _activations[str(weights["lstm_%i_activation" % i])],
+                "recurrent_activation": _activations[str(weights["lstm_%i_recurrent_activation" % i])]
+            })
+
+        # For models trained on the character indices, looking up the embedding and then multiplying it by the kernel of
+        # the first LSTM is the same as looking up a row of their product
+        if "embeddings" in weights:
+            embeddings = weights["embeddings"].astype(np.float32)
+            self.lstm_weights[0]["kernel"] = np.dot(embeddings, self.lstm_weights[0]["kernel"])
+
+        self.dense_kernel = weights["dense_kernel"].astype(np.float32)
+        self.dense_bias = weights["dense_bias"].astype(np.float32)
+        self.n_feat = self.dense_kernel.shape[-1]
+
+    def predict(self, X, temperature=1.0, max_length=200, random_state=None, data_handler=None, top_k=None,
+                top_p=None, constrained=False, fragment_lengths=None):
+        """
+        This function starts from a hot encoded SMILES and predicts the remaining part of the molecule, in the same way as
+        Smiles_generator.predict. The output can be decoded with Molecules_processing.onehot_decode.
+
+        :param X: hot-encoded SMILES or their character indices
+        :type X: np.array with shape (n_samples, length_smiles, n_char) or (n_samples, length_smiles)
+        :param temperature: Temperature factor for the modified softmax
+        :type temperature: float
+        :param max_length: maximum length of a smile string to generate
+        :type max_length: int
+        :param random_state: seed or random number generator used to sample the characters
+        :type random_state: None, int or numpy.random.Generator
+        :param data_handler: the object used to one-hot encode the SMILES
+        :type data_handler: Molecules_processing object or None
+        :param top_k: if given, only the top_k most likely characters are sampled at each step
+        :type top_k: int or None
+        :param top_p: if given, only the most likely characters with total probability top_p are sampled at each step
+        :type top_p: float or None
+        :param constrained: whether to forbid the characters that would make the SMILES syntactically impossible
+        :type constrained: bool
+        :param fragment_lengths: number of characters of each fragment in X, when they have different lengths (see
+        Molecules_processing.get_fragments)
+        :type fragment_lengths: np.array or list of ints of shape (n_samples,) or None
+        :return: hot-encoded SMILES or their character indices
+        :rtype: np.array of shape (n_samples, length_smiles, n_char) or (n_samples, length_smiles)
+        """
+
+        utils.check_temperature(temperature)
+        utils.check_maxlength(max_length, X)
+        utils.check_top_k(top_k)
+        utils.check_top_p(top_p)
+        utils.check_fragment_lengths(fragment_lengths, X)
+        rng = utils.set_random_state(random_state)
+
+        if isinstance(data_handler, type(None)):
+            end_idx, pad_idx = None, None
+        else:
+            end_idx, pad_idx = data_handler.char_to_idx['E'], data_handler.char_to_idx['A']
+
+        grammar = smiles_grammar.get_grammar(constrained, data_handler)
+
+        step_fn = self._get_step_fn(temperature)
+
+        return sampling.generate(step_fn, self.initial_states(X.shape[0]), X, max_length, rng, end_idx, pad_idx, top_k,
+                                 top_p, grammar, fragment_lengths)
+
+    def generate_iter(self, data_handler, n_total, batch_size=1000, temperature=1.0, max_length=200, random_state=None,
+                      top_k=None, top_p=None, constrained=False):
+        """
+        This function generates new SMILES strings from scratch and yields each of them as soon as it is finished, in the
+        same way as Smiles_generator.generate_iter.
+
+        :param data_handler: the object used to one-hot encode the SMILES the model was trained on
+        :type data_handler: Molecules_processing object
+        :param n_total: total number of SMILES to generate
+        :type n_total: int
+        :param batch_size: number of SMILES generated at the same time
+        :type batch_size: int
+        :param temperature: Temperature factor for the modified softmax
+        :type temperature: float
+        :param max_length: maximum length of a smile string to generate
+        :type max_length: int
+        :param random_state: seed or random number generator used to sample the characters
+        :type random_state: None, int or numpy.random.Generator
+        :param top_k: if given, only the top_k most likely characters are sampled at each step
+        :type top_k: int or None
+        :param top_p: if given, only the most likely characters with total probability top_p are sampled at each step
+        :type top_p: float or None
+        :param constrained: whether to forbid the characters that would make the SMILES syntactically impossible
+        :type constrained: bool
+        :return: SMILES strings
+        :rtype: generator of strings
+        """
+
+        utils.check_temperature(temperature)
+        utils.check_maxlength(max_length)
+        utils.check_n_samples(n_total)
+        utils.check_n_samples(batch_size)
+        utils.check_top_k(top_k)
+        utils.check_top_p(top_p)
+        rng = utils.set_random_state(random_state)
+
+        int_generator = sampling.generate_iter(self._get_step_fn(temperature), self.initial_states,
+                                               data_handler.char_to_idx['G'], data_handler.char_to_idx['E'],
+                                               data_handler.char_to_idx['A'], n_total, batch_size, max_length, rng,
+                                               top_k, top_p, smiles_grammar.get_grammar(constrained, data_handler))
+
+        for int_finished in int_generator:
+            for smile in data_handler.onehot_decode(int_finished):
+                yield smile
+
+    def beam_search(self, X, data_handler, beam_width=10, temperature=1.0, max_length=200):
+        """
+        This function finds the beam_width most likely completions of each fragment in X with a beam search.
+
+        :param X: hot-encoded SMILES fragments or their character indices
+        :type X: np.array with shape (n_samples, length_smiles, n_char) or (n_samples, length_smiles)
+        :param data_handler: the object used to one-hot encode the SMILES
+        :type data_handler: Molecules_processing object
+        :param beam_width: number of completions to find for each fragment, at most the number of characters
+        :type beam_width: int
+        :param temperature: Temperature factor for the modified softmax
+        :type temperature: float
+        :param max_length: maximum length of a smile string to generate
+        :type max_length: int
+        :return: hot-encoded completions, grouped by fragment from the most to the least likely, and their log-likelihoods
+        :rtype: np.array of shape (n_samples*beam_width, max_length, n_char) and np.array of shape (n_samples, beam_width)
+        """
+
+        utils.check_temperature(temperature)
+        utils.check_maxlength(max_length, X)
+        utils.check_beam_width(beam_width, len(data_handler.idx_to_char))
+
+        int_pred, log_likelihood = sampling.beam_search(self._get_step_fn(temperature),
+                                                        self.initial_states(X.shape[0] * beam_width), X, max_length,
+                                                        beam_width, data_handler.char_to_idx['E'],
+                                                        data_handler.char_to_idx['A'])
+        X_pred = int_pred.reshape(-1, max_length)
+        if len(X.shape) == 3:
+            X_pred = sampling.int_to_onehot(X_pred, X.shape[-1])
+
+        return X_pred, log_likelihood
+
+    def initial_states(self, n_samples):
+        """
+        This function returns the states of the LSTMs before any character has been seen.
+
+        :param n_samples: number of sequences
+        :type n_samples: int
+        :return: hidden and cell states of each LSTM
+        :rtype: list of numpy arrays of shape (n_samples, n_hidden)
+        """
+
+        states = []
+        for lstm in self.lstm_weights:
+            n_hidden = lstm["recurrent_kernel"].shape[0]
+            states += [np.zeros((n_samples, n_hidden), dtype=np.float32),
+                       np.zeros((n_samples, n_hidden), dtype=np.float32)]
+
+        return states
+
+    def step(self, int_chars, states, temperature=1.0):
+        """
+        This function feeds one character per sequence to the LSTMs and returns the probability of the next character.
+
+        :param int_chars: indices of the last character of each sequence
+        :type int_chars: numpy array of shape (n_samples,)
+        :param states: hidden and cell states of each LSTM
+        :type states: list of numpy arrays of shape (n_samples, n_hidden)
+        :param temperature: Temperature factor for the modified softmax
+        :type temperature: float
+        :return: probability distribution of the next character and the updated states
+        :rtype: numpy array of shape (n_samples, n_char) and list of numpy arrays
+        """
+
+        new_states = []
+
+        for i, lstm in enumerate(self.lstm_weights):
+            h, c = states[2*i], states[2*i+1]
+
+            # Multiplying a one-hot encoded character by the kernel is the same as taking a row of the kernel
+            if i == 0:
+                z = lstm["kernel"][int_chars]
+            else:
+                z = np.dot(x, lstm["kernel"])
+            z += np.dot(h, lstm["recurrent_kernel"]) + lstm["bias"]
+
+            # The gates are in the Keras order: input, forget, cell, output
+            z_i, z_f, z_c, z_o = np.split(z, 4, axis=-1)
+            c = lstm["recurrent_activation"](z_f) * c + lstm["recurrent_activation"](z_i) * lstm["activation"](z_c)
+            h = lstm["recurrent_activation"](z_o) * lstm["activation"](c)
+
+            new_states += [h, c]
+            x = h
+
+        # Dense layer and softmax with temperature
+        logits = (np.dot(x, self.dense_kernel) + self.dense_bias) / temperature
+        logits -= np.max(logits, axis=-1, keepdims=True)
+        char_prob = np.exp(logits)
+        char_prob /= np.sum(char_prob, axis=-1, keepdims=True)
+
+        return char_prob, new_states
+
+    def _get_step_fn(self, temperature):
+        """
+        This function returns the step function at a given temperature, in the form needed by the sampling module.
+
+        :param temperature: Temperature factor for the modified softmax
+        :type temperature: float
+        :return: step function
+        :rtype: callable
+        """
+
+        def step_fn(int_chars, states):
+            return self.step(int_chars, states, temperature)
+
+        return step_fn
@@ -10,18 +10,24 @@ class.
 import keras.backend as K
 from keras import optimizers
 from keras.models import load_model
-from keras.layers import Activation
-from keras.layers import Lambda
 
 import numpy as np
-import random
+import itertools
+import queue
+import threading
+import time
 
 from . import utils
 from . import data_processing
+from . import sampling
+from . import step_model
+from . import replay_buffer
+from . import likelihood
+from . import batching
 
 class Reinforcement_learning():
 
-    def __init__(self, model_file, data_handler_file, reward_function):
+    def __init__(self, model_file, data_handler_file, reward_function, random_state=None, prior_cache_size=10000):
         """
 
         :param model_file: Name of the file in which the model has been previously saved.
@@ -32,22 +38,46 @@ class Reinforcement_learning():
         function takes as input one-hot encoded smiles strings (i.e. a numpy array of shape (n_samples, max_length, n_char)
         and returns the rewards (a list of length n_valid_smiles of floats) and a list of indices of the invalid smiles.
         :type reward_function: function
+        :param random_state: seed or random number generator used to sample the episodes
+        :type random_state: None, int or numpy.random.Generator
+        :param prior_cache_size: number of SMILES whose log-likelihood under the prior is kept in a cache, so that the
+        prior does not score again the SMILES that the agent generates several times
+        :type prior_cache_size: int
         """
 
+        self.prior_cache = likelihood.Loglikelihood_cache(prior_cache_size)
+
         self._load_model(model_file)
         self._load_data_handler(data_handler_file)
         self.reward_function = reward_function
+        self.rng = utils.set_random_state(random_state)
+
+        # Fraction of the training time spent in each stage
+        self.utilisation = {}
+
+        # Held while the weights of the agent are updated or copied into the step model, which can happen in different
+        # threads in asynchronous mode
+        self._weights_lock = threading.Lock()
 
-    def train(self, epochs=5, n_train_episodes=15, temperature=0.75, sigma=60, rl_learning_rate=0.0005):
+    def train(self, epochs=5, n_train_episodes=15, temperature=0.75, sigma=60, rl_learning_rate=0.0005,
+              batch_size=None, buffer_size=None, priority_exponent=0.0, asynchronous=False, max_staleness=1,
+              queue_size=None):
         """
-        This function fits the model using reinforcement learning.
+        This function fits the model using reinforcement learning. In each epoch, the agent is updated on minibatches of
+        episodes drawn from the experience buffer, until as many episodes as n_train_episodes have been used.
 
+        In asynchronous mode, the episodes are generated and scored by the prior in a background thread, and their
+        rewards are calculated in another one, while the agent is being trained on the previous episodes. The episodes
+        can then come from an agent that is a few epochs older than the one being trained. The fraction of the time
+        spent by each stage is stored in the utilisation attribute. The generation of a new batch of episodes waits for
+        the training, so that at most max_staleness + 1 batches are being prepared at any time and no batch ends up
+        more than max_staleness epochs older than the agent.
 
         :param epochs: number of iterations of RL to do
         :type epochs: int
         :param n_train_episodes: number of training episodes to generate in each epoch
         :type n_train_episodes: int
-        :param temperature: Temperature factor in the softmax
+        :param temperature: Temperature factor in the softmax used to sample the episodes from the agent
         :type temperature: positive float
         :param max_length: maximum length of an episode
         :type max_length: int
@@ -55,6 +85,23 @@ class Reinforcement_learning():
         :type sigma: float
         :param rl_learning_rate: learning rate for optimiser in the reinforcement learning algorithm
         :type rl_learning_rate: positive float
+        :param batch_size: number of episodes in each update of the agent. If None, each epoch makes a single update on
+        n_train_episodes episodes.
+        :type batch_size: int or None
+        :param buffer_size: number of episodes with the largest rewards kept in the experience buffer. If None, it is
+        n_train_episodes.
+        :type buffer_size: int or None
+        :param priority_exponent: how much the episodes with large rewards are favoured when drawing the minibatches
+        (see Replay_buffer.sample). If 0, they are drawn uniformly.
+        :type priority_exponent: non-negative float
+        :param asynchronous: whether to generate and score the next episodes while the agent is being trained
+        :type asynchronous: bool
+        :param max_staleness: in asynchronous mode, maximum number of epochs of training between the generation of some
+        episodes and their use. With 0, the next episodes are only generated once the agent has been updated.
+        :type max_staleness: int
+        :param queue_size: in asynchronous mode, maximum number of batches of episodes waiting between two stages. If
+        None, it is max_staleness + 1, which is the largest number of batches that can be waiting.
+        :type queue_size: int or None
 
         :return: None
         """
@@ -64,28 +111,69 @@ class Reinforcement_learning():
         utils.check_temperature(temperature)
         utils.check_sigma(sigma)
         utils.check_lr(rl_learning_rate)
+        if isinstance(batch_size, type(None)):
+            batch_size = n_train_episodes
+        utils.check_n_samples(batch_size)
+        if isinstance(buffer_size, type(None)):
+            buffer_size = n_train_episodes
+        utils.check_n_samples(buffer_size)
+        utils.check_priority_exponent(priority_exponent)
+        utils.check_staleness(max_staleness)
+        if isinstance(queue_size, type(None)):
+            queue_size = max_staleness + 1
+        utils.check_n_samples(queue_size)
+
+        # The episodes are sampled from the agent with the softmax at the requested temperature
+        if self.agent_step.temperature != temperature:
+            self.agent_step = step_model.Step_model(self.agent, temperature)
 
         # Making the Reinforcement Learning training function
         training_function = self._generate_rl_training_fn(self.agent, sigma, rl_learning_rate)
 
         # The training function takes as arguments: the state, the action and the reward.
-        # These have to be calculated in advance and stored.
-        experience = []
-        rewards = []
+        # These have to be calculated in advance and stored. The buffer has its own random number generator, since
+        # the episodes may be generated in another thread.
+        buffer_rng = utils.set_random_state(int(self.rng.integers(2**31)))
+        experience = replay_buffer.Replay_buffer(buffer_size, random_state=buffer_rng)
+
+        self._n_epochs_trained = 0
+        self._epoch_trained = threading.Condition()
+        self._stage_time = {"generation": 0.0, "reward": 0.0, "training": 0.0}
+        start = time.time()
+
+        # This generates some episodes (i.e. smiles)
+        if asynchronous:
+            episodes = self._rl_episodes_pipeline(n_train_episodes, max_staleness, queue_size)
+        else:
+            episodes = self._rl_episodes_sequential(n_train_episodes)
+
+        try:
+            for ep in range(epochs):
+                hot_pred, sequence_log_likelihood, new_rewards = next(episodes)
+
+                start_stage = time.time()
+                experience.insert(hot_pred, sequence_log_likelihood, new_rewards)
 
-        for ep in range(epochs):
-            # This generates some episodes (i.e. smiles)
-            experience, rewards = self._rl_episodes(self.agent, self.prior, self.dh, n_train_episodes,
-                                                    experience, rewards)
+                for n_used in range(0, n_train_episodes, batch_size):
+                    # Each update is made on a minibatch of different episodes from the experience buffer
+                    states, prior_loglikelihood, reward = experience.sample(min(batch_size, n_train_episodes - n_used),
+                                                                            priority_exponent)
+                    # The padding after the longest SMILES of the minibatch does not change the loss
+                    max_len = np.max(batching.sequence_lengths(states, self.dh.char_to_idx['A']))
+                    states = states[:, :max_len]
 
-            for _ in range(n_train_episodes):
-                # TODO think about removing this loop
-                random_n = random.randint(0, len(experience) - 1)
-                state = experience[random_n][0]
-                prior_loglikelihood = experience[random_n][1]
-                reward = experience[random_n][2]
+                    with self._weights_lock:
+                        training_function([states, prior_loglikelihood, reward])
 
-                training_function([state, prior_loglikelihood, reward])
+                with self._epoch_trained:
+                    self._n_epochs_trained += 1
+                    self._epoch_trained.notify_all()
+                self._stage_time["training"] += time.time() - start_stage
+        finally:
+            episodes.close()
+
+        total_time = time.time() - start
+        self.utilisation = {stage: stage_time / total_time for stage, stage_time in self._stage_time.items()}
 
     def save(self, filename='model.h5'):
         """
@@ -109,6 +197,12 @@ class Reinforcement_learning():
         self.agent = load_model(filename)
         self.prior = load_model(filename)
 
+        # Models with an embedding layer are trained on the indices of the characters rather than their one-hot encoding
+        self._int_input = (len(self.agent.input_shape) == 2)
+
+        # Single step copy of the agent used to generate the episodes, rebuilt by train for other temperatures
+        self.agent_step = step_model.Step_model(self.agent)
+
     def _load_data_handler(self, filename="data_proc.pickle"):
         """
         This function loads the data handler that has been previously saved as a pickle.
@@ -121,25 +215,6 @@ class Reinforcement_learning():
         self.dh = data_processing.Molecules_processing()
         self.dh.load(filename)
 
-    def _modify_model_for_predictions(self, model, temperature):
-        """
-        This function modifies the model for predict time by adding a temperature factor to the softmax activation
-        function.
-
-        :param model: the model to modify
-        :type model: keras model
-        :param temperature: temperature that modifies the softmax
-        :type temperature: float > 0 and <= 1
-        :return: The modified model
-        """
-
-        model.pop()
-        model.pop()
-        model.add(Lambda(lambda x: x / temperature))
-        model.add(Activation('softmax'))
-
-        return model
-
     def _generate_rl_training_fn(self, model_agent, sigma, lr):
         """
         This function extends the model so that Reinforcement Learning can be done.
@@ -155,7 +230,7 @@ class Reinforcement_learning():
         """
 
         # The first argument is the model input
-        hot_encoded_sequence = model_agent.input
+        sequence = model_agent.input
 
         # The probabilities that the agent would assign in each state
         agent_action_prob_placeholder = model_agent.output
@@ -163,11 +238,9 @@ class Reinforcement_learning():
         # The log likelihood of a sequence from a prior
         prior_loglikelihood = K.placeholder(shape=(None,), name="prior_loglikelihood")
 
-        # The log likelihood of a sequence from the agent
-        individual_action_probability = K.sum(hot_encoded_sequence[:, 1:] * agent_action_prob_placeholder[:, :-1],
-                                              axis=-1)
-        agent_likelihood = K.prod(individual_action_probability)
-        agent_loglikelihood = K.log(agent_likelihood)
+        # The log likelihood of each sequence from the agent
+        agent_loglikelihood = likelihood.sequence_loglikelihood_tensor(agent_action_prob_placeholder, sequence,
+                                                                       self.dh.char_to_idx['E'])
 
         # Reward that the sequence has obtained
         reward_placeholder = K.placeholder(shape=(None,), name="reward")
@@ -177,115 +250,204 @@ class Reinforcement_learning():
         desirability = reward_placeholder
         augmented_likelihood = prior_loglikelihood + sigma_k * desirability
 
-        # Loss function
-        loss = K.pow(augmented_likelihood - agent_loglikelihood, 2)
+        # Loss function, averaged over the sequences of the minibatch
+        loss = K.mean(K.pow(augmented_likelihood - agent_loglikelihood, 2))
 
         # Optimiser and updates
         optimiser = optimizers.Adam(lr=lr, clipnorm=3.0)
         updates = optimiser.get_updates(params=model_agent.trainable_weights, loss=loss)
 
-        rl_training_function = K.function(inputs=[hot_encoded_sequence, prior_loglikelihood, reward_placeholder],
+        rl_training_function = K.function(inputs=[sequence, prior_loglikelihood, reward_placeholder],
                                           outputs=[], updates=updates)
 
         return rl_training_function
 
-    def _rl_episodes(self, model_agent, model_prior, data_handler, n_episodes, experience, rewards):
+    def _generate_episodes(self, n_episodes):
         """
-        This function takes generates new SMILES using the agent and then calculates their probability using the prior.
-        It then calculates the reward of the generated SMILES and adds all information to the experience buffer.
-
-        :param model_agent: the model that will be modified by the RL algorithm
-        :type model_agent: Smiles_generator object
-        :param model_prior: the original model
-        :param data_handler: Smiles_generator object
-        :param n_episodes: number of training episodes on which to train
+        This function generates new SMILES using the agent and then calculates their log-likelihood using the prior.
+
+        :param n_episodes: number of SMILES to generate
         :type n_episodes: int
-        :param max_length: maximum length of generated smiles
-        :type max_length: int
-        :param experience: contains the generated hot-encoded smiles, their prior probability and their reward.
-        :type experience: list of tuples with 3 elements each
-        :param rewards: contains the rewards for the generated smiles (Redundant: could be potentially removed)
-        :type rewards: list of floats
-        :return: updated experience and rewards.
+        :return: the generated hot-encoded smiles (or their character indices) and their prior log-likelihood
+        :rtype: tuple of two numpy arrays
         """
 
         # Using the agent network to predict a smile
-        X = data_handler.get_empty(n_episodes*2)
-        hot_pred = self._pred(X=X, model=model_agent, max_length=data_handler.max_size)
-
-        # Calculate the sequence log-likelihood for the prior
-        prior_action_prob = model_prior.predict(hot_pred)
-        individual_action_probability = np.sum(np.multiply(hot_pred[:, 1:], prior_action_prob[:, :-1]), axis=-1)
-        prod_individual_action_prob = np.prod(individual_action_probability, axis=-1)
-        sequence_log_likelihood = np.log(prod_individual_action_prob)
-
-        if np.isnan(np.sum(sequence_log_likelihood)) or np.isinf(np.sum(sequence_log_likelihood)):
-            print("There are NaNs in the predictions.")
-            exit()
-
-        # Calculate the reward for the finished smile
-        smiles_predictions = data_handler.onehot_decode(hot_pred)
-        new_rewards = self.reward_function(smiles_predictions)
-
-        # If the experience buffer is not full, add as many are needed
-        if len(experience) < n_episodes:
-
-            # Sort in order of increaseing reward
-            idx_sorted = np.argsort(new_rewards)
-            hot_pred = hot_pred[idx_sorted]
-            sequence_log_likelihood = sequence_log_likelihood[idx_sorted]
-            new_rewards = np.asarray(new_rewards)[idx_sorted]
-
-            # Append the smiles with largest reward first
-            for n_ep in range(n_episodes-len(experience)):
-                if n_ep+1 > len(new_rewards):
-                    break
-                expanded_hot_pred = np.expand_dims(hot_pred[-(n_ep+1)], axis=0)
-                experience.append((expanded_hot_pred, sequence_log_likelihood[-(n_ep+1)], new_rewards[-(n_ep+1)]))
-                rewards.append(new_rewards[-(n_ep+1)])
-        else:
-            # If the minimum reward is smaller than the reward for the current smile, replace it
-            while min(rewards) < max(new_rewards):
-                idx_to_pop = np.argmin(rewards)
-                idx_to_add = np.argmax(new_rewards)
-                del experience[idx_to_pop]
-                del rewards[idx_to_pop]
-                expanded_hot_pred = np.expand_dims(hot_pred[idx_to_add], axis=0)
-                experience.append((expanded_hot_pred, sequence_log_likelihood[idx_to_add], new_rewards[idx_to_add]))
-                rewards.append(new_rewards[idx_to_add])
-                hot_pred = np.delete(hot_pred, idx_to_add, axis=0)
-                sequence_log_likelihood = np.delete(sequence_log_likelihood, idx_to_add, axis=0)
-                new_rewards = np.delete(new_rewards, idx_to_add, axis=0)
-
-        return experience, rewards
+        X = self.dh.get_empty(n_episodes, one_hot=not self._int_input)
+        hot_pred = self._pred(X=X, model=self.agent_step, max_length=self.dh.max_size)
+
+        # Calculate the sequence log-likelihood for the prior, which only needs to read up to the longest SMILES
+        def prior_loglikelihood(sequences):
+            max_len = np.max(batching.sequence_lengths(sequences, self.dh.char_to_idx['A']))
+            prior_action_prob = self.prior.predict(sequences[:, :max_len])
+            return likelihood.sequence_loglikelihood(prior_action_prob, sequences[:, :max_len],
+                                                     self.dh.char_to_idx['E'])
+
+        # The prior does not change, so only the SMILES that are not in the cache are scored
+        sequence_log_likelihood = self.prior_cache.loglikelihood(hot_pred, self.dh.char_to_idx['E'],
+                                                                 prior_loglikelihood)
+
+        return hot_pred, sequence_log_likelihood
+
+    def _score_episodes(self, hot_pred):
+        """
+        This function calculates the reward of the generated SMILES.
+
+        :param hot_pred: the generated hot-encoded smiles or their character indices
+        :type hot_pred: numpy array of shape (n_samples, max_length, n_char) or (n_samples, max_length)
+        :return: the rewards
+        :rtype: numpy array of shape (n_samples,)
+        """
+
+        smiles_predictions = self.dh.onehot_decode(hot_pred)
+
+        return np.asarray(self.reward_function(smiles_predictions), dtype=np.float32)
+
+    def _rl_episodes_sequential(self, n_episodes):
+        """
+        This function generates batches of episodes, each when it is needed. Twice as many episodes as the number of
+        training episodes are generated, and the experience buffer keeps those with the largest rewards.
+
+        :param n_episodes: number of training episodes
+        :type n_episodes: int
+        :return: the generated hot-encoded smiles, their prior log-likelihood and their rewards
+        :rtype: generator of tuples of three numpy arrays
+        """
+
+        while True:
+            start_stage = time.time()
+            hot_pred, sequence_log_likelihood = self._generate_episodes(n_episodes*2)
+            self._stage_time["generation"] += time.time() - start_stage
+
+            start_stage = time.time()
+            new_rewards = self._score_episodes(hot_pred)
+            self._stage_time["reward"] += time.time() - start_stage
+
+            yield hot_pred, sequence_log_likelihood, new_rewards
+
+    def _rl_episodes_pipeline(self, n_episodes, max_staleness, queue_size):
+        """
+        This function generates batches of episodes in the background. One thread generates the episodes and scores them
+        with the prior, and another calculates their rewards, while the agent is trained in the main thread. The stages
+        are connected by bounded queues, and an exception in a stage is passed on through them, so that it is raised in
+        the training loop. The batch used in epoch i is only generated once the agent has been trained for
+        i - max_staleness epochs, so the batches are never too old when they are used.
+
+        :param n_episodes: number of training episodes
+        :type n_episodes: int
+        :param max_staleness: maximum number of epochs of training between the generation of some episodes and their use
+        :type max_staleness: int
+        :param queue_size: maximum number of batches of episodes waiting between two stages
+        :type queue_size: int
+        :return: the generated hot-encoded smiles, their prior log-likelihood and their rewards
+        :rtype: generator of tuples of three numpy arrays
+        """
+
+        # The Keras models are used from other threads, which need the same graph and session as the main thread
+        session = K.get_session()
+        graph = session.graph
+        self.prior._make_predict_function()
+        self.agent_step.step_model._make_predict_function()
+
+        generated = queue.Queue(maxsize=queue_size)
+        scored = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+
+        def put(items, item):
+            # Waiting for some space in the queue, but checking regularly whether the episodes are still needed
+            while not stop.is_set():
+                try:
+                    items.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(items):
+            while not stop.is_set():
+                try:
+                    return items.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return None
+
+        def wait_for_training(n_batch):
+            # Waiting until the batch would not be too old when used, but checking regularly whether it is still needed
+            with self._epoch_trained:
+                while self._n_epochs_trained < n_batch - max_staleness:
+                    if stop.is_set():
+                        return False
+                    self._epoch_trained.wait(timeout=0.1)
+            return not stop.is_set()
+
+        def generation_stage():
+            try:
+                with session.as_default(), graph.as_default():
+                    for n_batch in itertools.count():
+                        if not wait_for_training(n_batch):
+                            return
+                        start_stage = time.time()
+                        hot_pred, sequence_log_likelihood = self._generate_episodes(n_episodes*2)
+                        self._stage_time["generation"] += time.time() - start_stage
+                        if not put(generated, (hot_pred, sequence_log_likelihood)):
+                            return
+            except Exception as error:
+                put(generated, error)
+
+        def reward_stage():
+            try:
+                while not stop.is_set():
+                    item = get(generated)
+                    if isinstance(item, type(None)):
+                        return
+                    if isinstance(item, Exception):
+                        put(scored, item)
+                        return
+                    hot_pred, sequence_log_likelihood = item
+                    start_stage = time.time()
+                    new_rewards = self._score_episodes(hot_pred)
+                    self._stage_time["reward"] += time.time() - start_stage
+                    if not put(scored, (hot_pred, sequence_log_likelihood, new_rewards)):
+                        return
+            except Exception as error:
+                put(scored, error)
+
+        workers = [threading.Thread(target=generation_stage, daemon=True),
+                   threading.Thread(target=reward_stage, daemon=True)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            while True:
+                item = scored.get()
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
 
     def _pred(self, X, model, max_length):
         """
         This function predicts one-hot encoded smiles strings starting from a fragment.
 
-        :param X: One-hot encoded fragment of smile string
-        :type X: numpy array of shape (n_samples, n_char, n_feat)
-        :param model: the RNN keras model to use for prediction
-        :type model: object from Smiles_generator class
+        :param X: One-hot encoded fragment of smile string, or its character indices
+        :type X: numpy array of shape (n_samples, n_char, n_feat) or (n_samples, n_char)
+        :param model: the single step copy of the RNN keras model to use for prediction
+        :type model: object from Step_model class
         :param max_length: maximum length of predicted molecules
         :type max_length: int
-        :return: predicted one-hot encoded smiles strings
-        :rtype: numpy array of shape (n_samples, max_n_char, n_feat)
+        :return: predicted one-hot encoded smiles strings, or their character indices
+        :rtype: numpy array of shape (n_samples, max_n_char, n_feat) or (n_samples, max_n_char)
         """
 
-        n_feat = X.shape[-1]
-        n_samples = X.shape[0]
-
-        # Predictions
-        X_pred = np.zeros((n_samples, max_length, n_feat))
-        X_pred[:, :X.shape[1], :] = X
-
-        for i in range(1, max_length):
-            prob_distribution = model.predict(X_pred[:, :i, :])
+        # The agent has been updated since the last episodes were generated. In asynchronous mode, the main thread may be
+        # updating the weights at the same time, so the lock makes sure that they are copied between two updates.
+        with self._weights_lock:
+            model.sync_weights()
 
-            # Slow step
-            for j in range(n_samples):
-                idx_out = np.random.choice(np.arange(n_feat), p=prob_distribution[j, -1])
-                X_pred[j, i, idx_out] = 1
+        X_pred = sampling.generate(model, model.initial_states(X.shape[0]), X, max_length, self.rng,
+                                   end_idx=self.dh.char_to_idx['E'], pad_idx=self.dh.char_to_idx['A'])
 
-        return X_pred
\ No newline at end of file
+        return X_pred
@@ -0,0 +1,124 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This module contains the experience buffer used in reinforcement learning. It keeps the episodes with the largest
+rewards in preallocated arrays, so that adding a batch of episodes and sampling a minibatch only take a few vectorised
+operations, even for buffers of tens of thousands of episodes.
+"""
+
+import numpy as np
+
+from . import utils
+
+class Replay_buffer():
+
+    def __init__(self, max_size, random_state=None):
+        """
+        This function sets up an empty buffer. The arrays are allocated when the first episodes are added, since the
+        shape of the sequences is not known before.
+
+        :param max_size: maximum number of episodes kept in the buffer
+        :type max_size: int
+        :param random_state: seed or random number generator used to sample the episodes
+        :type random_state: None, int or numpy.random.Generator
+        """
+
+        utils.check_n_samples(max_size)
+
+        self.max_size = max_size
+        self.rng = utils.set_random_state(random_state)
+        self.n_stored = 0
+
+        self.sequences = None
+        self.prior_loglikelihoods = np.zeros(max_size, dtype=np.float32)
+        self.rewards = np.zeros(max_size, dtype=np.float32)
+
+    def __len__(self):
+        """
+        This function returns the number of episodes in the buffer.
+
+        :return: number of episodes
+        :rtype: int
+        """
+
+        return self.n_stored
+
+    def insert(self, sequences, prior_loglikelihoods, rewards):
+        """
+        This function adds a batch of episodes to the buffer. When the buffer is full, the episodes with the largest
+        rewards among the stored and the new ones are kept, and the new episodes take the place of the discarded ones.
+
+        :param sequences: hot-encoded SMILES or their character indices
+        :type sequences: numpy array of shape (n_samples, max_length, n_char) or (n_samples, max_length)
+        :param prior_loglikelihoods: log-likelihood of each sequence according to the prior
+        :type prior_loglikelihoods: numpy array of shape (n_samples,)
+        :param rewards: reward of each sequence
+        :type rewards: numpy array of shape (n_samples,) or list of floats
+        :return: None
+        """
+
+        prior_loglikelihoods = np.asarray(prior_loglikelihoods, dtype=np.float32)
+        rewards = np.asarray(rewards, dtype=np.float32)
+        if not (sequences.shape[0] == prior_loglikelihoods.shape[0] == rewards.shape[0]):
+            raise utils.InputError("There should be one prior log-likelihood and one reward for each sequence. Got %s "
+                                   "sequences, %s log-likelihoods and %s rewards." % (str(sequences.shape[0]),
+                                   str(prior_loglikelihoods.shape[0]), str(rewards.shape[0])))
+
+        if isinstance(self.sequences, type(None)):
+            self.sequences = np.zeros((self.max_size,) + sequences.shape[1:], dtype=sequences.dtype)
+        elif sequences.shape[1:] != self.sequences.shape[1:]:
+            raise utils.InputError("The sequences should have shape %s. Got %s." % (str(self.sequences.shape[1:]),
+                                                                                   str(sequences.shape[1:])))
+
+        # Finding the episodes to keep among the stored and the new ones, without sorting them all
+        all_rewards = np.concatenate([self.rewards[:self.n_stored], rewards])
+        if all_rewards.shape[0] > self.max_size:
+            keep = np.argpartition(-all_rewards, self.max_size - 1)[:self.max_size]
+        else:
+            keep = np.arange(all_rewards.shape[0])
+
+        new_kept = keep[keep >= self.n_stored] - self.n_stored
+        free_slots = np.ones(self.max_size, dtype=bool)
+        free_slots[keep[keep < self.n_stored]] = False
+        slots = np.flatnonzero(free_slots)[:new_kept.shape[0]]
+
+        self.sequences[slots] = sequences[new_kept]
+        self.prior_loglikelihoods[slots] = prior_loglikelihoods[new_kept]
+        self.rewards[slots] = rewards[new_kept]
+        self.n_stored = keep.shape[0]
+
+    def sample(self, n_samples, priority_exponent=0.0):
+        """
+        This function draws a minibatch of different episodes from the buffer. With a priority exponent larger than
+        zero, the episodes are drawn with a probability proportional to (1/rank)**priority_exponent, where the episode
+        with the largest reward has rank 1.
+
+        :param n_samples: number of episodes. It is clipped to the number of episodes in the buffer.
+        :type n_samples: int
+        :param priority_exponent: how much the episodes with large rewards are favoured. If 0, the episodes are drawn
+        uniformly.
+        :type priority_exponent: non-negative float
+        :return: sequences, prior log-likelihoods and rewards of the episodes
+        :rtype: tuple of three numpy arrays
+        """
+
+        utils.check_n_samples(n_samples)
+        utils.check_priority_exponent(priority_exponent)
+        if self.n_stored == 0:
+            raise utils.InputError("The buffer does not contain any episodes yet.")
+
+        n_samples = min(n_samples, self.n_stored)
+
+        if priority_exponent == 0:
+            probabilities = None
+        else:
+            ranks = np.empty(self.n_stored)
+            ranks[np.argsort(-self.rewards[:self.n_stored], kind='stable')] = np.arange(1, self.n_stored + 1)
+            priorities = ranks ** (-priority_exponent)
+            probabilities = priorities / np.sum(priorities)
+
+        idx = self.rng.choice(self.n_stored, size=n_samples, replace=False, p=probabilities)
+
+        return self.sequences[idx], self.prior_loglikelihoods[idx], self.rewards[idx]
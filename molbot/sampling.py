@@ -0,0 +1,377 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This module contains the functions that generate SMILES one character at a time from a model that carries its hidden
+states forward. It only depends on numpy, so that the same generation loop can be used with any model that provides a
+step function.
+
+A step function takes the indices of the last characters of each sequence (a numpy array of shape (n_samples,)) and a
+list of states, and returns the probability distribution of the next character (a numpy array of shape
+(n_samples, n_char)) and the updated list of states.
+"""
+
+import numpy as np
+
+def onehot_to_int(hot_sequences):
+    """
+    This function turns one-hot encoded sequences into sequences of character indices.
+
+    :param hot_sequences: one-hot encoded sequences
+    :type hot_sequences: numpy array of shape (n_samples, length, n_char)
+    :return: character indices
+    :rtype: numpy array of shape (n_samples, length)
+    """
+
+    return np.argmax(hot_sequences, axis=-1)
+
+def int_to_onehot(int_sequences, n_feat, dtype=np.float64):
+    """
+    This function turns sequences of character indices into one-hot encoded sequences.
+
+    :param int_sequences: character indices
+    :type int_sequences: numpy array of shape (n_samples, length)
+    :param n_feat: number of possible characters
+    :type n_feat: int
+    :param dtype: type of the output array
+    :type dtype: numpy dtype
+    :return: one-hot encoded sequences
+    :rtype: numpy array of shape (n_samples, length, n_feat)
+    """
+
+    n_samples, length = int_sequences.shape
+    hot_sequences = np.zeros((n_samples, length, n_feat), dtype=dtype)
+    hot_sequences[np.arange(n_samples)[:, None], np.arange(length)[None, :], int_sequences] = 1
+
+    return hot_sequences
+
+def _as_int(X):
+    """
+    This function returns the character indices of sequences that are either one-hot encoded or already indices.
+    """
+
+    if len(X.shape) == 2:
+        return X
+    return onehot_to_int(X)
+
+def sample_categorical(prob_distribution, rng):
+    """
+    This function samples one character for every sequence in the batch at once. It draws one uniform random number per
+    sequence and finds where it falls in the cumulative distribution of that sequence.
+
+    :param prob_distribution: probability of each character for each sequence
+    :type prob_distribution: numpy array of shape (n_samples, n_char)
+    :param rng: random number generator
+    :type rng: numpy.random.Generator
+    :return: indices of the sampled characters
+    :rtype: numpy array of shape (n_samples,)
+    """
+
+    cumulative_prob = np.cumsum(prob_distribution, axis=-1)
+
+    # Scaling by the total takes care of distributions that do not exactly sum to 1
+    random_draw = rng.random(prob_distribution.shape[0]) * cumulative_prob[:, -1]
+    idx_out = np.sum(cumulative_prob <= random_draw[:, None], axis=-1)
+
+    return np.minimum(idx_out, prob_distribution.shape[-1] - 1)
+
+def top_k_filter(prob_distribution, top_k):
+    """
+    This function keeps only the top_k most likely characters of each sequence and renormalises their probabilities.
+
+    :param prob_distribution: probability of each character for each sequence
+    :type prob_distribution: numpy array of shape (n_samples, n_char)
+    :param top_k: number of characters to keep
+    :type top_k: int
+    :return: filtered probability distribution
+    :rtype: numpy array of shape (n_samples, n_char)
+    """
+
+    if top_k >= prob_distribution.shape[-1]:
+        return prob_distribution
+
+    # Probability of the k-th most likely character of each sequence
+    threshold = -np.partition(-prob_distribution, top_k - 1, axis=-1)[:, top_k - 1]
+    filtered_prob = np.where(prob_distribution >= threshold[:, None], prob_distribution, 0)
+
+    return filtered_prob / np.sum(filtered_prob, axis=-1, keepdims=True)
+
+def nucleus_filter(prob_distribution, top_p):
+    """
+    This function keeps, for each sequence, the smallest set of most likely characters whose total probability is at
+    least top_p (nucleus sampling) and renormalises their probabilities.
+
+    :param prob_distribution: probability of each character for each sequence
+    :type prob_distribution: numpy array of shape (n_samples, n_char)
+    :param top_p: minimum total probability of the characters kept
+    :type top_p: float > 0 and <= 1
+    :return: filtered probability distribution
+    :rtype: numpy array of shape (n_samples, n_char)
+    """
+
+    idx_sorted = np.argsort(-prob_distribution, axis=-1)
+    sorted_prob = np.take_along_axis(prob_distribution, idx_sorted, axis=-1)
+
+    # A character is kept if the characters more likely than it do not reach top_p yet
+    cumulative_prob = np.cumsum(sorted_prob, axis=-1)
+    keep_sorted = (cumulative_prob - sorted_prob) < top_p
+
+    keep = np.zeros(prob_distribution.shape, dtype=bool)
+    np.put_along_axis(keep, idx_sorted, keep_sorted, axis=-1)
+    filtered_prob = np.where(keep, prob_distribution, 0)
+
+    return filtered_prob / np.sum(filtered_prob, axis=-1, keepdims=True)
+
+def _filter_distribution(prob_distribution, top_k, top_p):
+    if not isinstance(top_k, type(None)):
+        prob_distribution = top_k_filter(prob_distribution, top_k)
+    if not isinstance(top_p, type(None)):
+        prob_distribution = nucleus_filter(prob_distribution, top_p)
+    return prob_distribution
+
+def generate(step_fn, states, X, max_length, rng, end_idx=None, pad_idx=None, top_k=None, top_p=None, grammar=None,
+             fragment_lengths=None):
+    """
+    This function predicts one-hot encoded smiles strings starting from a fragment, by feeding one character at a time
+    to the step function. The characters of the fragment are fed first, so that the states of the model are those of
+    the whole fragment when the sampling starts. The fragments can have different lengths: each sequence starts being
+    sampled after the end of its own fragment.
+
+    If the index of the end character is given, the sequences that have generated it are removed from the batch that is
+    fed to the step function and their remaining positions are filled with the padding character. The generation stops
+    as soon as all the sequences have finished.
+
+    :param step_fn: function that predicts the probability of the next character and updates the states
+    :type step_fn: callable
+    :param states: initial states of the model
+    :type states: list of numpy arrays
+    :param X: One-hot encoded fragment of smile string, or the indices of its characters
+    :type X: numpy array of shape (n_samples, length_fragment, n_char) or (n_samples, length_fragment)
+    :param max_length: maximum length of predicted molecules
+    :type max_length: int
+    :param rng: random number generator
+    :type rng: numpy.random.Generator
+    :param end_idx: index of the end character 'E'. If None, all sequences are generated up to max_length.
+    :type end_idx: int or None
+    :param pad_idx: index of the padding character 'A', used after the end character
+    :type pad_idx: int or None
+    :param top_k: if given, only the top_k most likely characters are sampled at each step
+    :type top_k: int or None
+    :param top_p: if given, only the most likely characters with total probability top_p are sampled at each step
+    :type top_p: float or None
+    :param grammar: if given, the characters that would make the SMILES syntactically impossible are not sampled
+    :type grammar: Smiles_grammar object or None
+    :param fragment_lengths: number of characters of each fragment (including 'G'). If None, all the characters of X
+    are used for all the sequences.
+    :type fragment_lengths: numpy array or list of ints of shape (n_samples,) or None
+    :return: predicted smiles strings, in the same format as X
+    :rtype: numpy array of shape (n_samples, max_length, n_char) or (n_samples, max_length)
+    """
+
+    n_samples, n_frag = X.shape[:2]
+
+    if isinstance(fragment_lengths, type(None)):
+        fragment_lengths = np.full(n_samples, n_frag)
+    else:
+        fragment_lengths = np.asarray(fragment_lengths, dtype=int)
+
+    int_pred = np.zeros((n_samples, max_length), dtype=np.int32)
+    int_pred[:, :n_frag] = _as_int(X)
+    if not isinstance(pad_idx, type(None)):
+        int_pred[np.arange(max_length)[None, :] >= fragment_lengths[:, None]] = pad_idx
+
+    # Indices of the sequences that have not generated the end character yet
+    active = np.arange(n_samples)
+
+    if not isinstance(grammar, type(None)):
+        grammar.start(n_samples)
+
+    for i in range(1, max_length):
+        prob_distribution, states = step_fn(int_pred[active, i-1], states)
+
+        if not isinstance(grammar, type(None)):
+            grammar.update(active, int_pred[active, i-1])
+
+        # The characters of the fragments are already known
+        sampled = fragment_lengths[active] <= i
+        if not np.any(sampled):
+            continue
+        rows = active[sampled]
+        prob_distribution = prob_distribution[sampled]
+
+        if not isinstance(grammar, type(None)):
+            prob_distribution = grammar.apply(prob_distribution, rows)
+        prob_distribution = _filter_distribution(prob_distribution, top_k, top_p)
+        int_pred[rows, i] = sample_categorical(prob_distribution, rng)
+
+        if not isinstance(end_idx, type(None)):
+            still_active = ~sampled | (int_pred[active, i] != end_idx)
+            if not np.all(still_active):
+                active = active[still_active]
+                states = [state[still_active] for state in states]
+            if active.shape[0] == 0:
+                break
+
+    if len(X.shape) == 2:
+        return int_pred
+    return int_to_onehot(int_pred, X.shape[-1])
+
+def generate_iter(step_fn, initial_states, start_idx, end_idx, pad_idx, n_total, batch_size, max_length, rng,
+                  top_k=None, top_p=None, grammar=None):
+    """
+    This function generates sequences starting from the start character 'G' and yields them as soon as they finish.
+    When a sequence finishes, its place in the batch is taken by a new sequence (and its states are reset), so that the
+    batch fed to the step function stays full until fewer than batch_size sequences are left to generate.
+
+    :param step_fn: function that predicts the probability of the next character and updates the states
+    :type step_fn: callable
+    :param initial_states: function that returns the states of the model for a given number of new sequences
+    :type initial_states: callable
+    :param start_idx: index of the start character 'G'
+    :type start_idx: int
+    :param end_idx: index of the end character 'E'
+    :type end_idx: int
+    :param pad_idx: index of the padding character 'A'
+    :type pad_idx: int
+    :param n_total: total number of sequences to generate
+    :type n_total: int
+    :param batch_size: number of sequences fed to the step function at once
+    :type batch_size: int
+    :param max_length: maximum length of the sequences
+    :type max_length: int
+    :param rng: random number generator
+    :type rng: numpy.random.Generator
+    :param top_k: if given, only the top_k most likely characters are sampled at each step
+    :type top_k: int or None
+    :param top_p: if given, only the most likely characters with total probability top_p are sampled at each step
+    :type top_p: float or None
+    :param grammar: if given, the characters that would make the SMILES syntactically impossible are not sampled
+    :type grammar: Smiles_grammar object or None
+    :return: the character indices of the sequences that finished at each step, padded to max_length
+    :rtype: generator of numpy arrays of shape (n_finished, max_length)
+    """
+
+    n_batch = min(batch_size, n_total)
+
+    sequences = np.full((n_batch, max_length), pad_idx, dtype=np.int32)
+    sequences[:, 0] = start_idx
+    lengths = np.ones(n_batch, dtype=np.int32)
+
+    # The rows of the states correspond to the slots of the batch that are still in use
+    slots = np.arange(n_batch)
+    states = initial_states(n_batch)
+    fresh_states = initial_states(1)
+    n_started = n_batch
+
+    if not isinstance(grammar, type(None)):
+        grammar.start(n_batch)
+
+    while slots.shape[0] > 0:
+        prob_distribution, states = step_fn(sequences[slots, lengths[slots]-1], states)
+
+        if not isinstance(grammar, type(None)):
+            grammar.update(slots, sequences[slots, lengths[slots]-1])
+            prob_distribution = grammar.apply(prob_distribution, slots)
+        prob_distribution = _filter_distribution(prob_distribution, top_k, top_p)
+        int_chars = sample_categorical(prob_distribution, rng)
+        sequences[slots, lengths[slots]] = int_chars
+        lengths[slots] += 1
+
+        finished = np.flatnonzero((int_chars == end_idx) | (lengths[slots] == max_length))
+        if finished.shape[0] == 0:
+            continue
+
+        yield sequences[slots[finished]].copy()
+
+        # Refilling the slots of the finished sequences with new 'G' characters while there are some left to generate
+        n_refill = min(finished.shape[0], n_total - n_started)
+        n_started += n_refill
+        refill, drop = finished[:n_refill], finished[n_refill:]
+
+        sequences[slots[refill]] = pad_idx
+        sequences[slots[refill], 0] = start_idx
+        lengths[slots[refill]] = 1
+        if not isinstance(grammar, type(None)):
+            grammar.restart(slots[refill])
+        for state, fresh_state in zip(states, fresh_states):
+            state[refill] = fresh_state[0]
+
+        if drop.shape[0] > 0:
+            keep = np.ones(slots.shape[0], dtype=bool)
+            keep[drop] = False
+            slots = slots[keep]
+            states = [state[keep] for state in states]
+
+def beam_search(step_fn, states, X, max_length, beam_width, end_idx, pad_idx):
+    """
+    This function finds the beam_width most likely completions of each fragment with a beam search. All the beams of all
+    the fragments are fed to the step function as a single batch. Beams that have generated the end character are padded
+    and keep their log-likelihood, so that they compete with the unfinished ones until the end.
+
+    :param step_fn: function that predicts the probability of the next character and updates the states
+    :type step_fn: callable
+    :param states: initial states of the model for n_samples * beam_width sequences
+    :type states: list of numpy arrays
+    :param X: One-hot encoded fragment of smile string, or the indices of its characters
+    :type X: numpy array of shape (n_samples, length_fragment, n_char) or (n_samples, length_fragment)
+    :param max_length: maximum length of predicted molecules
+    :type max_length: int
+    :param beam_width: number of completions kept for each fragment
+    :type beam_width: int
+    :param end_idx: index of the end character 'E'
+    :type end_idx: int
+    :param pad_idx: index of the padding character 'A'
+    :type pad_idx: int
+    :return: the completions of each fragment, from the most to the least likely, and their log-likelihoods
+    :rtype: numpy array of shape (n_samples, beam_width, max_length) and numpy array of shape (n_samples, beam_width)
+    """
+
+    n_samples, n_frag = X.shape[:2]
+    n_beams = n_samples * beam_width
+
+    int_pred = np.full((n_beams, max_length), pad_idx, dtype=np.int32)
+    int_pred[:, :n_frag] = np.repeat(_as_int(X), beam_width, axis=0)
+
+    # Only the first copy of each fragment is a real beam at the start, so that the beams found are all different
+    log_likelihood = np.full((n_samples, beam_width), -np.inf)
+    log_likelihood[:, 0] = 0
+    finished = np.zeros(n_beams, dtype=bool)
+
+    for i in range(1, max_length):
+        prob_distribution, states = step_fn(int_pred[:, i-1], states)
+
+        if i < n_frag:
+            continue
+
+        n_feat = prob_distribution.shape[-1]
+        with np.errstate(divide='ignore'):
+            log_prob = np.log(prob_distribution)
+
+        # Log-probability of continuing a finished beam: only padding is allowed and it does not change the likelihood
+        log_prob[finished] = -np.inf
+        log_prob[finished, pad_idx] = 0
+
+        # Likelihood of all the possible extensions of all the beams of each fragment
+        candidates = (log_likelihood[:, :, None] + log_prob.reshape(n_samples, beam_width, n_feat))
+        candidates = candidates.reshape(n_samples, beam_width * n_feat)
+
+        idx_best = np.argpartition(-candidates, beam_width - 1, axis=-1)[:, :beam_width]
+        best_candidates = np.take_along_axis(candidates, idx_best, axis=-1)
+        idx_order = np.argsort(-best_candidates, axis=-1)
+        idx_best = np.take_along_axis(idx_best, idx_order, axis=-1)
+        log_likelihood = np.take_along_axis(best_candidates, idx_order, axis=-1)
+
+        # Index of the beam that each new beam extends, in the batch of all the beams
+        idx_parent = (np.arange(n_samples)[:, None] * beam_width + idx_best // n_feat).ravel()
+        int_chars = (idx_best % n_feat).ravel()
+
+        int_pred = int_pred[idx_parent]
+        int_pred[:, i] = int_chars
+        states = [state[idx_parent] for state in states]
+        finished = finished[idx_parent] | (int_chars == end_idx)
+
+        if np.all(finished):
+            break
+
+    return int_pred.reshape(n_samples, beam_width, max_length), log_likelihood
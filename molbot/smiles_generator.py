@@ -6,10 +6,13 @@
 This module contains the class for the RNN that learns molecules from SMILES strings and then can generate new SMILES.
 """
 import numpy as np
+import os
+import tempfile
 
 from keras import optimizers
 from keras import Sequential
 from keras.layers import LSTM
+from keras.layers import Embedding
 from keras.layers import Dense
 from keras.layers import Activation
 from keras.layers import TimeDistributed
@@ -18,11 +21,15 @@ from keras.layers import Lambda
 from keras.models import load_model
 
 from . import utils
+from . import sampling
+from . import smiles_grammar
+from . import step_model
+from . import numpy_engine
 
 class Smiles_generator():
 
     def __init__(self, tensorboard=False, hidden_neurons_1=256, hidden_neurons_2=256, dropout_1=0.3, dropout_2=0.5,
-                 batch_size="auto", epochs=4, learning_rate=0.001, validation=0.05):
+                 batch_size="auto", epochs=4, learning_rate=0.001, validation=0.05, embedding_dim=None):
         """
         This function initialises the parent class common to both Model 1 and 2.
 
@@ -46,6 +53,9 @@ class Smiles_generator():
         :type learning_rate: float > 0
         :param validation: percentage of samples to use for validation during training.
         :type validation: float >= 0 and < 1
+        :param embedding_dim: size of the embedding of the characters, used when the model is trained on the indices of
+        the characters rather than on their one-hot encoding. If None, it is the number of characters.
+        :type embedding_dim: int or None
         """
 
         self.tensorboard = utils.set_tensorboard(tensorboard)
@@ -57,42 +67,52 @@ class Smiles_generator():
         self.epochs = utils.set_epochs(epochs)
         self.learning_rate = utils.set_learning_rate(learning_rate)
         self.validation = utils.set_validation(validation)
+        self.embedding_dim = utils.set_embedding_dim(embedding_dim)
 
         self.model = None
         self.loaded_model = None
 
-    def fit(self, X, y):
-        """
-        This function fits the parameters of the RNN to the data provided.
+        # Single step models used for predictions, one for each temperature
+        self._step_models = {}
 
-        :param X: Input one-hot-encoded padded smiles strings
-        :type X: np.array of shape (n_samples, max_len, n_char)
-        :param y: Output one-hot-encoded padded smiles strings
-        :type y: np.array of shape (n_samples, max_len, n_char)
+    def fit(self, X, y, n_char=None):
+        """
+        This function fits the parameters of the RNN to the data provided. X and y can either be one-hot encoded or
+        contain the indices of the characters (as returned by Molecules_processing.string_to_int). In the second case,
+        the model starts with an embedding layer and is trained with the sparse categorical cross-entropy, so that the
+        one-hot encoded arrays are never stored in memory.
+
+        :param X: Input one-hot-encoded padded smiles strings or their character indices
+        :type X: np.array of shape (n_samples, max_len, n_char) or (n_samples, max_len)
+        :param y: Output one-hot-encoded padded smiles strings or their character indices
+        :type y: np.array of shape (n_samples, max_len, n_char) or (n_samples, max_len)
+        :param n_char: number of different characters, only used when a new model is trained on character indices. If
+        None, it is taken from the largest index in X and y.
+        :type n_char: int or None
 
         :return: the estimator object
         """
 
         # Check the inputs
         X, y = utils.check_X_y(X, y)
+        int_input = (len(X.shape) == 2)
 
         # Adjust batch_size based on number of samples provided
         batch_size = utils.set_batch_size(self.batch_size, X.shape[0])
 
-        # Set up tensorboard
-        if self.tensorboard:
-            tensorboard = TensorBoard(log_dir='./tb', write_graph=True, write_images=False)
-            callbacks_list = [tensorboard]
+        callbacks_list = self._get_callbacks()
+
+        if not int_input:
+            n_feat = X.shape[-1]
+        elif isinstance(n_char, type(None)):
+            n_feat = int(max(np.max(X), np.max(y))) + 1
         else:
-            callbacks_list = []
+            n_feat = n_char
+        model = self._get_model_to_fit(n_feat, int_input)
 
-        # If the model has never been trained, create a new one, otherwise restart training from a previously trained model
-        if isinstance(self.model, type(None)) and isinstance(self.loaded_model, type(None)):
-            model = self._build_model(X.shape[-1])
-        elif not isinstance(self.model, type(None)):
-            model = self.model
-        elif not isinstance(self.loaded_model, type(None)):
-            model = self.loaded_model
+        # The sparse categorical cross-entropy expects the indices of the characters with a trailing dimension of size 1
+        if int_input:
+            y = np.expand_dims(y, axis=-1)
 
         # If there are enough samples, use some as validation data
         if int(self.validation*X.shape[0]) > 0:
@@ -103,48 +123,218 @@ class Smiles_generator():
         else:
             model.fit(X, y, batch_size=batch_size, verbose=1, epochs=self.epochs, callbacks=callbacks_list)
 
-        # Update the right variable with the newly trained model
-        if isinstance(self.model, type(None)) and isinstance(self.loaded_model, type(None)):
-            self.model = model
-        elif not isinstance(self.model, type(None)):
-            self.model = model
-        elif not isinstance(self.loaded_model, type(None)):
-            self.loaded_model = model
+        self._set_fitted_model(model)
 
-        self._model = model
-        self.is_fitted_ = True
+        return self
+
+    def fit_stream(self, data_stream, validation_stream=None):
+        """
+        This function fits the parameters of the RNN to batches that are produced one at a time. They can be SMILES read
+        from files and encoded on the fly, so that data sets larger than the memory can be used, SMILES grouped by
+        length, so that each batch is only padded to its longest SMILES, or SMILES read from a memory-mapped data set.
+        The batch size is the one of the stream and the validation parameter of the estimator is not used: a second
+        stream can be given for validation instead.
+
+        :param data_stream: the training batches
+        :type data_stream: data_streaming.Smiles_stream, batching.Length_batcher or tokenized_dataset.Dataset_batches
+        object
+        :param validation_stream: the validation batches
+        :type validation_stream: data_streaming.Smiles_stream, batching.Length_batcher or
+        tokenized_dataset.Dataset_batches object or None
+
+        :return: the estimator object
+        """
+
+        int_input = not data_stream.one_hot
+        model = self._get_model_to_fit(data_stream.n_feat, int_input)
+
+        if isinstance(validation_stream, type(None)):
+            validation_data, validation_steps = None, None
+        else:
+            validation_data = self._stream_batches(validation_stream, int_input)
+            validation_steps = len(validation_stream)
+
+        model.fit_generator(self._stream_batches(data_stream, int_input), steps_per_epoch=len(data_stream),
+                            epochs=self.epochs, verbose=1, callbacks=self._get_callbacks(),
+                            validation_data=validation_data, validation_steps=validation_steps)
+
+        self._set_fitted_model(model)
 
         return self
 
-    def predict(self, X, temperature=1.0, max_length=200):
+    def predict(self, X, temperature=1.0, max_length=200, random_state=None, data_handler=None, top_k=None,
+                top_p=None, constrained=False, fragment_lengths=None):
         """
         This function starts from a hot encoded SMILES and predicts the remaining part of the molecule. X needs to
-        at least contain a 'G' character, it cannot be empty.
+        at least contain a 'G' character, it cannot be empty. If the data handler that encoded X is given, each
+        molecule stops being generated once it has reached the end character 'E' and it is then padded with 'A'. If X
+        contains the indices of the characters instead, so do the predictions.
 
-        :param X: hot-encoded SMILES
-        :type X: np.array with shape (n_samples, length_smiles, n_char)
+        :param X: hot-encoded SMILES or their character indices
+        :type X: np.array with shape (n_samples, length_smiles, n_char) or (n_samples, length_smiles)
         :param temperature: Temperature factor for the modified softmax
         :type temperature: float
         :param max_length: maximum length of a smile string to generate
         :type max_length: int
-        :return: hot-encoded SMILES
-        :rtype: np.array of shape (n_samples, length_smiles, n_char)
+        :param random_state: seed or random number generator used to sample the characters
+        :type random_state: None, int or numpy.random.Generator
+        :param data_handler: the object used to one-hot encode the SMILES
+        :type data_handler: Molecules_processing object or None
+        :param top_k: if given, only the top_k most likely characters are sampled at each step
+        :type top_k: int or None
+        :param top_p: if given, only the most likely characters with total probability top_p are sampled at each step
+        :type top_p: float or None
+        :param constrained: whether to forbid the characters that would make the SMILES syntactically impossible
+        :type constrained: bool
+        :param fragment_lengths: number of characters of each fragment in X, when they have different lengths (see
+        Molecules_processing.get_fragments)
+        :type fragment_lengths: np.array or list of ints of shape (n_samples,) or None
+        :return: hot-encoded SMILES or their character indices
+        :rtype: np.array of shape (n_samples, length_smiles, n_char) or (n_samples, length_smiles)
         """
 
         utils.check_temperature(temperature)
-        utils.check_maxlength(max_length)
+        utils.check_maxlength(max_length, X)
+        utils.check_top_k(top_k)
+        utils.check_top_p(top_p)
+        utils.check_fragment_lengths(fragment_lengths, X)
+        rng = utils.set_random_state(random_state)
 
-        if isinstance(self.model, type(None)) and isinstance(self.loaded_model, type(None)):
-            raise Exception("The model has not been fit and no saved model has been loaded.\n")
-        elif not isinstance(self.model, type(None)):
-            model = self._modify_model_for_predictions(self.model, temperature)
+        model = self._get_step_model(temperature)
+
+        if isinstance(data_handler, type(None)):
+            end_idx, pad_idx = None, None
         else:
-            model = self._modify_model_for_predictions(self.loaded_model, temperature)
+            end_idx, pad_idx = data_handler.char_to_idx['E'], data_handler.char_to_idx['A']
+
+        grammar = smiles_grammar.get_grammar(constrained, data_handler)
 
-        X_pred = self._pred(X, model, max_length)
+        X_pred = sampling.generate(model, model.initial_states(X.shape[0]), X, max_length, rng, end_idx, pad_idx,
+                                   top_k, top_p, grammar, fragment_lengths)
 
         return X_pred
 
+    def generate_iter(self, data_handler, n_total, batch_size=1000, temperature=1.0, max_length=200, random_state=None,
+                      top_k=None, top_p=None, constrained=False):
+        """
+        This function generates new SMILES strings from scratch and yields each of them as soon as it is finished. When
+        a molecule is finished, a new one is started in its place, so that the batch of molecules being generated stays
+        full and the memory used does not depend on the total number of molecules.
+
+        :param data_handler: the object used to one-hot encode the SMILES the model was trained on
+        :type data_handler: Molecules_processing object
+        :param n_total: total number of SMILES to generate
+        :type n_total: int
+        :param batch_size: number of SMILES generated at the same time
+        :type batch_size: int
+        :param temperature: Temperature factor for the modified softmax
+        :type temperature: float
+        :param max_length: maximum length of a smile string to generate
+        :type max_length: int
+        :param random_state: seed or random number generator used to sample the characters
+        :type random_state: None, int or numpy.random.Generator
+        :param top_k: if given, only the top_k most likely characters are sampled at each step
+        :type top_k: int or None
+        :param top_p: if given, only the most likely characters with total probability top_p are sampled at each step
+        :type top_p: float or None
+        :param constrained: whether to forbid the characters that would make the SMILES syntactically impossible
+        :type constrained: bool
+        :return: SMILES strings
+        :rtype: generator of strings
+        """
+
+        utils.check_temperature(temperature)
+        utils.check_maxlength(max_length)
+        utils.check_n_samples(n_total)
+        utils.check_n_samples(batch_size)
+        utils.check_top_k(top_k)
+        utils.check_top_p(top_p)
+        rng = utils.set_random_state(random_state)
+
+        model = self._get_step_model(temperature)
+
+        int_generator = sampling.generate_iter(model, model.initial_states, data_handler.char_to_idx['G'],
+                                               data_handler.char_to_idx['E'], data_handler.char_to_idx['A'],
+                                               n_total, batch_size, max_length, rng, top_k, top_p,
+                                               smiles_grammar.get_grammar(constrained, data_handler))
+
+        for int_finished in int_generator:
+            for smile in data_handler.onehot_decode(int_finished):
+                yield smile
+
+    def beam_search(self, X, data_handler, beam_width=10, temperature=1.0, max_length=200):
+        """
+        This function finds the beam_width most likely completions of each fragment in X with a beam search.
+
+        :param X: hot-encoded SMILES fragments or their character indices
+        :type X: np.array with shape (n_samples, length_smiles, n_char) or (n_samples, length_smiles)
+        :param data_handler: the object used to one-hot encode the SMILES
+        :type data_handler: Molecules_processing object
+        :param beam_width: number of completions to find for each fragment, at most the number of characters
+        :type beam_width: int
+        :param temperature: Temperature factor for the modified softmax
+        :type temperature: float
+        :param max_length: maximum length of a smile string to generate
+        :type max_length: int
+        :return: hot-encoded completions (or their character indices, if X contains indices), grouped by fragment from the
+        most to the least likely, and their log-likelihoods
+        :rtype: np.array of shape (n_samples*beam_width, max_length, n_char) or (n_samples*beam_width, max_length) and
+        np.array of shape (n_samples, beam_width)
+        """
+
+        utils.check_temperature(temperature)
+        utils.check_maxlength(max_length, X)
+        utils.check_beam_width(beam_width, len(data_handler.idx_to_char))
+
+        model = self._get_step_model(temperature)
+        int_pred, log_likelihood = sampling.beam_search(model, model.initial_states(X.shape[0] * beam_width), X, max_length,
+                                                        beam_width, data_handler.char_to_idx['E'],
+                                                        data_handler.char_to_idx['A'])
+        X_pred = int_pred.reshape(-1, max_length)
+        if len(X.shape) == 3:
+            X_pred = sampling.int_to_onehot(X_pred, X.shape[-1])
+
+        return X_pred, log_likelihood
+
+    def generate_parallel(self, data_handler, n_total, n_workers=None, chunk_size=1000, temperature=1.0, max_length=200,
+                          random_state=None):
+        """
+        This function generates new SMILES strings from scratch with a pool of processes, which use the weights of this
+        model through the numpy engine. For a given random_state, the SMILES generated do not depend on the number of
+        processes. See numpy_engine.generate_parallel for details.
+
+        :param data_handler: the object used to one-hot encode the SMILES the model was trained on
+        :type data_handler: Molecules_processing object
+        :param n_total: total number of SMILES to generate
+        :type n_total: int
+        :param n_workers: number of processes. If None, the number of CPUs is used.
+        :type n_workers: int or None
+        :param chunk_size: number of SMILES generated at the same time by a process
+        :type chunk_size: int
+        :param temperature: Temperature factor for the modified softmax
+        :type temperature: float
+        :param max_length: maximum length of a smile string to generate
+        :type max_length: int
+        :param random_state: seed from which the random number generators of the processes are derived
+        :type random_state: None, int or numpy.random.Generator
+        :return: SMILES strings
+        :rtype: list of strings
+        """
+
+        weights_dir = tempfile.mkdtemp()
+        weights_file = os.path.join(weights_dir, "weights.npz")
+
+        try:
+            self.export_weights(weights_file)
+            smiles = numpy_engine.generate_parallel(weights_file, data_handler, n_total, n_workers, chunk_size,
+                                                    temperature, max_length, random_state)
+        finally:
+            if os.path.exists(weights_file):
+                os.remove(weights_file)
+            os.rmdir(weights_dir)
+
+        return smiles
+
     def save(self, filename='model.h5'):
         """
         This function enables to save the trained model so that then training or predictions can be done at a later stage.
@@ -160,6 +350,47 @@ class Smiles_generator():
         else:
             raise utils.InputError("No model to be saved.")
 
+    def export_weights(self, filename='model.npz'):
+        """
+        This function saves the weights of the embedding, of the LSTMs and of the dense layer in a numpy file, so that
+        new SMILES can be generated with the Numpy_generator class without loading Keras.
+
+        :param filename: Name of the file in which to save the weights.
+        :type filename: string
+        :return: None
+        """
+
+        if not isinstance(self.model, type(None)):
+            model = self.model
+        elif not isinstance(self.loaded_model, type(None)):
+            model = self.loaded_model
+        else:
+            raise utils.InputError("No model to be exported.")
+
+        weights = {}
+        n_lstm = 0
+
+        for layer in model.layers:
+            if isinstance(layer, LSTM):
+                kernel, recurrent_kernel, bias = layer.get_weights()
+                config = layer.get_config()
+                weights["lstm_%i_kernel" % n_lstm] = kernel
+                weights["lstm_%i_recurrent_kernel" % n_lstm] = recurrent_kernel
+                weights["lstm_%i_bias" % n_lstm] = bias
+                weights["lstm_%i_activation" % n_lstm] = config['activation']
+                weights["lstm_%i_recurrent_activation" % n_lstm] = config['recurrent_activation']
+                n_lstm += 1
+            elif isinstance(layer, Embedding):
+                weights["embeddings"] = layer.get_weights()[0]
+            elif isinstance(layer, TimeDistributed):
+                kernel, bias = layer.get_weights()
+                weights["dense_kernel"] = kernel
+                weights["dense_bias"] = bias
+
+        weights["n_lstm"] = n_lstm
+
+        np.savez(filename, **weights)
+
     def load(self, filename='model.h5'):
         """
         This function loads a model that has been previously saved.
@@ -169,17 +400,106 @@ class Smiles_generator():
         """
 
         self.loaded_model = load_model(filename)
+        self._step_models = {}
 
-    def _build_model(self, n_feat):
+    def _get_callbacks(self):
+        """
+        This function sets up tensorboard, if it is used.
+
+        :return: the callbacks used during training
+        :rtype: list
+        """
+
+        if self.tensorboard:
+            tensorboard = TensorBoard(log_dir='./tb', write_graph=True, write_images=False)
+            return [tensorboard]
+        else:
+            return []
+
+    def _get_model_to_fit(self, n_feat, int_input):
+        """
+        This function returns the model to train. If the model has never been trained, a new one is created, otherwise
+        training restarts from a previously trained model.
+
+        :param n_feat: number of different characters
+        :type n_feat: int
+        :param int_input: whether the data contains the indices of the characters rather than their one-hot encoding
+        :type int_input: bool
+        :return: Keras model
+        """
+
+        if isinstance(self.model, type(None)) and isinstance(self.loaded_model, type(None)):
+            model = self._build_model(n_feat, int_input)
+        elif not isinstance(self.model, type(None)):
+            model = self.model
+        else:
+            model = self.loaded_model
+
+        if (len(model.input_shape) == 2) != int_input:
+            raise utils.InputError("The model was trained on %s, but the data provided contains %s." %
+                                   (("character indices", "one-hot encoded SMILES") if int_input else
+                                    ("one-hot encoded SMILES", "character indices")))
+
+        return model
+
+    def _set_fitted_model(self, model):
+        """
+        This function updates the right variable with the newly trained model.
+
+        :param model: the trained model
+        :return: None
+        """
+
+        if isinstance(self.model, type(None)) and isinstance(self.loaded_model, type(None)):
+            self.model = model
+        elif not isinstance(self.model, type(None)):
+            self.model = model
+        elif not isinstance(self.loaded_model, type(None)):
+            self.loaded_model = model
+
+        self._model = model
+        self.is_fitted_ = True
+
+    def _stream_batches(self, data_stream, int_input):
+        """
+        This function passes on the batches of a stream, adding the trailing dimension that the sparse categorical
+        cross-entropy expects to the outputs made of character indices.
+
+        :param data_stream: the batches
+        :type data_stream: data_streaming.Smiles_stream, batching.Length_batcher or tokenized_dataset.Dataset_batches
+        object
+        :param int_input: whether the batches contain the indices of the characters
+        :type int_input: bool
+        :return: batches of inputs and outputs of the model
+        :rtype: generator of tuples of two numpy arrays
+        """
+
+        for X, y in data_stream:
+            if int_input:
+                y = np.expand_dims(y, axis=-1)
+            yield X, y
+
+    def _build_model(self, n_feat, int_input=False):
         """
         This function generates the RNN.
 
+        :param n_feat: number of different characters
+        :type n_feat: int
+        :param int_input: whether the model takes the indices of the characters rather than their one-hot encoding
+        :type int_input: bool
         :return: Keras Sequential object
         """
         model = Sequential()
-        # This will output (max_size, n_hidden_1)
-        model.add(LSTM(units=self.hidden_neurons_1, input_shape=(None, n_feat), return_sequences=True,
-                       dropout=self.dropout_1))
+        if int_input:
+            # This will output (max_size, embedding_dim)
+            embedding_dim = n_feat if isinstance(self.embedding_dim, type(None)) else self.embedding_dim
+            model.add(Embedding(input_dim=n_feat, output_dim=embedding_dim, input_shape=(None,)))
+            # This will output (max_size, n_hidden_1)
+            model.add(LSTM(units=self.hidden_neurons_1, return_sequences=True, dropout=self.dropout_1))
+        else:
+            # This will output (max_size, n_hidden_1)
+            model.add(LSTM(units=self.hidden_neurons_1, input_shape=(None, n_feat), return_sequences=True,
+                           dropout=self.dropout_1))
         # This will output (max_size, n_hidden_2)
         model.add(
             LSTM(units=self.hidden_neurons_2, input_shape=(None, self.hidden_neurons_1), return_sequences=True,
@@ -191,55 +511,45 @@ class Smiles_generator():
         model.add(Activation('softmax'))
         optimiser = optimizers.Adam(lr=self.learning_rate, beta_1=0.9, beta_2=0.999, epsilon=None, decay=0.0,
                                     amsgrad=False)
-        model.compile(loss="categorical_crossentropy", optimizer=optimiser)
+        if int_input:
+            model.compile(loss="sparse_categorical_crossentropy", optimizer=optimiser)
+        else:
+            model.compile(loss="categorical_crossentropy", optimizer=optimiser)
 
         return model
 
-    def _modify_model_for_predictions(self, model, temperature):
+    def _get_step_model(self, temperature):
         """
-        This function modifies the model for predict time by adding a temperature factor to the softmax activation
-        function.
+        This function returns the single step copy of the trained model used to generate new SMILES. The copies are
+        built once for each temperature and kept, so that repeated predictions do not rebuild the graph. The trained
+        model itself is never modified.
 
-        :param model: the model to modify
-        :type model: keras model
         :param temperature: temperature that modifies the softmax
-        :type temperature: float > 0 and <= 1
-        :return: The modified model
+        :type temperature: float > 0
+        :return: the single step model
+        :rtype: Step_model object
         """
 
-        # Removes the activation function layer and the lambda layer with temperture param equal to 1
-        model.pop()
-        model.pop()
-        # Adds the layer with temperature parameter specified by the user and then re-adds the Softmax
-        model.add(Lambda(lambda x: x / temperature))
-        model.add(Activation('softmax'))
-
-        return model
-
-    def _pred(self, X, model, max_length):
-        """
-        This function predicts one-hot encoded smiles strings starting from a fragment.
-
-        :param X: One-hot encoded fragment of smile string
-        :param model: the keras model to use for prediction
-        :param max_length: maximum length of predicted molecules
-        :return: predicted one-hot encoded smiles strings
-        """
-
-        n_feat = X.shape[-1]
-        n_samples = X.shape[0]
-
-        # Predictions
-        X_pred = np.zeros((n_samples, max_length, n_feat))
-        X_pred[:, :X.shape[1], :] = X
+        if isinstance(self.model, type(None)) and isinstance(self.loaded_model, type(None)):
+            raise Exception("The model has not been fit and no saved model has been loaded.\n")
+        elif not isinstance(self.model, type(None)):
+            model = self.model
+        else:
+            model = self.loaded_model
 
-        for i in range(1, max_length):
-            prob_distribution = model.predict(X_pred[:, :i, :])
+        if temperature in self._step_models:
+            # The model may have been trained since the copy was made
+            step = self._step_models[temperature]
+            step.sync_weights()
+        else:
+            # Only keeping a few temperatures, discarding the ones used least recently
+            if len(self._step_models) >= 5:
+                del self._step_models[next(iter(self._step_models))]
+            step = step_model.Step_model(model, temperature)
 
-            # Slow step
-            for j in range(n_samples):
-                idx_out = np.random.choice(np.arange(n_feat), p=prob_distribution[j, -1])
-                X_pred[j, i, idx_out] = 1
+        # Moving the temperature to the end of the dictionary, as the most recently used
+        self._step_models.pop(temperature, None)
+        self._step_models[temperature] = step
 
-        return X_pred
+        return step
 
@@ -0,0 +1,233 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This module contains a lightweight SMILES grammar that is used during the generation to forbid the characters that
+would make a string syntactically impossible: unbalanced parentheses and brackets, ring closures left open, bonds that
+are not followed by an atom and an end character 'E' placed in the middle of a branch. It does not check valences or
+aromaticity, so the strings it allows are not guaranteed to be valid molecules.
+
+The state of the grammar (the number of open branches, the open ring closures, whether the sequence is inside a
+bracket atom and the type of the last character) is stored in numpy arrays, so that it is updated for the whole batch
+at once. Two-digit ring closures ('%10') are only tracked when they are a single token.
+"""
+
+import numpy as np
+
+from . import utils
+
+# Types of characters
+_START, _END, _PAD, _ATOM, _BOND, _BRANCH_OPEN, _BRANCH_CLOSE, _RING, _BRACKET_OPEN, _BRACKET_CLOSE, _DOT, _OTHER, \
+    _FORBIDDEN = range(13)
+_n_types = 13
+
+_bonds = {'-', '=', '#', '$', ':', '/', '\\'}
+
+def _token_type(token):
+    """
+    This function returns the type of a character (or of a multi-character token).
+
+    :param token: the character
+    :type token: string
+    :return: type of the character
+    :rtype: int
+    """
+
+    if token == 'G':
+        return _START
+    elif token == 'E':
+        return _END
+    elif token == 'A':
+        return _PAD
+    elif token == '(':
+        return _BRANCH_OPEN
+    elif token == ')':
+        return _BRANCH_CLOSE
+    elif token == '[':
+        return _BRACKET_OPEN
+    elif token == ']':
+        return _BRACKET_CLOSE
+    elif token == '.':
+        return _DOT
+    elif token in _bonds:
+        return _BOND
+    elif token.isdigit() or (token.startswith('%') and token[1:].isdigit() and len(token) > 1):
+        return _RING
+    elif token.startswith('[') and token.endswith(']'):
+        # A whole bracket atom, when the SMILES are split in atom-level tokens
+        return _ATOM
+    elif token.isalpha():
+        return _ATOM
+    elif token == '%':
+        return _FORBIDDEN
+    else:
+        return _OTHER
+
+def get_grammar(constrained, data_handler):
+    """
+    This function makes the grammar used for the constrained generation, if it is needed.
+
+    :param constrained: whether the generation should be constrained by the grammar
+    :type constrained: bool
+    :param data_handler: the object used to one-hot encode the SMILES
+    :type data_handler: Molecules_processing object or None
+    :return: the grammar
+    :rtype: Smiles_grammar object or None
+    """
+
+    if not constrained:
+        return None
+    elif isinstance(data_handler, type(None)):
+        raise utils.InputError("The data handler is needed to constrain the generation with the SMILES grammar.")
+    else:
+        return Smiles_grammar(data_handler.idx_to_char)
+
+class Smiles_grammar():
+
+    def __init__(self, idx_to_char):
+        """
+        This function builds the tables of the characters that are allowed after each type of character.
+
+        :param idx_to_char: dictionary that maps the indices to the characters
+        :type idx_to_char: dictionary
+        """
+
+        n_feat = len(idx_to_char)
+        tokens = [idx_to_char[idx] for idx in range(n_feat)]
+
+        self.token_type = np.array([_token_type(token) for token in tokens])
+
+        # Each ring closure label is given a column in the array of open rings
+        ring_labels = sorted(set(token for token, token_type in zip(tokens, self.token_type) if token_type == _RING))
+        self.ring_idx = np.array([ring_labels.index(token) if token in ring_labels else -1 for token in tokens])
+        self.n_rings = len(ring_labels)
+
+        def is_type(*types):
+            return np.isin(self.token_type, types)
+
+        ends_atom = (_ATOM, _BRACKET_CLOSE, _RING, _BRANCH_CLOSE)
+
+        # Characters allowed outside brackets, depending on the type of the previous character
+        self._allowed_outside = np.zeros((_n_types, n_feat), dtype=bool)
+        for prev_type in range(_n_types):
+            allowed = is_type(_ATOM, _BRACKET_OPEN)
+            if prev_type in ends_atom:
+                allowed |= is_type(_BOND, _BRANCH_OPEN, _BRANCH_CLOSE, _RING, _DOT, _END)
+            elif prev_type == _BRANCH_OPEN:
+                allowed |= is_type(_BOND)
+            elif prev_type == _BOND:
+                allowed |= is_type(_RING)
+            self._allowed_outside[prev_type] = allowed
+
+        # Characters allowed inside brackets: anything but the structure of the SMILES, and not an empty bracket
+        self._allowed_inside = np.zeros((_n_types, n_feat), dtype=bool)
+        for prev_type in range(_n_types):
+            allowed = is_type(_ATOM, _RING, _OTHER, _BRACKET_CLOSE) | np.isin(tokens, ['-'])
+            if prev_type == _BRACKET_OPEN:
+                allowed &= ~is_type(_BRACKET_CLOSE)
+            self._allowed_inside[prev_type] = allowed
+
+        self._is_branch_close = is_type(_BRANCH_CLOSE)
+        self._is_end = is_type(_END)
+
+        self.start(0)
+
+    def start(self, n_samples):
+        """
+        This function sets the state of the grammar for a batch of new sequences.
+
+        :param n_samples: number of sequences
+        :type n_samples: int
+        :return: None
+        """
+
+        self.depth = np.zeros(n_samples, dtype=np.int32)
+        self.open_rings = np.zeros((n_samples, self.n_rings), dtype=bool)
+        self.in_bracket = np.zeros(n_samples, dtype=bool)
+        self.prev_type = np.full(n_samples, _START, dtype=np.int32)
+
+    def restart(self, rows):
+        """
+        This function resets the state of some of the sequences, when they are replaced by new ones.
+
+        :param rows: indices of the sequences in the batch
+        :type rows: numpy array of ints
+        :return: None
+        """
+
+        self.depth[rows] = 0
+        self.open_rings[rows] = False
+        self.in_bracket[rows] = False
+        self.prev_type[rows] = _START
+
+    def mask(self, rows):
+        """
+        This function returns which characters can follow the current sequences without breaking the grammar.
+
+        :param rows: indices of the sequences in the batch
+        :type rows: numpy array of ints
+        :return: allowed characters
+        :rtype: numpy array of bools of shape (n_rows, n_char)
+        """
+
+        prev_type = self.prev_type[rows]
+        allowed = np.where(self.in_bracket[rows, None], self._allowed_inside[prev_type],
+                           self._allowed_outside[prev_type])
+
+        # Closing a branch needs an open one and ending the string needs everything to be closed
+        allowed[:, self._is_branch_close] &= (self.depth[rows] > 0)[:, None]
+        all_closed = (self.depth[rows] == 0) & ~np.any(self.open_rings[rows], axis=-1)
+        allowed[:, self._is_end] &= all_closed[:, None]
+
+        # If the sequence is already impossible (for example in a fragment), nothing is forbidden
+        allowed[~np.any(allowed, axis=-1)] = True
+
+        return allowed
+
+    def update(self, rows, int_chars):
+        """
+        This function updates the state of the sequences after a character has been added to them.
+
+        :param rows: indices of the sequences in the batch
+        :type rows: numpy array of ints
+        :param int_chars: indices of the characters added
+        :type int_chars: numpy array of ints
+        :return: None
+        """
+
+        char_type = self.token_type[int_chars]
+        outside = ~self.in_bracket[rows]
+
+        self.depth[rows] += (outside & (char_type == _BRANCH_OPEN)).astype(np.int32)
+        self.depth[rows] -= (outside & (char_type == _BRANCH_CLOSE)).astype(np.int32)
+
+        is_ring = outside & (char_type == _RING)
+        self.open_rings[rows[is_ring], self.ring_idx[int_chars[is_ring]]] ^= True
+
+        self.in_bracket[rows[char_type == _BRACKET_OPEN]] = True
+        self.in_bracket[rows[char_type == _BRACKET_CLOSE]] = False
+
+        self.prev_type[rows] = char_type
+
+    def apply(self, prob_distribution, rows):
+        """
+        This function sets to zero the probability of the characters that are not allowed and renormalises the rest.
+
+        :param prob_distribution: probability of each character for each sequence
+        :type prob_distribution: numpy array of shape (n_rows, n_char)
+        :param rows: indices of the sequences in the batch
+        :type rows: numpy array of ints
+        :return: filtered probability distribution
+        :rtype: numpy array of shape (n_rows, n_char)
+        """
+
+        filtered_prob = np.where(self.mask(rows), prob_distribution, 0)
+        total_prob = np.sum(filtered_prob, axis=-1, keepdims=True)
+
+        # If the model gives no probability to any of the allowed characters, the original distribution is kept
+        no_prob = total_prob[:, 0] <= 0
+        filtered_prob[no_prob] = prob_distribution[no_prob]
+        total_prob[no_prob] = np.sum(prob_distribution[no_prob], axis=-1, keepdims=True)
+
+        return filtered_prob / total_prob
@@ -0,0 +1,191 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This module contains the class that turns a trained SMILES generator into a model that predicts one character at a
+time. The hidden and cell states of the LSTMs are inputs and outputs of the model, so that they can be carried forward
+from one step to the next and the cost of generating a molecule grows linearly with its length. The original generation,
+which feeds the whole sequence generated so far to the model at every step, is kept as a reference for the tests and
+benchmarks.
+"""
+
+import numpy as np
+
+from keras.models import Model
+from keras.layers import Input
+from keras.layers import LSTM
+from keras.layers import Lambda
+from keras.layers import Activation
+
+from . import sampling
+
+class Step_model():
+
+    def __init__(self, model, temperature=1.0):
+        """
+        This function builds the single step copy of a trained model.
+
+        :param model: the trained model from which to take the weights
+        :type model: keras Sequential model
+        :param temperature: Temperature factor for the modified softmax
+        :type temperature: float
+        """
+
+        self.model = model
+        self.temperature = temperature
+
+        # Pairs of (trained LSTM, single step LSTM) whose weights need to be kept in sync
+        self._recurrent_layers = []
+        self._state_sizes = []
+
+        self.step_model = self._build_step_model()
+        self.sync_weights()
+
+    def __call__(self, int_chars, states):
+        """
+        This function feeds one character per sequence to the model and returns the probability of the next character.
+
+        :param int_chars: indices of the last character of each sequence
+        :type int_chars: numpy array of shape (n_samples,)
+        :param states: hidden and cell states of each LSTM
+        :type states: list of numpy arrays of shape (n_samples, n_hidden)
+        :return: probability distribution of the next character and the updated states
+        :rtype: numpy array of shape (n_samples, n_char) and list of numpy arrays
+        """
+
+        n_samples = int_chars.shape[0]
+
+        if self.int_input:
+            chars = np.reshape(int_chars, (n_samples, 1))
+        else:
+            chars = np.zeros((n_samples, 1, self.n_feat), dtype=np.float32)
+            chars[np.arange(n_samples), 0, int_chars] = 1
+
+        outputs = self.step_model.predict_on_batch([chars] + list(states))
+
+        return outputs[0][:, -1, :], outputs[1:]
+
+    def initial_states(self, n_samples):
+        """
+        This function returns the states of the LSTMs before any character has been seen.
+
+        :param n_samples: number of sequences
+        :type n_samples: int
+        :return: hidden and cell states of each LSTM
+        :rtype: list of numpy arrays of shape (n_samples, n_hidden)
+        """
+
+        return [np.zeros((n_samples, size), dtype=np.float32) for size in self._state_sizes]
+
+    def sync_weights(self):
+        """
+        This function copies the weights of the trained LSTMs into the single step LSTMs. The embedding and dense layers
+        are shared between the two models, so they do not need to be copied.
+
+        :return: None
+        """
+
+        for trained_layer, step_layer in self._recurrent_layers:
+            step_layer.set_weights(trained_layer.get_weights())
+
+    def _build_step_model(self):
+        """
+        This function makes a model with the same layers as the trained model, where the LSTMs take their initial states
+        as inputs and return their final states as outputs.
+
+        :return: Keras Model object
+        """
+
+        self.n_feat = self.model.output_shape[-1]
+
+        # Models with an embedding layer take the indices of the characters rather than their one-hot encoding
+        self.int_input = len(self.model.input_shape) == 2
+        if self.int_input:
+            char_input = Input(shape=(1,))
+        else:
+            char_input = Input(shape=(1, self.n_feat))
+        state_inputs = []
+        state_outputs = []
+
+        h = char_input
+        for layer in self.model.layers:
+            if isinstance(layer, LSTM):
+                config = layer.get_config()
+                config.pop('name', None)
+                config.pop('batch_input_shape', None)
+                config.update({'return_sequences': True, 'return_state': True, 'stateful': False})
+                step_layer = LSTM.from_config(config)
+
+                initial_state = [Input(shape=(layer.units,)), Input(shape=(layer.units,))]
+                h, state_h, state_c = step_layer(h, initial_state=initial_state)
+
+                state_inputs += initial_state
+                state_outputs += [state_h, state_c]
+                self._state_sizes += [layer.units, layer.units]
+                self._recurrent_layers.append((layer, step_layer))
+            elif isinstance(layer, (Lambda, Activation)):
+                # The softmax with the temperature is added at the end
+                continue
+            else:
+                h = layer(h)
+
+        # Modifying softmax with temperature
+        temperature = self.temperature
+        h = Lambda(lambda x: x / temperature)(h)
+        char_prob = Activation('softmax')(h)
+
+        return Model(inputs=[char_input] + state_inputs, outputs=[char_prob] + state_outputs)
+
+def whole_sequence_model(model, temperature=1.0):
+    """
+    This function makes a model for the whole sequence that shares the layers of a trained model, with a softmax with
+    temperature. It is only used as a reference for the single step model.
+
+    :param model: the trained model
+    :type model: keras Sequential model
+    :param temperature: Temperature factor for the modified softmax
+    :type temperature: float
+    :return: model that predicts the probability of the next character at each step of the sequences
+    :rtype: keras Model
+    """
+
+    # The last layer before the softmax with temperature 1 of the trained model
+    last_layer = [layer for layer in model.layers if not isinstance(layer, (Lambda, Activation))][-1]
+
+    h = Lambda(lambda x: x / temperature)(last_layer.get_output_at(0))
+    char_prob = Activation('softmax')(h)
+
+    return Model(inputs=model.input, outputs=char_prob)
+
+def whole_sequence_pred(X, model, max_length, rng):
+    """
+    This function predicts one-hot encoded SMILES by feeding the whole sequence generated so far to the model at every
+    step, as the SMILES generator did before using a single step model. It is only used as a reference for the single
+    step model, since the cost of generating a molecule grows quadratically with its length.
+
+    :param X: One-hot encoded fragments of smile strings
+    :type X: numpy array of shape (n_samples, length_fragment, n_char)
+    :param model: model returned by whole_sequence_model
+    :type model: keras Model
+    :param max_length: maximum length of the predicted molecules
+    :type max_length: int
+    :param rng: random number generator used to sample the characters
+    :type rng: numpy.random.Generator
+    :return: the predicted one-hot encoded SMILES
+    :rtype: numpy array of shape (n_samples, max_length, n_char)
+    """
+
+    n_feat = X.shape[-1]
+    n_samples = X.shape[0]
+
+    X_pred = np.zeros((n_samples, max_length, n_feat))
+    X_pred[:, :X.shape[1], :] = X
+
+    for i in range(1, max_length):
+        prob_distribution = model.predict(X_pred[:, :i, :])
+
+        idx_out = sampling.sample_categorical(prob_distribution[:, -1], rng)
+        X_pred[np.arange(n_samples), i, idx_out] = 1
+
+    return X_pred
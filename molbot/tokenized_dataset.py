@@ -0,0 +1,347 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+"""
+This module contains a compact on-disk format for data sets of SMILES that have already been turned into character
+indices. A data set is a directory with the matrix of the character indices (one byte per character when there are at
+most 256 different characters), the length of each SMILES and the data handler with the indices of the characters.
+The matrices are opened as memory maps, so opening a data set takes the same time whatever its size, nothing is read
+until it is used and several processes reading the same data set share the same pages in memory.
+"""
+
+import os
+import itertools
+import multiprocessing
+
+import numpy as np
+
+from . import utils
+from . import sampling
+from . import batching
+from . import data_processing
+from . import data_streaming
+
+_tokens_file = "tokens.npy"
+_lengths_file = "lengths.npy"
+_data_handler_file = "data_proc.pickle"
+
+# Objects loaded once by each process of the pool used in write_dataset_parallel
+_worker_data_handler = None
+_worker_smiles_column = None
+_worker_delimiter = None
+
+def _init_worker(data_handler, smiles_column, delimiter):
+    global _worker_data_handler, _worker_smiles_column, _worker_delimiter
+    _worker_data_handler = data_handler
+    _worker_smiles_column = smiles_column
+    _worker_delimiter = delimiter
+
+def _count_lines(args):
+    filename, start, end = args
+    with open(filename, 'rb') as in_file:
+        in_file.seek(start)
+        text = in_file.read(end - start)
+    return text.count(b'\n') + int(not text.endswith(b'\n'))
+
+def _encode_range(args):
+    filename, start, end, tokens_file, row_offset, n_rows, chunk_size = args
+    molecules = data_streaming.read_smiles_range(filename, start, end, _worker_smiles_column, _worker_delimiter)
+    if len(molecules) > n_rows:
+        raise utils.InputError("Found %i SMILES in %i lines of %s. The lines should end with '\\n'." %
+                               (len(molecules), n_rows, filename))
+    pad_idx = _worker_data_handler.char_to_idx['A']
+
+    # Each process writes its rows directly in the memory map, only the lengths are sent back
+    tokens = np.load(tokens_file, mmap_mode='r+')
+    lengths = []
+    n_written = 0
+    for i in range(0, len(molecules), chunk_size):
+        int_chunk = _worker_data_handler.string_to_int(molecules[i:i+chunk_size])
+        tokens[row_offset+n_written:row_offset+n_written+int_chunk.shape[0]] = int_chunk
+        lengths.append(batching.sequence_lengths(int_chunk, pad_idx).astype(np.int32))
+        n_written += int_chunk.shape[0]
+    tokens.flush()
+    del tokens
+
+    return np.concatenate(lengths) if len(lengths) > 0 else np.zeros(0, dtype=np.int32)
+
+def write_dataset(directory, molecules, data_handler, n_samples=None, chunk_size=100000):
+    """
+    This function turns SMILES into character indices and writes them in a new data set, one chunk at a time. The data
+    handler needs to already contain the indices of all the characters and the maximum length of the SMILES (see
+    Molecules_processing.build_vocabulary). If the data handler skips some of the SMILES, the rows left at the end of
+    the matrix of character indices are not part of the data set.
+
+    :param directory: name of the directory in which to write the data set
+    :type directory: string
+    :param molecules: unpadded SMILES strings
+    :type molecules: list of strings or iterable of strings (for example data_streaming.read_smiles)
+    :param data_handler: the object used to encode the SMILES
+    :type data_handler: Molecules_processing object
+    :param n_samples: number of SMILES, only needed when they are not given as a list
+    :type n_samples: int or None
+    :param chunk_size: number of SMILES encoded at the same time
+    :type chunk_size: int
+    :return: None
+    """
+
+    if len(data_handler.char_to_idx) == 0 or data_handler.max_size == 0:
+        raise utils.InputError("The data handler needs to know the characters and the maximum length of the SMILES "
+                               "before the data set can be written.")
+    if isinstance(n_samples, type(None)):
+        n_samples = len(molecules)
+    utils.check_n_samples(n_samples)
+    utils.check_n_samples(chunk_size)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    dtype = np.uint8 if len(data_handler.idx_to_char) <= 256 else np.uint16
+    pad_idx = data_handler.char_to_idx['A']
+
+    tokens = np.lib.format.open_memmap(os.path.join(directory, _tokens_file), mode='w+', dtype=dtype,
+                                       shape=(n_samples, data_handler.max_size))
+    lengths = []
+
+    molecules = iter(molecules)
+    n_read, n_written = 0, 0
+    while n_read < n_samples:
+        chunk = list(itertools.islice(molecules, min(chunk_size, n_samples - n_read)))
+        if len(chunk) == 0:
+            raise utils.InputError("Only %i SMILES were given, but n_samples is %i." % (n_read, n_samples))
+        n_read += len(chunk)
+
+        int_chunk = data_handler.string_to_int(chunk)
+        tokens[n_written:n_written+int_chunk.shape[0]] = int_chunk
+        lengths.append(batching.sequence_lengths(int_chunk, pad_idx).astype(np.int32))
+        n_written += int_chunk.shape[0]
+
+    tokens.flush()
+    del tokens
+
+    # The lengths are small and are written last, so they also give the number of SMILES in the data set
+    np.save(os.path.join(directory, _lengths_file), np.concatenate(lengths))
+
+    data_handler.save(os.path.join(directory, _data_handler_file))
+
+def write_dataset_parallel(directory, filenames, data_handler, n_workers=None, chunk_bytes=2**22, chunk_size=100000,
+                           smiles_column=0, delimiter=',', header=False):
+    """
+    This function writes a new data set from the SMILES in some CSV files, like write_dataset, with a pool of processes.
+    The files are split in ranges of bytes that are read and encoded by the processes, which write the character
+    indices directly into the memory-mapped matrix of the data set. The data handler needs to already contain the
+    indices of all the characters and the maximum length of the SMILES (see Molecules_processing.build_vocabulary) and
+    it is not changed by the processes. Each SMILES has to be on a single line. When called from a script, the call has
+    to be inside an ``if __name__ == "__main__":`` block.
+
+    :param directory: name of the directory in which to write the data set
+    :type directory: string
+    :param filenames: names of the files that contain the SMILES
+    :type filenames: string or list of strings
+    :param data_handler: the object used to encode the SMILES
+    :type data_handler: Molecules_processing object
+    :param n_workers: number of processes. If None, the number of CPUs is used.
+    :type n_workers: int or None
+    :param chunk_bytes: approximate number of bytes of the files read at the same time by a process
+    :type chunk_bytes: int
+    :param chunk_size: number of SMILES encoded at the same time by a process
+    :type chunk_size: int
+    :param smiles_column: index of the column that contains the SMILES
+    :type smiles_column: int
+    :param delimiter: character that separates the columns
+    :type delimiter: string
+    :param header: whether the first line of each file is a header
+    :type header: bool
+    :return: None
+    """
+
+    if len(data_handler.char_to_idx) == 0 or data_handler.max_size == 0:
+        raise utils.InputError("The data handler needs to know the characters and the maximum length of the SMILES "
+                               "before the data set can be written.")
+    utils.check_n_samples(chunk_size)
+    if isinstance(n_workers, type(None)):
+        n_workers = multiprocessing.cpu_count()
+    utils.check_n_samples(n_workers)
+
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    ranges = [(filename, start, end) for filename in filenames
+              for start, end in data_streaming.split_file(filename, chunk_bytes, header)]
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    tokens_file = os.path.join(directory, _tokens_file)
+    dtype = np.uint8 if len(data_handler.idx_to_char) <= 256 else np.uint16
+
+    # The processes are spawned rather than forked, since the parent process may have initialised Tensorflow
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(n_workers, initializer=_init_worker, initargs=(data_handler, smiles_column, delimiter)) as pool:
+        # Each line holds at most one SMILES, so counting the lines tells each range in which rows it can write
+        counts = pool.map(_count_lines, ranges)
+        n_samples = sum(counts)
+        if n_samples == 0:
+            raise utils.InputError("No SMILES were found in the files %s." % (str(filenames)))
+        row_offsets = np.cumsum(counts) - counts
+
+        tokens = np.lib.format.open_memmap(tokens_file, mode='w+', dtype=dtype, shape=(n_samples, data_handler.max_size))
+        del tokens
+
+        tasks = [(filename, start, end, tokens_file, int(row_offset), n_rows, chunk_size)
+                 for (filename, start, end), row_offset, n_rows in zip(ranges, row_offsets, counts)]
+        lengths = pool.map(_encode_range, tasks)
+
+    # The rows left empty by the empty lines and by the SMILES skipped by the data handler are filled by moving up the
+    # rows of the following ranges, while the rows left at the end are not part of the data set
+    tokens = np.load(tokens_file, mmap_mode='r+')
+    n_written = 0
+    for row_offset, range_lengths in zip(row_offsets, lengths):
+        if row_offset != n_written:
+            for i in range(0, range_lengths.shape[0], chunk_size):
+                n_rows = min(chunk_size, range_lengths.shape[0] - i)
+                tokens[n_written+i:n_written+i+n_rows] = tokens[row_offset+i:row_offset+i+n_rows]
+        n_written += range_lengths.shape[0]
+    tokens.flush()
+    del tokens
+
+    lengths = np.concatenate(lengths)
+    if lengths.shape[0] == 0:
+        raise utils.InputError("No SMILES were found in the files %s." % (str(filenames)))
+
+    # The lengths are small and are written last, so they also give the number of SMILES in the data set
+    np.save(os.path.join(directory, _lengths_file), lengths)
+
+    data_handler.save(os.path.join(directory, _data_handler_file))
+
+class Tokenized_dataset():
+
+    def __init__(self, directory):
+        """
+        This function opens a data set written by write_dataset. The character indices are not read into memory.
+
+        :param directory: name of the directory that contains the data set
+        :type directory: string
+        """
+
+        self.lengths = np.load(os.path.join(directory, _lengths_file), mmap_mode='r')
+        self.tokens = np.load(os.path.join(directory, _tokens_file), mmap_mode='r')[:self.lengths.shape[0]]
+
+        self.data_handler = data_processing.Molecules_processing()
+        self.data_handler.load(os.path.join(directory, _data_handler_file))
+
+        self.n_feat = len(self.data_handler.idx_to_char)
+
+    def __len__(self):
+        """
+        This function returns the number of SMILES in the data set.
+
+        :return: number of SMILES
+        :rtype: int
+        """
+
+        return self.tokens.shape[0]
+
+    def get_X_y(self, idx, one_hot=True, trim=True):
+        """
+        This function reads some SMILES of the data set and returns them in the format used to train the model. Only
+        the SMILES requested are read from the disk.
+
+        :param idx: indices of the SMILES (or a slice)
+        :type idx: slice or numpy array of ints
+        :param one_hot: whether to one-hot encode the SMILES or to return the indices of their characters
+        :type one_hot: bool
+        :param trim: whether to remove the padding after the longest of the SMILES requested
+        :type trim: bool
+        :return: input and output of the model
+        :rtype: two numpy arrays of shape (n_samples, max_len, n_char) or (n_samples, max_len)
+        """
+
+        X = np.asarray(self.tokens[idx], dtype=np.int16)
+        if trim and X.shape[0] > 0:
+            X = X[:, :np.max(self.lengths[idx])]
+
+        y = np.full(X.shape, self.data_handler.char_to_idx['A'], dtype=X.dtype)
+        y[:, :-1] = X[:, 1:]
+
+        if one_hot:
+            return sampling.int_to_onehot(X, self.n_feat, np.float32), sampling.int_to_onehot(y, self.n_feat, np.float32)
+        else:
+            return X, y
+
+    def batches(self, batch_size=128, one_hot=True, random_state=None):
+        """
+        This function returns the batches used to train the model with Smiles_generator.fit_stream.
+
+        :param batch_size: number of SMILES in each batch
+        :type batch_size: int
+        :param one_hot: whether to one-hot encode the SMILES or to return the indices of their characters
+        :type one_hot: bool
+        :param random_state: seed or random number generator used to shuffle the SMILES
+        :type random_state: None, int or numpy.random.Generator
+        :return: the batches
+        :rtype: Dataset_batches object
+        """
+
+        return Dataset_batches(self, batch_size, one_hot, random_state)
+
+class Dataset_batches():
+
+    def __init__(self, dataset, batch_size=128, one_hot=True, random_state=None):
+        """
+        This function sets up the batches of a data set. The SMILES are shuffled at every epoch and each batch is
+        only padded to its longest SMILES.
+
+        :param dataset: the data set
+        :type dataset: Tokenized_dataset object
+        :param batch_size: number of SMILES in each batch
+        :type batch_size: int
+        :param one_hot: whether to one-hot encode the SMILES or to return the indices of their characters
+        :type one_hot: bool
+        :param random_state: seed or random number generator used to shuffle the SMILES
+        :type random_state: None, int or numpy.random.Generator
+        """
+
+        utils.check_n_samples(batch_size)
+
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.one_hot = one_hot
+        self.n_feat = dataset.n_feat
+        self.rng = utils.set_random_state(random_state)
+
+    def __len__(self):
+        """
+        This function returns the number of batches in one pass over the data set.
+
+        :return: number of batches
+        :rtype: int
+        """
+
+        return int(np.ceil(len(self.dataset) / self.batch_size))
+
+    def __iter__(self):
+        """
+        This function yields the batches of the data set, passing over it again and again as Keras expects.
+
+        :return: batches of inputs and outputs of the model
+        :rtype: generator of tuples of two numpy arrays
+        """
+
+        while True:
+            for batch in self.epoch():
+                yield batch
+
+    def epoch(self):
+        """
+        This function yields the batches of a single pass over the data set.
+
+        :return: batches of inputs and outputs of the model
+        :rtype: generator of tuples of two numpy arrays
+        """
+
+        order = self.rng.permutation(len(self.dataset))
+
+        for i in range(0, order.shape[0], self.batch_size):
+            # Reading the rows in the order in which they are stored on the disk
+            idx = np.sort(order[i:i+self.batch_size])
+            yield self.dataset.get_X_y(idx, self.one_hot)
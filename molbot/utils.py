@@ -4,8 +4,6 @@
 
 import numpy as np
 
-from sklearn.utils.validation import check_array
-
 def is_array_like(x):
     return isinstance(x, (tuple, list, np.ndarray))
 
@@ -27,6 +25,13 @@ def ceil(a, b):
 class InputError(Exception):
     pass
 
+class EncodingError(InputError):
+    """
+    Raised when a molecule cannot be encoded, because it contains characters that are not in the vocabulary or it is
+    too long.
+    """
+    pass
+
 def set_tensorboard(tb):
     if (tb in (True, False)):
         return tb
@@ -39,6 +44,24 @@ def set_hidden_neurons(h):
     else:
         raise InputError("The number of hidden neurons should be a positive non zero integer. Got %s." % (str(h)))
 
+def set_embedding_dim(embedding_dim):
+    if isinstance(embedding_dim, type(None)) or is_positive_integer(embedding_dim):
+        return embedding_dim
+    else:
+        raise InputError("The embedding dimension should be None or a positive non zero integer. Got %s." % (str(embedding_dim)))
+
+def set_tokenizer(tokenizer):
+    if tokenizer in ["character", "atom"]:
+        return tokenizer
+    else:
+        raise InputError("The tokenizer should be 'character' or 'atom'. Got %s." % (str(tokenizer)))
+
+def set_encoding_policy(policy, allowed_policies):
+    if policy in allowed_policies:
+        return policy
+    else:
+        raise InputError("The policy should be one of %s. Got %s." % (str(allowed_policies), str(policy)))
+
 def _check_float_perc(x):
     if x >= 0.0 and x < 1.0:
         return x
@@ -93,26 +116,43 @@ def set_learning_rate(lr):
     check_lr(lr)
     return lr
 
-def check_X_y(X, y):
+def check_X_y_shapes(X, y):
     """
-    This function checks that the input and output for the estimator have the correct dimensions.
-    :param X: Input one-hot-encoded padded smiles strings
-    :type X: np.array of shape (n_samples, max_len, n_char)
-    :param y: Output one-hot-encoded padded smiles strings
-    :type y: np.array of shape (n_samples, max_len, n_char)
+    This function checks that the input and output for the estimator have compatible shapes, without converting them.
+    :param X: Input one-hot-encoded padded smiles strings or their character indices
+    :type X: np.array of shape (n_samples, max_len, n_char) or (n_samples, max_len)
+    :param y: Output one-hot-encoded padded smiles strings or their character indices
+    :type y: np.array of shape (n_samples, max_len, n_char) or (n_samples, max_len)
 
-    :return: approved arrays X and y
-    :rtype: two np.arrays of shape (n_samples, max_len, n_char)
+    :return: None
     """
     if y is None:
         raise ValueError("y cannot be None")
 
-    if len(X.shape) != 3 or len(y.shape) != 3:
-        raise ValueError("The RNN expects a 3-dimensional input. Got inputs with shape %s and %s", (str(X.shape), str(y.shape)))
+    if len(X.shape) not in (2, 3) or len(X.shape) != len(y.shape):
+        raise ValueError("The RNN expects either 3-dimensional one-hot encoded inputs or 2-dimensional integer inputs. "
+                         "Got inputs with shape %s and %s" % (str(X.shape), str(y.shape)))
 
     if X.shape[0] != y.shape[0]:
         raise ValueError("X and y don't have the same number of samples.")
 
+def check_X_y(X, y):
+    """
+    This function checks that the input and output for the estimator have the correct dimensions. They can either be
+    both one-hot encoded or both contain the indices of the characters.
+    :param X: Input one-hot-encoded padded smiles strings or their character indices
+    :type X: np.array of shape (n_samples, max_len, n_char) or (n_samples, max_len)
+    :param y: Output one-hot-encoded padded smiles strings or their character indices
+    :type y: np.array of shape (n_samples, max_len, n_char) or (n_samples, max_len)
+
+    :return: approved arrays X and y
+    :rtype: two np.arrays of shape (n_samples, max_len, n_char) or (n_samples, max_len)
+    """
+    check_X_y_shapes(X, y)
+
+    # Imported here so that the modules that only generate SMILES do not need to load scikit-learn
+    from sklearn.utils.validation import check_array
+
     X = check_array(X, allow_nd=True)
     y = check_array(y, allow_nd=True)
 
@@ -129,16 +169,66 @@ def check_temperature(T):
     if T <= 0:
         raise ValueError("Temperature parameter should be > 0.0. Got %s" % (str(T)))
 
-def check_maxlength(ml):
+def check_maxlength(ml, X=None):
     """
-    This function checks that the maximum length for the predicted smiles is a positive integer.
+    This function checks that the maximum length for the predicted smiles is an integer that leaves room for at least
+    one character after 'G' and for all the characters of the fragments.
 
     :param ml: maximum smiles length
     :type ml: int
+    :param X: the fragments from which the smiles are predicted
+    :type X: numpy array of shape (n_samples, n_char, n_feat) or (n_samples, n_char) or None
     :return: None
     """
-    if not isinstance(ml, type(int)) and ml <= 0:
-        raise ValueError("The length of the predicted strings should be an integer larger than 0.")
+    if not is_positive_integer(ml) or ml < 2:
+        raise InputError("The length of the predicted strings should be an integer larger than 1. Got %s." % (str(ml)))
+    if not isinstance(X, type(None)) and ml < X.shape[1]:
+        raise InputError("The length of the predicted strings should be at least the length of the fragments (%s). "
+                         "Got %s." % (str(X.shape[1]), str(ml)))
+
+def set_random_state(random_state):
+    """
+    This function turns the random_state parameter into a numpy random number generator.
+
+    :param random_state: seed or random number generator. If None, the generator is seeded from the operating system.
+    :type random_state: None, int or numpy.random.Generator
+    :return: random number generator
+    :rtype: numpy.random.Generator
+    """
+    if isinstance(random_state, np.random.Generator):
+        return random_state
+    elif random_state is None or is_positive_integer(random_state) or random_state == 0:
+        return np.random.default_rng(random_state)
+    else:
+        raise InputError("The random state should be None, a non negative integer or a numpy Generator. Got %s." % (str(random_state)))
+
+def check_n_samples(n):
+    if not is_positive_integer(n):
+        raise InputError("The number of samples should be a positive integer. Got %s." % (str(n)))
+
+def check_top_k(top_k):
+    if not isinstance(top_k, type(None)) and not is_positive_integer(top_k):
+        raise InputError("The number of characters to sample from should be a positive integer. Got %s." % (str(top_k)))
+
+def check_beam_width(beam_width, n_feat):
+    if not is_positive_integer(beam_width) or beam_width > n_feat:
+        raise InputError("The beam width should be a positive integer of at most the number of characters (%i), since "
+                         "the first step cannot find more different beams. Got %s." % (n_feat, str(beam_width)))
+
+def check_top_p(top_p):
+    if not isinstance(top_p, type(None)) and not (_is_numeric(top_p) and 0.0 < top_p <= 1.0):
+        raise InputError("The nucleus probability should be larger than 0 and at most 1. Got %s." % (str(top_p)))
+
+def check_fragment_lengths(fragment_lengths, X):
+    if isinstance(fragment_lengths, type(None)):
+        return
+    if len(np.shape(fragment_lengths)) != 1 or np.shape(fragment_lengths)[0] != X.shape[0]:
+        raise InputError("There should be one fragment length for each sample. Got %s for %s samples." %
+                         (str(np.shape(fragment_lengths)), str(X.shape[0])))
+    if not all(_is_integer(length) for length in np.asarray(fragment_lengths).tolist()):
+        raise InputError("The fragment lengths should be integers. Got %s." % (str(fragment_lengths)))
+    if np.min(fragment_lengths) < 1 or np.max(fragment_lengths) > X.shape[1]:
+        raise InputError("The fragment lengths should be between 1 and %s." % (str(X.shape[1])))
 
 def check_ep(ep):
     if not is_positive_integer(ep):
@@ -151,6 +241,14 @@ def check_lr(lr):
     else:
         raise InputError("The learning rate should be number larger than 0.")
 
+def check_priority_exponent(priority_exponent):
+    if not _is_numeric(priority_exponent) or priority_exponent < 0:
+        raise InputError("The priority exponent should be a non negative number. Got %s." % (str(priority_exponent)))
+
+def check_staleness(staleness):
+    if not (is_positive_integer(staleness) or staleness == 0):
+        raise InputError("The maximum staleness should be a non negative integer. Got %s." % (str(staleness)))
+
 def check_sigma(sigma):
     try:
         sigma = float(sigma)
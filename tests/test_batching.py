@@ -0,0 +1,67 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+from molbot import batching, data_processing
+import numpy as np
+
+smiles = ["CC(=O)NC(CS)C(=O)Oc1ccc(NC(C)=O)cc1", "COc1ccc2CC5C3C=CC(O)C4Oc1c2C34CCN5C", "O=C(C)Oc1ccccc1C(=O)O",
+          "CCO", "c1ccccc1", "CC(C)O", "OCC(O)CO"]
+
+dp = data_processing.Molecules_processing()
+X = dp.onehot_encode(smiles)
+y = np.zeros(X.shape)
+y[:, :-1, :] = X[:, 1:, :]
+y[:, -1, dp.char_to_idx['A']] = 1
+pad_idx = dp.char_to_idx['A']
+
+def test_sequence_lengths():
+
+    expected = [len(smile) + 2 for smile in smiles]
+
+    assert np.all(batching.sequence_lengths(X, pad_idx) == expected)
+    assert np.all(batching.sequence_lengths(np.argmax(X, axis=-1), pad_idx) == expected)
+
+def test_length_batcher():
+
+    batcher = batching.Length_batcher(X, y, pad_idx, batch_size=2, random_state=0)
+    assert len(batcher) == 4
+    assert batcher.n_feat == X.shape[-1]
+
+    batches = list(batcher.epoch())
+    assert len(batches) == 4
+
+    # Each batch is trimmed to its longest SMILES, without losing any character
+    decoded = []
+    for X_batch, y_batch in batches:
+        lengths = batching.sequence_lengths(X_batch, pad_idx)
+        assert X_batch.shape[1] == np.max(lengths)
+        assert y_batch.shape == X_batch.shape
+        decoded += dp.onehot_decode(X_batch)
+    assert sorted(decoded) == sorted(smiles)
+
+    # The two shortest SMILES are batched together
+    assert min(X_batch.shape[1] for X_batch, _ in batches) == len("CC(C)O") + 2
+
+    saved = batcher.padding_saved()
+    assert 0.0 < saved < 1.0
+    timesteps = sum(X_batch.shape[0] * X_batch.shape[1] for X_batch, _ in batches)
+    assert np.isclose(saved, 1.0 - timesteps / (X.shape[0] * X.shape[1]))
+
+def test_int_batcher():
+
+    int_X = np.argmax(X, axis=-1)
+    int_y = np.argmax(y, axis=-1)
+
+    batcher = batching.Length_batcher(int_X, int_y, pad_idx, batch_size=3)
+    assert not batcher.one_hot
+    assert batcher.n_feat == int(np.max(int_X)) + 1
+
+    batches = iter(batcher)
+    n_seen = sum(next(batches)[0].shape[0] for _ in range(2 * len(batcher)))
+    assert n_seen == 2 * X.shape[0]
+
+if __name__ == "__main__":
+    test_sequence_lengths()
+    test_length_batcher()
+    test_int_batcher()
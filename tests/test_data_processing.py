@@ -2,8 +2,10 @@
 # University of Bristol), David Glowacki (University of Bristol). All rights reserved.
 # Licensed under the GPL. See LICENSE in the project root for license information.
 
-from molbot import data_processing
+from molbot import data_processing, utils
+import numpy as np
 import os
+import pickle
 
 def _get_data():
     # Reading the data set
@@ -32,5 +34,220 @@ def test_onehot_encode():
     for i in range(len(molecules)):
         assert molecules[i] == mols[i]
 
+def test_string_to_int():
+    """
+    Testing that the characters are turned into the indices of the sorted vocabulary and padded with G, E and A.
+    """
+
+    molecules = _get_data()
+
+    data_handler = data_processing.Molecules_processing()
+    int_mols = data_handler.string_to_int(molecules)
+
+    vocabulary = sorted(set("".join(molecules)) | {"G", "E", "A"})
+    assert [data_handler.idx_to_char[idx] for idx in range(len(vocabulary))] == vocabulary
+    assert data_handler.max_size == max(len(molecule) for molecule in molecules) + 2
+    assert int_mols.shape == (len(molecules), data_handler.max_size)
+    assert int_mols.dtype == np.int16
+
+    for int_mol, molecule in zip(int_mols, molecules):
+        padded = "G" + molecule + "E" + "A" * (data_handler.max_size - len(molecule) - 2)
+        assert "".join(data_handler.idx_to_char[idx] for idx in int_mol) == padded
+
+    # Characters that are not in the vocabulary and molecules that are too long cannot be encoded
+    try:
+        data_handler.string_to_int(["CC[Xe]"])
+        raise AssertionError("An EncodingError should be raised for unknown characters.")
+    except utils.EncodingError:
+        pass
+    try:
+        data_handler.string_to_int(["C" * data_handler.max_size])
+        raise AssertionError("An EncodingError should be raised for molecules that are too long.")
+    except utils.EncodingError:
+        pass
+
+def test_build_vocabulary():
+    """
+    Testing that the vocabulary built from a stream of molecules, one chunk at a time, is the same as the one found by
+    encoding all the molecules at once.
+    """
+
+    molecules = _get_data()
+
+    for tokenizer in ["character", "atom"]:
+        data_handler = data_processing.Molecules_processing(tokenizer=tokenizer)
+        int_mols = data_handler.string_to_int(molecules)
+
+        streaming_handler = data_processing.Molecules_processing(tokenizer=tokenizer)
+        statistics = streaming_handler.build_vocabulary(iter(molecules), chunk_size=7)
+
+        assert streaming_handler.char_to_idx == data_handler.char_to_idx
+        assert streaming_handler.max_size == data_handler.max_size
+        assert np.all(streaming_handler.string_to_int(molecules) == int_mols)
+
+        lengths = [len(data_handler.tokenize(molecule)) for molecule in molecules]
+        assert statistics["n_molecules"] == len(molecules)
+        assert np.all(statistics["length_counts"] == np.bincount(lengths))
+        assert sum(statistics["char_counts"].values()) == sum(lengths)
+
+def test_encoding_policies():
+    """
+    Testing the molecules with unknown characters and the molecules that are too long.
+    """
+
+    molecules = ["CCO", "c1ccccc1", "CC(C)O"]
+    new_molecules = ["CCN", "CCO", "CCCCCCCCCCCCCCO", "CC"]
+
+    # Skipping the molecules
+    data_handler = data_processing.Molecules_processing(unknown_chars="skip", long_molecules="skip")
+    data_handler.build_vocabulary(molecules)
+    int_mols = data_handler.string_to_int(new_molecules)
+    assert list(data_handler.skipped_idx) == [0, 2]
+    assert data_handler.onehot_decode(int_mols) == ["CCO", "CC"]
+
+    # Replacing the unknown characters and truncating the long molecules
+    data_handler = data_processing.Molecules_processing(unknown_chars="unknown", long_molecules="truncate")
+    data_handler.build_vocabulary(molecules)
+    assert "?" in data_handler.char_to_idx
+    int_mols = data_handler.string_to_int(new_molecules)
+    assert len(data_handler.skipped_idx) == 0
+    decoded = data_handler.onehot_decode(int_mols)
+    assert decoded[0] == "CC?"
+    assert decoded[1] == "CCO"
+    assert decoded[2] == "G" + "C" * (data_handler.max_size - 1)
+    assert decoded[3] == "CC"
+
+    # Raising an exception that can be caught
+    data_handler = data_processing.Molecules_processing()
+    data_handler.build_vocabulary(molecules, max_length=20)
+    assert data_handler.max_size == 22
+    try:
+        data_handler.string_to_int(new_molecules)
+        raise AssertionError("An EncodingError should be raised for unknown characters.")
+    except utils.EncodingError:
+        pass
+
+    try:
+        data_processing.Molecules_processing(unknown_chars="ignore")
+        raise AssertionError("An InputError should be raised for unknown policies.")
+    except utils.InputError:
+        pass
+
+def test_onehot_dtype():
+    """
+    Testing that the one-hot encoding has the type requested and the same values whatever the type.
+    """
+
+    molecules = _get_data()
+
+    data_handler = data_processing.Molecules_processing()
+    hot_mols = data_handler.onehot_encode(molecules)
+    assert hot_mols.dtype == np.int16
+    assert np.all(np.sum(hot_mols, axis=-1) == 1)
+
+    for dtype in [bool, np.uint8, np.float32]:
+        hot_mols_dtype = data_handler.onehot_encode(molecules, dtype=dtype)
+        assert hot_mols_dtype.dtype == dtype
+        assert np.all(hot_mols_dtype == hot_mols)
+
+def test_onehot_decode():
+    """
+    Testing the decoding of character indices, including sequences that were never ended with an 'E' character.
+    """
+
+    molecules = _get_data()
+
+    data_handler = data_processing.Molecules_processing()
+    hot_mols = data_handler.onehot_encode(molecules)
+    int_mols = np.argmax(hot_mols, axis=-1)
+    assert data_handler.onehot_decode(int_mols) == molecules
+
+    rng = np.random.default_rng(0)
+    random_mols = rng.integers(len(data_handler.idx_to_char), size=(50, 20))
+    for int_mol, mol in zip(random_mols, data_handler.onehot_decode(random_mols)):
+        chars = "".join(data_handler.idx_to_char[idx] for idx in int_mol)
+        if "E" in chars:
+            assert mol == chars[1:chars.index("E")]
+        else:
+            assert mol == chars
+
+    assert data_handler.onehot_decode(np.zeros((0, 20), dtype=int)) == []
+
+def test_atom_tokenizer():
+    """
+    Testing that the atom-level tokens round-trip, make shorter sequences and are saved with the data handler.
+    """
+
+    molecules = _get_data() + ["C[C@@H](Cl)c1cc[nH]c1Br", "CC%10CCCCCCCCC%10"]
+
+    char_handler = data_processing.Molecules_processing()
+    atom_handler = data_processing.Molecules_processing(tokenizer="atom")
+    char_mols = char_handler.string_to_int(molecules)
+    atom_mols = atom_handler.string_to_int(molecules)
+
+    assert atom_handler.tokenize("C[C@@H](Cl)c1cc[nH]c1Br") == ["C", "[C@@H]", "(", "Cl", ")", "c", "1", "c", "c",
+                                                                "[nH]", "c", "1", "Br"]
+    assert atom_mols.shape[1] < char_mols.shape[1]
+    assert "%10" in atom_handler.char_to_idx and "[nH]" in atom_handler.char_to_idx
+    assert atom_handler.onehot_decode(atom_handler.onehot_encode(molecules)) == molecules
+
+    atom_handler.save("temp_atom.pickle")
+    loaded_handler = data_processing.Molecules_processing()
+    loaded_handler.load("temp_atom.pickle")
+    os.remove("temp_atom.pickle")
+    assert loaded_handler.tokenizer == "atom"
+    assert np.all(loaded_handler.string_to_int(molecules) == atom_mols)
+
+    hot_fragments, fragment_lengths = loaded_handler.get_fragments(["C[C@@H](Cl", "CBr"])
+    assert list(fragment_lengths) == [5, 3]
+
+    # Files saved before the tokenizer could be chosen are read as split in characters
+    pickle.dump([char_handler.char_to_idx, char_handler.idx_to_char, char_handler.max_size],
+                open("temp_char.pickle", "wb"))
+    loaded_handler.load("temp_char.pickle")
+    os.remove("temp_char.pickle")
+    assert loaded_handler.tokenizer == "character"
+    assert np.all(loaded_handler.string_to_int(molecules) == char_mols)
+
+def test_get_fragments():
+    """
+    Testing that fragments of different lengths are encoded starting with G and padded to the longest fragment.
+    """
+
+    molecules = _get_data()
+
+    data_handler = data_processing.Molecules_processing()
+    data_handler.onehot_encode(molecules)
+    hot_fragments, fragment_lengths = data_handler.get_fragments(["c1cc", "C", "CC(=O)"])
+
+    assert hot_fragments.shape == (3, 7, len(data_handler.idx_to_char))
+    assert list(fragment_lengths) == [5, 2, 7]
+    for hot_fragment, length, fragment in zip(hot_fragments, fragment_lengths, ["c1cc", "C", "CC(=O)"]):
+        chars = "".join(data_handler.idx_to_char[idx] for idx in hot_fragment.argmax(axis=-1)[:length])
+        assert chars == "G" + fragment
+
+def test_get_fragments_skipped():
+    """
+    Testing that the fragments skipped by the encoding policies are left out of the lengths too.
+    """
+
+    data_handler = data_processing.Molecules_processing(unknown_chars="skip")
+    data_handler.build_vocabulary(["CCO", "c1ccccc1", "CC(C)O"])
+    int_fragments, fragment_lengths = data_handler.get_fragments(["CC", "CCN", "c1c"], one_hot=False)
+
+    assert list(data_handler.skipped_idx) == [1]
+    assert list(fragment_lengths) == [3, 4]
+    assert int_fragments.shape == (2, 4)
+    for int_fragment, length, fragment in zip(int_fragments, fragment_lengths, ["CC", "c1c"]):
+        assert "".join(data_handler.idx_to_char[idx] for idx in int_fragment[:length]) == "G" + fragment
+
 if __name__ == "__main__":
     test_onehot_encode()
+    test_string_to_int()
+    test_build_vocabulary()
+    test_encoding_policies()
+    test_onehot_dtype()
+    test_onehot_decode()
+    test_atom_tokenizer()
+    test_get_fragments()
+    test_get_fragments_skipped()
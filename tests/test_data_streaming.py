@@ -0,0 +1,151 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+from molbot import data_streaming, data_processing, utils
+import numpy as np
+import os
+
+smiles = ["CC(=O)NC(CS)C(=O)Oc1ccc(NC(C)=O)cc1", "COc1ccc2CC5C3C=CC(O)C4Oc1c2C34CCN5C", "O=C(C)Oc1ccccc1C(=O)O",
+          "CCO", "c1ccccc1", "CC(C)O", "OCC(O)CO"]
+
+def _write_csv(filename, molecules, header=False):
+    with open(filename, "w") as out_file:
+        if header:
+            out_file.write("smiles,value\n")
+        for i, smile in enumerate(molecules):
+            out_file.write("%s,%i\n\n" % (smile, i))
+
+def test_read_smiles():
+
+    _write_csv("temp_1.csv", smiles[:3], header=True)
+    _write_csv("temp_2.csv", smiles[3:])
+
+    read = list(data_streaming.read_smiles("temp_1.csv", header=True))
+    assert read == smiles[:3]
+
+    read = list(data_streaming.read_smiles(["temp_1.csv", "temp_2.csv"], header=False))
+    assert read[0] == "smiles"
+    assert read[1:4] == smiles[:3]
+
+    os.remove("temp_1.csv")
+    os.remove("temp_2.csv")
+
+def test_split_file():
+
+    _write_csv("temp_1.csv", smiles, header=True)
+
+    # The ranges start at the beginning of a line, so together they contain each SMILES once
+    ranges = data_streaming.split_file("temp_1.csv", 20, header=True)
+    assert len(ranges) > 1
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges[:-1], ranges[1:]))
+    assert ranges[-1][1] == os.path.getsize("temp_1.csv")
+
+    read = []
+    for start, end in ranges:
+        read += data_streaming.read_smiles_range("temp_1.csv", start, end)
+    assert read == smiles
+
+    os.remove("temp_1.csv")
+
+def test_shuffle_buffer():
+
+    rng = np.random.default_rng(0)
+    shuffled = list(data_streaming.shuffle_buffer(range(100), 10, rng))
+
+    assert sorted(shuffled) == list(range(100))
+    assert shuffled != list(range(100))
+
+def test_stream():
+
+    _write_csv("temp_1.csv", smiles)
+
+    dp = data_processing.Molecules_processing()
+    X = dp.onehot_encode(smiles)
+
+    stream = data_streaming.Smiles_stream("temp_1.csv", dp, batch_size=3, buffer_size=4, random_state=0)
+    assert len(stream) == 3
+
+    batches = list(stream.epoch())
+    assert [batch[0].shape[0] for batch in batches] == [3, 3, 1]
+    assert batches[0][0].shape[1:] == X.shape[1:]
+
+    # Each molecule is seen once per epoch and the outputs are the inputs shifted by one character
+    X_epoch = np.concatenate([batch[0] for batch in batches])
+    y_epoch = np.concatenate([batch[1] for batch in batches])
+    assert sorted(dp.onehot_decode(X_epoch)) == sorted(smiles)
+    assert np.all(y_epoch[:, :-1] == X_epoch[:, 1:])
+    assert np.all(np.argmax(y_epoch[:, -1], axis=-1) == dp.char_to_idx['A'])
+
+    # Streaming more batches than in an epoch starts again from the beginning of the file
+    int_stream = data_streaming.Smiles_stream("temp_1.csv", dp, batch_size=4, one_hot=False)
+    int_batches = iter(int_stream)
+    X_int = [next(int_batches)[0] for _ in range(5)]
+    int_batches.close()
+    assert all(len(batch.shape) == 2 for batch in X_int)
+    assert sum(batch.shape[0] for batch in X_int) == 4 + 3 + 4 + 3 + 4
+
+    os.remove("temp_1.csv")
+
+def test_stream_skipped():
+    """
+    Testing that the batches are made of the molecules kept by the data handler, so that the number of batches in an
+    epoch matches len(stream) even when whole batches of molecules are skipped.
+    """
+
+    skipped = ["[Na+].[Cl-]", "[K+].[Br-]", "[Na+].[Br-]"]
+    _write_csv("temp_1.csv", skipped + smiles[:3] + skipped)
+
+    dp = data_processing.Molecules_processing(unknown_chars="skip")
+    dp.onehot_encode(smiles)
+
+    stream = data_streaming.Smiles_stream("temp_1.csv", dp, batch_size=2, buffer_size=1, one_hot=False)
+    assert stream.n_samples == 3
+    assert len(stream) == 2
+
+    batches = iter(stream)
+    X_batches = [next(batches)[0] for _ in range(4)]
+    batches.close()
+    assert [X.shape[0] for X in X_batches] == [2, 1, 2, 1]
+    assert sorted(dp.onehot_decode(np.concatenate(X_batches[:2]))) == sorted(smiles[:3])
+
+    # A data set where all the molecules are skipped raises an error rather than waiting for batches
+    _write_csv("temp_1.csv", skipped)
+    stream = data_streaming.Smiles_stream("temp_1.csv", dp, batch_size=2)
+    try:
+        next(iter(stream))
+        raise AssertionError("An InputError should be raised when no molecules can be encoded.")
+    except utils.InputError:
+        pass
+
+    os.remove("temp_1.csv")
+
+def test_stream_errors():
+
+    _write_csv("temp_1.csv", smiles + ["[Na+].[Cl-]"])
+
+    dp = data_processing.Molecules_processing()
+    try:
+        data_streaming.Smiles_stream("temp_1.csv", dp)
+        raise AssertionError("An InputError should be raised for an empty data handler.")
+    except utils.InputError:
+        pass
+
+    # The error in the background thread is raised in the training loop
+    dp.onehot_encode(smiles)
+    stream = data_streaming.Smiles_stream("temp_1.csv", dp, batch_size=100)
+    try:
+        list(stream.epoch())
+        raise AssertionError("An EncodingError should be raised for the unknown characters.")
+    except utils.EncodingError:
+        pass
+
+    os.remove("temp_1.csv")
+
+if __name__ == "__main__":
+    test_read_smiles()
+    test_split_file()
+    test_shuffle_buffer()
+    test_stream()
+    test_stream_skipped()
+    test_stream_errors()
@@ -0,0 +1,145 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+from molbot import likelihood, data_processing
+import numpy as np
+
+smiles = ["CC(=O)NC(CS)C(=O)Oc1ccc(NC(C)=O)cc1", "COc1ccc2CC5C3C=CC(O)C4Oc1c2C34CCN5C", "O=C(C)Oc1ccccc1C(=O)O",
+          "CCO", "c1ccccc1", "CC(C)O", "OCC(O)CO"]
+
+def _random_prob(shape, rng):
+    prob = rng.random(shape)
+    return prob / np.sum(prob, axis=-1, keepdims=True)
+
+def test_action_mask():
+
+    dp = data_processing.Molecules_processing()
+    int_X = dp.string_to_int(smiles)
+
+    mask = likelihood.action_mask(int_X, dp.char_to_idx['E'])
+    assert mask.shape == (int_X.shape[0], int_X.shape[1] - 1)
+    assert np.all(np.sum(mask, axis=-1) == [len(smile) + 1 for smile in smiles])
+
+def test_loglikelihood():
+
+    rng = np.random.default_rng(0)
+    dp = data_processing.Molecules_processing()
+    int_X = dp.string_to_int(smiles)
+    hot_X = dp.onehot_encode(smiles)
+    end_idx = dp.char_to_idx['E']
+    prob = _random_prob(hot_X.shape, rng)
+
+    # Same as the product of the probabilities of the characters up to 'E'
+    loglikelihood = likelihood.sequence_loglikelihood(prob, int_X, end_idx)
+    for i, smile in enumerate(smiles):
+        n_char = len(smile) + 2
+        expected = np.log(np.prod(prob[i, np.arange(n_char - 1), int_X[i, 1:n_char]]))
+        assert np.isclose(loglikelihood[i], expected)
+
+    assert np.allclose(likelihood.sequence_loglikelihood(prob, hot_X, end_idx), loglikelihood)
+
+    # The probabilities predicted after 'E' do not change the log-likelihood
+    n_char = len(smiles[3]) + 2
+    prob[3, n_char-1:] = _random_prob(prob[3, n_char-1:].shape, rng)
+    assert np.allclose(likelihood.sequence_loglikelihood(prob, int_X, end_idx), loglikelihood)
+
+def test_long_sequences():
+
+    rng = np.random.default_rng(0)
+    n_char = 30
+    int_X = rng.integers(0, n_char - 1, size=(5, 1000))
+    prob = _random_prob((5, 1000, n_char), rng)
+
+    # The product of the probabilities underflows to zero, while the sum of their logarithms is finite
+    action_prob = np.take_along_axis(prob[:, :-1], int_X[:, 1:, np.newaxis], axis=-1)[..., 0]
+    assert np.all(np.prod(action_prob, axis=-1) == 0)
+    loglikelihood = likelihood.sequence_loglikelihood(prob, int_X, n_char - 1)
+    assert np.all(np.isfinite(loglikelihood))
+    assert np.allclose(loglikelihood, np.sum(np.log(action_prob), axis=-1))
+
+    # A character with zero probability does not give an infinite log-likelihood
+    prob[0, 0, int_X[0, 1]] = 0
+    assert np.isfinite(likelihood.sequence_loglikelihood(prob, int_X, n_char - 1)[0])
+
+def test_cache():
+
+    dp = data_processing.Molecules_processing()
+    int_X = dp.string_to_int(smiles)
+    end_idx = dp.char_to_idx['E']
+
+    scored = []
+    def score_fn(sequences):
+        scored.append(sequences.shape[0])
+        return -np.sum(sequences, axis=-1).astype(float)
+
+    cache = likelihood.Loglikelihood_cache(max_size=5)
+    expected = score_fn(int_X)
+    scored.clear()
+
+    # Only the SMILES missing from the cache are scored, and the duplicates in a batch only once
+    loglikelihood = cache.loglikelihood(int_X[[0, 1, 0]], end_idx, score_fn)
+    assert np.allclose(loglikelihood, expected[[0, 1, 0]])
+    assert scored == [2]
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    loglikelihood = cache.loglikelihood(int_X[[1, 2, 3]], end_idx, score_fn)
+    assert np.allclose(loglikelihood, expected[[1, 2, 3]])
+    assert scored == [2, 2]
+    assert np.isclose(cache.hit_rate(), 2.0 / 6)
+
+    # The SMILES used least recently are removed first: 0 and 1 are removed, then 3 rather than 2 that was just used
+    cache.loglikelihood(int_X[[4, 5, 6]], end_idx, score_fn)
+    assert len(cache) == 5
+    cache.loglikelihood(int_X[[2]], end_idx, score_fn)
+    cache.loglikelihood(int_X[[0]], end_idx, score_fn)
+    assert scored == [2, 2, 3, 1]
+    cache.loglikelihood(int_X[[2]], end_idx, score_fn)
+    assert scored == [2, 2, 3, 1]
+    cache.loglikelihood(int_X[[3]], end_idx, score_fn)
+    assert scored == [2, 2, 3, 1, 1]
+
+    # The padding after 'E' is not part of the key
+    padded = np.full((1, int_X.shape[1] + 10), dp.char_to_idx['A'], dtype=int_X.dtype)
+    padded[0, :int_X.shape[1]] = int_X[3]
+    cache.loglikelihood(padded, end_idx, score_fn)
+    assert scored == [2, 2, 3, 1, 1]
+
+def test_loglikelihood_tensor():
+    """
+    Testing that the Keras backend version used in the RL loss gives the same log-likelihood as the numpy version. Keras
+    is only imported here, so that the other tests run without it.
+    """
+
+    import keras.backend as K
+
+    rng = np.random.default_rng(0)
+    dp = data_processing.Molecules_processing()
+    int_X = dp.string_to_int(smiles)
+    hot_X = dp.onehot_encode(smiles).astype(np.float32)
+    end_idx = dp.char_to_idx['E']
+    n_feat = hot_X.shape[-1]
+
+    # The probabilities after 'E' are random too, so the padding has to be masked for the two versions to agree
+    prob = _random_prob(hot_X.shape, rng).astype(np.float32)
+    prob[0, 0, int_X[0, 1]] = 0
+    expected = likelihood.sequence_loglikelihood(prob, int_X, end_idx)
+
+    prob_placeholder = K.placeholder(shape=(None, None, n_feat))
+    int_placeholder = K.placeholder(shape=(None, None))
+    hot_placeholder = K.placeholder(shape=(None, None, n_feat))
+
+    int_function = K.function([prob_placeholder, int_placeholder],
+                              [likelihood.sequence_loglikelihood_tensor(prob_placeholder, int_placeholder, end_idx)])
+    hot_function = K.function([prob_placeholder, hot_placeholder],
+                              [likelihood.sequence_loglikelihood_tensor(prob_placeholder, hot_placeholder, end_idx)])
+
+    assert np.allclose(int_function([prob, int_X.astype(np.float32)])[0], expected, rtol=1e-6, atol=1e-6)
+    assert np.allclose(hot_function([prob, hot_X])[0], expected, rtol=1e-6, atol=1e-6)
+
+if __name__ == "__main__":
+    test_action_mask()
+    test_loglikelihood()
+    test_long_sequences()
+    test_cache()
+    test_loglikelihood_tensor()
@@ -0,0 +1,236 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+from molbot import numpy_engine, data_processing, utils
+import numpy as np
+import os
+import re
+import subprocess
+import sys
+
+smiles = ["CC(=O)NC(CS)C(=O)Oc1ccc(NC(C)=O)cc1", "COc1ccc2CC5C3C=CC(O)C4Oc1c2C34CCN5C", "O=C(C)Oc1ccccc1C(=O)O"]
+
+def _make_weights(filename, n_feat, n_hidden=8):
+    """
+    Saves random weights in the same format as Smiles_generator.export_weights.
+    """
+    rng = np.random.default_rng(0)
+    weights = {"n_lstm": 2}
+    for i, n_in in enumerate([n_feat, n_hidden]):
+        weights["lstm_%i_kernel" % i] = rng.normal(size=(n_in, 4*n_hidden))
+        weights["lstm_%i_recurrent_kernel" % i] = rng.normal(size=(n_hidden, 4*n_hidden))
+        weights["lstm_%i_bias" % i] = rng.normal(size=(4*n_hidden,))
+        weights["lstm_%i_activation" % i] = "tanh"
+        weights["lstm_%i_recurrent_activation" % i] = "hard_sigmoid"
+    weights["dense_kernel"] = rng.normal(size=(n_hidden, n_feat))
+    weights["dense_bias"] = rng.normal(size=(n_feat,))
+    np.savez(filename, **weights)
+
+def test_no_keras():
+    """
+    Testing that generating with numpy does not import Keras. This is done in a new process, since the other tests may
+    have already imported Keras.
+    """
+
+    code = "import sys; from molbot import numpy_engine, data_processing; assert 'keras' not in sys.modules"
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    subprocess.check_call([sys.executable, "-c", code], cwd=os.path.join(current_dir, ".."))
+
+def test_numpy_generator():
+    """
+    Testing that the numpy generator is reproducible and that its output can be decoded.
+    """
+
+    dp = data_processing.Molecules_processing()
+    dp.onehot_encode(smiles)
+    n_feat = len(dp.idx_to_char)
+    _make_weights("temp_weights.npz", n_feat)
+
+    generator = numpy_engine.Numpy_generator("temp_weights.npz")
+    os.remove("temp_weights.npz")
+
+    hot_pred_1 = generator.predict(dp.get_empty(4), temperature=0.75, max_length=30, random_state=3, data_handler=dp)
+    hot_pred_2 = generator.predict(dp.get_empty(4), temperature=0.75, max_length=30, random_state=3, data_handler=dp)
+
+    assert hot_pred_1.shape == (4, 30, n_feat)
+    assert np.all(hot_pred_1 == hot_pred_2)
+    assert len(dp.onehot_decode(hot_pred_1)) == 4
+    assert len(list(generator.generate_iter(dp, n_total=6, batch_size=4, max_length=30))) == 6
+
+def test_step_probabilities():
+    """
+    Testing that the probabilities of the next character are normalised and that the states are carried forward.
+    """
+
+    _make_weights("temp_weights.npz", 5)
+    generator = numpy_engine.Numpy_generator("temp_weights.npz")
+    os.remove("temp_weights.npz")
+
+    states = generator.initial_states(3)
+    prob_1, states = generator.step(np.array([0, 1, 2]), states)
+    prob_2, states = generator.step(np.array([0, 1, 2]), states)
+
+    assert prob_1.shape == (3, 5)
+    assert np.allclose(np.sum(prob_1, axis=-1), 1)
+    assert not np.allclose(prob_1, prob_2)
+
+def test_constrained_generation():
+    """
+    Testing that the SMILES generated with the grammar constraints have balanced branches and closed rings.
+    """
+
+    dp = data_processing.Molecules_processing()
+    dp.onehot_encode(smiles)
+    _make_weights("temp_weights.npz", len(dp.idx_to_char))
+    generator = numpy_engine.Numpy_generator("temp_weights.npz")
+    os.remove("temp_weights.npz")
+
+    hot_pred = generator.predict(dp.get_empty(50), max_length=60, random_state=0, data_handler=dp, constrained=True)
+
+    for smile in dp.onehot_decode(hot_pred):
+        # Strings that did not finish within max_length are not decoded
+        if smile.startswith("G"):
+            continue
+        # The digits inside brackets are not ring closures
+        smile = re.sub(r"\[[^\]]*\]", "", smile)
+        assert smile.count("(") == smile.count(")")
+        for digit in "123456789":
+            assert smile.count(digit) % 2 == 0
+
+def test_embedding():
+    """
+    Testing that a model with an embedding layer generates the same molecules from the character indices as the
+    equivalent model without it does from the one-hot encoded characters.
+    """
+
+    dp = data_processing.Molecules_processing()
+    dp.onehot_encode(smiles)
+    n_feat = len(dp.idx_to_char)
+
+    _make_weights("temp_weights.npz", n_feat)
+    weights = dict(np.load("temp_weights.npz"))
+    embeddings = np.random.default_rng(1).normal(size=(n_feat, 3))
+    kernel = np.random.default_rng(2).normal(size=(3, weights["lstm_0_kernel"].shape[-1]))
+
+    weights["lstm_0_kernel"] = np.dot(embeddings, kernel)
+    np.savez("temp_weights.npz", **weights)
+    hot_generator = numpy_engine.Numpy_generator("temp_weights.npz")
+
+    weights["embeddings"] = embeddings
+    weights["lstm_0_kernel"] = kernel
+    np.savez("temp_weights.npz", **weights)
+    int_generator = numpy_engine.Numpy_generator("temp_weights.npz")
+    os.remove("temp_weights.npz")
+
+    hot_pred = hot_generator.predict(dp.get_empty(4), max_length=30, random_state=5, data_handler=dp)
+    int_pred = int_generator.predict(dp.get_empty(4, one_hot=False), max_length=30, random_state=5, data_handler=dp)
+
+    assert int_pred.shape == (4, 30)
+    assert np.all(np.argmax(hot_pred, axis=-1) == int_pred)
+    assert dp.onehot_decode(hot_pred) == dp.onehot_decode(int_pred)
+
+def test_generate_parallel():
+    """
+    Testing that the molecules generated in parallel do not depend on the number of processes.
+    """
+
+    dp = data_processing.Molecules_processing()
+    dp.onehot_encode(smiles)
+    _make_weights("temp_weights.npz", len(dp.idx_to_char))
+
+    smiles_1 = numpy_engine.generate_parallel("temp_weights.npz", dp, n_total=25, n_workers=1, chunk_size=10,
+                                              max_length=30, random_state=5)
+    smiles_2 = numpy_engine.generate_parallel("temp_weights.npz", dp, n_total=25, n_workers=3, chunk_size=10,
+                                              max_length=30, random_state=5)
+    os.remove("temp_weights.npz")
+
+    assert len(smiles_1) == 25
+    assert smiles_1 == smiles_2
+
+    # The processes generate character indices, which give the same molecules as the one-hot encoded fragments
+    _make_weights("temp_weights.npz", len(dp.idx_to_char))
+    generator = numpy_engine.Numpy_generator("temp_weights.npz")
+    os.remove("temp_weights.npz")
+    hot_pred = generator.predict(dp.get_empty(5), max_length=30, random_state=2, data_handler=dp)
+    int_pred = generator.predict(dp.get_empty(5, one_hot=False), max_length=30, random_state=2, data_handler=dp)
+    assert dp.onehot_decode(hot_pred) == dp.onehot_decode(int_pred)
+
+def test_max_length_errors():
+    """
+    Testing that a maximum length too short for the fragments raises an InputError rather than crashing.
+    """
+
+    dp = data_processing.Molecules_processing()
+    dp.onehot_encode(smiles)
+    _make_weights("temp_weights.npz", len(dp.idx_to_char))
+    generator = numpy_engine.Numpy_generator("temp_weights.npz")
+    os.remove("temp_weights.npz")
+
+    fragments, _ = dp.get_fragments(["CC(=O)"])
+    for call in [lambda: generator.predict(dp.get_empty(2), max_length=1, data_handler=dp),
+                 lambda: generator.predict(fragments, max_length=5, data_handler=dp),
+                 lambda: generator.beam_search(fragments, dp, beam_width=2, max_length=5),
+                 lambda: list(generator.generate_iter(dp, n_total=2, max_length=1))]:
+        try:
+            call()
+            raise AssertionError("An InputError should be raised for a maximum length that is too short.")
+        except utils.InputError:
+            pass
+
+def test_fragment_lengths_list():
+    """
+    Testing that the fragment lengths can be given as a list, and that lengths that are not integers raise an InputError.
+    """
+
+    dp = data_processing.Molecules_processing()
+    dp.onehot_encode(smiles)
+    _make_weights("temp_weights.npz", len(dp.idx_to_char))
+    generator = numpy_engine.Numpy_generator("temp_weights.npz")
+    os.remove("temp_weights.npz")
+
+    fragments, fragment_lengths = dp.get_fragments(["CC(=O)", "C"])
+    hot_pred_array = generator.predict(fragments, max_length=30, random_state=0, data_handler=dp,
+                                       fragment_lengths=fragment_lengths)
+    hot_pred_list = generator.predict(fragments, max_length=30, random_state=0, data_handler=dp,
+                                      fragment_lengths=list(fragment_lengths))
+    assert np.all(hot_pred_array == hot_pred_list)
+
+    try:
+        generator.predict(fragments, max_length=30, data_handler=dp, fragment_lengths=[4.5, 2])
+        raise AssertionError("An InputError should be raised for fragment lengths that are not integers.")
+    except utils.InputError:
+        pass
+
+def test_beam_width_errors():
+    """
+    Testing that a beam width larger than the number of characters raises an InputError.
+    """
+
+    dp = data_processing.Molecules_processing()
+    dp.onehot_encode(smiles)
+    n_feat = len(dp.idx_to_char)
+    _make_weights("temp_weights.npz", n_feat)
+    generator = numpy_engine.Numpy_generator("temp_weights.npz")
+    os.remove("temp_weights.npz")
+
+    int_pred, log_likelihood = generator.beam_search(dp.get_empty(1), dp, beam_width=n_feat, max_length=10)
+    assert np.all(np.isfinite(log_likelihood))
+
+    for beam_width in [0, n_feat + 1]:
+        try:
+            generator.beam_search(dp.get_empty(1), dp, beam_width=beam_width, max_length=10)
+            raise AssertionError("An InputError should be raised for a beam width of %i." % beam_width)
+        except utils.InputError:
+            pass
+
+if __name__ == "__main__":
+    test_no_keras()
+    test_numpy_generator()
+    test_step_probabilities()
+    test_constrained_generation()
+    test_embedding()
+    test_generate_parallel()
+    test_max_length_errors()
+    test_fragment_lengths_list()
+    test_beam_width_errors()
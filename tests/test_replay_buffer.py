@@ -0,0 +1,73 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+from molbot import replay_buffer, utils
+import numpy as np
+
+def _episodes(rewards, length=6):
+    # Each sequence is filled with its reward, to check that the three arrays stay aligned
+    rewards = np.asarray(rewards, dtype=np.float32)
+    sequences = np.repeat(rewards[:, np.newaxis], length, axis=1).astype(np.int16)
+    return sequences, -rewards, rewards
+
+def test_insert():
+
+    buffer = replay_buffer.Replay_buffer(5, random_state=0)
+    buffer.insert(*_episodes([3, 1, 4]))
+    assert len(buffer) == 3
+
+    # Only the largest rewards among the stored and the new episodes are kept
+    buffer.insert(*_episodes([1, 5, 9, 2, 6]))
+    assert len(buffer) == 5
+    assert sorted(buffer.rewards) == [3, 4, 5, 6, 9]
+    assert np.all(buffer.sequences[:, 0] == buffer.rewards)
+    assert np.all(buffer.prior_loglikelihoods == -buffer.rewards)
+
+    buffer.insert(*_episodes([0, 1]))
+    assert sorted(buffer.rewards) == [3, 4, 5, 6, 9]
+
+def test_sample():
+
+    buffer = replay_buffer.Replay_buffer(100, random_state=0)
+    buffer.insert(*_episodes(np.arange(100)))
+
+    sequences, prior_loglikelihoods, rewards = buffer.sample(10)
+    assert sequences.shape == (10, 6)
+    assert len(np.unique(rewards)) == 10
+    assert np.all(sequences[:, 0] == rewards)
+    assert np.all(prior_loglikelihoods == -rewards)
+
+    # A large priority exponent almost always draws the episodes with the largest rewards
+    _, _, rewards = buffer.sample(5, priority_exponent=10.0)
+    assert sorted(rewards) == [95, 96, 97, 98, 99]
+
+    assert buffer.sample(1000)[0].shape[0] == 100
+
+def test_errors():
+
+    buffer = replay_buffer.Replay_buffer(5)
+    try:
+        buffer.sample(2)
+        raise AssertionError("An InputError should be raised for an empty buffer.")
+    except utils.InputError:
+        pass
+
+    sequences, prior_loglikelihoods, rewards = _episodes([1, 2, 3])
+    try:
+        buffer.insert(sequences, prior_loglikelihoods[:2], rewards)
+        raise AssertionError("An InputError should be raised for a missing log-likelihood.")
+    except utils.InputError:
+        pass
+
+    buffer.insert(sequences, prior_loglikelihoods, rewards)
+    try:
+        buffer.insert(*_episodes([1, 2, 3], length=7))
+        raise AssertionError("An InputError should be raised for sequences of a different length.")
+    except utils.InputError:
+        pass
+
+if __name__ == "__main__":
+    test_insert()
+    test_sample()
+    test_errors()
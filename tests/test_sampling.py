@@ -0,0 +1,177 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+from molbot import sampling
+import numpy as np
+
+n_feat = 5
+
+def _counting_step(int_chars, states):
+    """
+    Step function that always predicts the character after the last one and counts the number of steps in its state.
+    """
+    prob = np.zeros((int_chars.shape[0], n_feat))
+    prob[np.arange(int_chars.shape[0]), (int_chars + 1) % n_feat] = 1
+    return prob, [states[0] + 1]
+
+def test_onehot_round_trip():
+    """
+    Testing that turning character indices into one-hot arrays and back returns the same indices.
+    """
+
+    int_seq = np.random.randint(0, n_feat, size=(4, 7))
+    hot_seq = sampling.int_to_onehot(int_seq, n_feat)
+
+    assert hot_seq.shape == (4, 7, n_feat)
+    assert np.all(np.sum(hot_seq, axis=-1) == 1)
+    assert np.all(sampling.onehot_to_int(hot_seq) == int_seq)
+
+def test_sample_categorical():
+    """
+    Testing that the vectorised sampling is reproducible and follows the probability distribution of each sequence.
+    """
+
+    prob = np.array([[0.0, 0.5, 0.0, 0.5, 0.0], [1.0, 0.0, 0.0, 0.0, 0.0], [0.1, 0.2, 0.3, 0.2, 0.2]])
+    prob = np.repeat(prob, 20000, axis=0)
+
+    idx_1 = sampling.sample_categorical(prob, np.random.default_rng(1))
+    idx_2 = sampling.sample_categorical(prob, np.random.default_rng(1))
+    assert np.all(idx_1 == idx_2)
+
+    for i in range(3):
+        frequencies = np.bincount(idx_1[i*20000:(i+1)*20000], minlength=n_feat) / 20000
+        assert np.allclose(frequencies, prob[i*20000], atol=0.02)
+
+def test_generate():
+    """
+    Testing that the fragment is kept, that the states are carried forward and that the sampled characters come from
+    the predicted distribution.
+    """
+
+    fragment = sampling.int_to_onehot(np.array([[0, 3], [2, 2]]), n_feat)
+    states = [np.zeros(2)]
+
+    def step_fn(int_chars, states):
+        step_fn.states = states
+        return _counting_step(int_chars, states)
+
+    hot_pred = sampling.generate(step_fn, states, fragment, max_length=6, rng=np.random.default_rng(0))
+    int_pred = sampling.onehot_to_int(hot_pred)
+
+    assert hot_pred.shape == (2, 6, n_feat)
+    assert np.all(int_pred == np.array([[0, 3, 4, 0, 1, 2], [2, 2, 3, 4, 0, 1]]))
+    assert np.all(step_fn.states[0] == 4)
+
+def test_fragment_lengths():
+    """
+    Testing that fragments of different lengths are kept and that each sequence is sampled after its own fragment.
+    """
+
+    fragment = sampling.int_to_onehot(np.array([[0, 3, 3], [2, 0, 0], [1, 2, 0]]), n_feat)
+    fragment_lengths = np.array([3, 1, 2])
+
+    hot_pred = sampling.generate(_counting_step, [np.zeros(3)], fragment, max_length=6,
+                                 rng=np.random.default_rng(0), fragment_lengths=fragment_lengths)
+    int_pred = sampling.onehot_to_int(hot_pred)
+
+    assert np.all(int_pred == np.array([[0, 3, 3, 4, 0, 1], [2, 3, 4, 0, 1, 2], [1, 2, 3, 4, 0, 1]]))
+
+def test_early_termination():
+    """
+    Testing that finished sequences are removed from the batch, padded, and that the generation stops when all the
+    sequences have finished.
+    """
+
+    fragment = sampling.int_to_onehot(np.array([[0], [2]]), n_feat)
+    end_idx, pad_idx = 3, 4
+
+    def step_fn(int_chars, states):
+        step_fn.n_calls += 1
+        step_fn.batch_sizes.append(int_chars.shape[0])
+        assert states[0].shape[0] == int_chars.shape[0]
+        return _counting_step(int_chars, states)
+    step_fn.n_calls = 0
+    step_fn.batch_sizes = []
+
+    hot_pred = sampling.generate(step_fn, [np.zeros(2)], fragment, max_length=10, rng=np.random.default_rng(0),
+                                 end_idx=end_idx, pad_idx=pad_idx)
+    int_pred = sampling.onehot_to_int(hot_pred)
+
+    assert hot_pred.shape == (2, 10, n_feat)
+    assert np.all(int_pred == np.array([[0, 1, 2, 3, 4, 4, 4, 4, 4, 4], [2, 3, 4, 4, 4, 4, 4, 4, 4, 4]]))
+    assert step_fn.batch_sizes == [2, 1, 1]
+
+def test_generate_iter():
+    """
+    Testing that the finished sequences are yielded as soon as they finish and that the slots of the batch are refilled
+    until the requested number of sequences has been generated.
+    """
+
+    start_idx, end_idx, pad_idx = 0, 3, 4
+
+    def step_fn(int_chars, states):
+        step_fn.batch_sizes.append(int_chars.shape[0])
+        return _counting_step(int_chars, states)
+    step_fn.batch_sizes = []
+
+    def initial_states(n_samples):
+        return [np.zeros(n_samples)]
+
+    finished = list(sampling.generate_iter(step_fn, initial_states, start_idx, end_idx, pad_idx, n_total=5,
+                                           batch_size=2, max_length=6, rng=np.random.default_rng(0)))
+    all_finished = np.concatenate(finished)
+
+    assert len(finished) == 3
+    assert all_finished.shape == (5, 6)
+    assert np.all(all_finished == np.array([[0, 1, 2, 3, 4, 4]]))
+    assert step_fn.batch_sizes == [2, 2, 2] * 2 + [1, 1, 1]
+
+def test_filters():
+    """
+    Testing that top-k and nucleus filtering keep the right characters and renormalise the probabilities.
+    """
+
+    prob = np.array([[0.1, 0.4, 0.2, 0.3, 0.0], [0.5, 0.05, 0.05, 0.3, 0.1]])
+
+    top_2 = sampling.top_k_filter(prob, 2)
+    assert np.allclose(top_2, np.array([[0, 4/7, 0, 3/7, 0], [0.625, 0, 0, 0.375, 0]]))
+
+    nucleus = sampling.nucleus_filter(prob, 0.75)
+    assert np.allclose(nucleus, np.array([[0, 4/9, 2/9, 3/9, 0], [0.625, 0, 0, 0.375, 0]]))
+
+    assert np.allclose(sampling.nucleus_filter(prob, 1.0), prob)
+
+def test_beam_search():
+    """
+    Testing that the beam search returns the most likely completions, sorted by likelihood.
+    """
+
+    end_idx, pad_idx = 3, 4
+    prob = np.array([[0.05, 0.6, 0.3, 0.05, 0.0],
+                     [0.1, 0.1, 0.1, 0.7, 0.0],
+                     [0.1, 0.1, 0.1, 0.7, 0.0],
+                     [0.2, 0.2, 0.2, 0.2, 0.2],
+                     [0.2, 0.2, 0.2, 0.2, 0.2]])
+
+    def step_fn(int_chars, states):
+        # The probability of the next character only depends on the last one
+        return prob[int_chars], states
+
+    fragment = sampling.int_to_onehot(np.array([[0]]), 5)
+    int_pred, log_likelihood = sampling.beam_search(step_fn, [np.zeros(2)], fragment, max_length=5, beam_width=2,
+                                                    end_idx=end_idx, pad_idx=pad_idx)
+
+    assert int_pred.shape == (1, 2, 5)
+    assert np.all(int_pred[0] == np.array([[0, 1, 3, 4, 4], [0, 2, 3, 4, 4]]))
+    assert np.allclose(log_likelihood[0], np.log([0.6*0.7, 0.3*0.7]))
+
+if __name__ == "__main__":
+    test_onehot_round_trip()
+    test_sample_categorical()
+    test_generate()
+    test_fragment_lengths()
+    test_early_termination()
+    test_generate_iter()
+    test_filters()
+    test_beam_search()
@@ -3,8 +3,10 @@
 # Licensed under the GPL. See LICENSE in the project root for license information.
 
 from molbot import smiles_generator as sg
-from molbot import data_processing, reinforcement_learning
+from molbot import data_processing, reinforcement_learning, numpy_engine, data_streaming, batching, tokenized_dataset
+from molbot import step_model
 import os
+import shutil
 import numpy as np
 
 # Data for the tests
@@ -54,6 +56,169 @@ def test_model():
     estimator.fit(X, y)
     estimator.predict(X_pred)
 
+def test_early_termination():
+
+    estimator = sg.Smiles_generator()
+    estimator.fit(X, y)
+    X_hot = estimator.predict(X_pred, max_length=50, data_handler=dp)
+
+    assert X_hot.shape == (3, 50, X.shape[-1])
+    assert np.all(np.sum(X_hot, axis=-1) == 1)
+
+def test_generate_iter():
+
+    estimator = sg.Smiles_generator()
+    estimator.fit(X, y)
+    smiles_iter = estimator.generate_iter(dp, n_total=7, batch_size=3, max_length=50, random_state=0)
+
+    assert len(list(smiles_iter)) == 7
+
+def test_cached_step_models():
+    """
+    Testing that predicting does not modify the trained model and that the single step models are reused.
+    """
+
+    estimator = sg.Smiles_generator()
+    estimator.fit(X, y)
+    n_layers = len(estimator.model.layers)
+
+    estimator.predict(X_pred, temperature=0.75, max_length=20)
+    step = estimator._get_step_model(0.75)
+    estimator.predict(X_pred, temperature=0.5, max_length=20)
+    estimator.predict(X_pred, temperature=0.75, max_length=20)
+
+    assert len(estimator.model.layers) == n_layers
+    assert estimator._get_step_model(0.75) is step
+    assert len(estimator._step_models) == 2
+
+def test_numpy_engine():
+    """
+    Testing that the numpy generator predicts the same probabilities as the Keras model.
+    """
+
+    estimator = sg.Smiles_generator()
+    estimator.fit(X, y)
+    estimator.export_weights("temp.npz")
+
+    generator = numpy_engine.Numpy_generator("temp.npz")
+    os.remove("temp.npz")
+
+    keras_prob = estimator.model.predict(X)
+
+    int_X = np.argmax(X, axis=-1)
+    states = generator.initial_states(X.shape[0])
+    for i in range(X.shape[1]):
+        numpy_prob, states = generator.step(int_X[:, i], states)
+        assert np.allclose(numpy_prob, keras_prob[:, i], atol=1e-5)
+
+def test_decoding_modes():
+
+    estimator = sg.Smiles_generator()
+    estimator.fit(X, y)
+
+    estimator.predict(X_pred, max_length=50, data_handler=dp, top_k=3)
+    estimator.predict(X_pred, max_length=50, data_handler=dp, top_p=0.9)
+    estimator.predict(X_pred, max_length=50, data_handler=dp, constrained=True)
+    X_beam, log_likelihood = estimator.beam_search(X_pred, dp, beam_width=4, max_length=50)
+
+    assert X_beam.shape == (12, 50, X.shape[-1])
+    assert np.all(np.diff(log_likelihood, axis=-1) <= 0)
+
+def test_fragments():
+
+    estimator = sg.Smiles_generator()
+    estimator.fit(X, y)
+
+    X_frag, fragment_lengths = dp.get_fragments(["CC(=O)", "c1c", "O"])
+    X_hot = estimator.predict(X_frag, max_length=50, data_handler=dp, fragment_lengths=fragment_lengths)
+
+    for i, length in enumerate(fragment_lengths):
+        assert np.all(np.argmax(X_hot[i, :length], axis=-1) == np.argmax(X_frag[i, :length], axis=-1))
+
+def test_int_input():
+    """
+    Testing that a model can be trained on the indices of the characters and that its predictions are indices too.
+    """
+
+    int_X = dp.string_to_int(smiles)
+    int_y = np.full(int_X.shape, dp.char_to_idx['A'], dtype=int_X.dtype)
+    int_y[:, :-1] = int_X[:, 1:]
+
+    estimator = sg.Smiles_generator(epochs=2, embedding_dim=8)
+    estimator.fit(int_X, int_y, n_char=len(dp.idx_to_char))
+
+    int_pred = estimator.predict(dp.get_empty(3, one_hot=False), max_length=50, random_state=0, data_handler=dp)
+    assert int_pred.shape == (3, 50)
+    assert len(dp.onehot_decode(int_pred)) == 3
+
+    estimator.export_weights("temp.npz")
+    generator = numpy_engine.Numpy_generator("temp.npz")
+    os.remove("temp.npz")
+
+    keras_prob = estimator.model.predict(int_X)
+    states = generator.initial_states(int_X.shape[0])
+    for i in range(int_X.shape[1]):
+        numpy_prob, states = generator.step(int_X[:, i], states)
+        assert np.allclose(numpy_prob, keras_prob[:, i], atol=1e-5)
+
+def test_fit_stream():
+    """
+    Testing that the model can be trained on SMILES streamed from a file, both one-hot encoded and as indices.
+    """
+
+    with open("temp_smiles.csv", "w") as out_file:
+        for smile in smiles:
+            out_file.write(smile + "\n")
+
+    for one_hot in [True, False]:
+        stream = data_streaming.Smiles_stream("temp_smiles.csv", dp, batch_size=2, one_hot=one_hot, random_state=0)
+        estimator = sg.Smiles_generator(epochs=2)
+        estimator.fit_stream(stream, validation_stream=stream)
+        pred = estimator.predict(dp.get_empty(3, one_hot=one_hot), max_length=50, data_handler=dp)
+        assert len(dp.onehot_decode(pred)) == 3
+
+    os.remove("temp_smiles.csv")
+
+def test_length_batcher():
+    """
+    Testing that the model can be trained on batches that are only padded to their longest SMILES.
+    """
+
+    batcher = batching.Length_batcher(X, y, dp.char_to_idx['A'], batch_size=2, random_state=0)
+    estimator = sg.Smiles_generator(epochs=2)
+    estimator.fit_stream(batcher)
+    estimator.predict(X_pred, max_length=50, data_handler=dp)
+
+def test_tokenized_dataset():
+    """
+    Testing that the model can be trained on a memory-mapped data set.
+    """
+
+    tokenized_dataset.write_dataset("temp_dataset", smiles, dp)
+    dataset = tokenized_dataset.Tokenized_dataset("temp_dataset")
+
+    estimator = sg.Smiles_generator(epochs=2)
+    estimator.fit_stream(dataset.batches(batch_size=2, one_hot=False, random_state=0))
+    estimator.predict(dp.get_empty(3, one_hot=False), max_length=50, data_handler=dp)
+
+    del dataset
+    shutil.rmtree("temp_dataset")
+
+def test_stateful_prediction():
+    """
+    Testing that the single step model samples the same molecules as feeding the whole sequence at every step.
+    """
+
+    estimator = sg.Smiles_generator()
+    estimator.fit(X, y)
+
+    X_stateful = estimator.predict(X_pred, temperature=0.75, max_length=20, random_state=0)
+
+    reference_model = step_model.whole_sequence_model(estimator.model, 0.75)
+    X_reference = step_model.whole_sequence_pred(X_pred, reference_model, 20, np.random.default_rng(0))
+
+    assert np.all(X_stateful == X_reference)
+
 def test_resume():
 
     estimator = sg.Smiles_generator()
@@ -79,6 +244,60 @@ def test_reload_fit():
     estimator.load(filename="temp.h5")
     estimator.fit(X, y)
 
+def _length_reward(smiles):
+    """
+    Rewards the SMILES by their length, so that the reinforcement learning can be tested without RDKit.
+    """
+
+    return [len(smi) / 10.0 for smi in smiles]
+
+def test_rl_pipeline():
+
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    model_file = os.path.join(current_dir, "temp.h5")
+    data_handler_file = os.path.join(current_dir, "temp.pickle")
+    rl = reinforcement_learning.Reinforcement_learning(model_file=model_file, data_handler_file=data_handler_file,
+                                                       reward_function=_length_reward, random_state=0)
+
+    # Counting the updates of the agent
+    n_updates = [0]
+    generate_training_fn = rl._generate_rl_training_fn
+
+    def counting_training_fn(*args):
+        training_function = generate_training_fn(*args)
+
+        def counted(inputs):
+            n_updates[0] += 1
+            return training_function(inputs)
+
+        return counted
+
+    rl._generate_rl_training_fn = counting_training_fn
+
+    for max_staleness in [1, 0]:
+        n_updates[0] = 0
+        weights_before = rl.agent.get_weights()
+        rl.train(epochs=3, n_train_episodes=4, asynchronous=True, max_staleness=max_staleness)
+        assert n_updates[0] == 3
+        assert any(not np.allclose(before, after) for before, after in zip(weights_before, rl.agent.get_weights()))
+        assert sorted(rl.utilisation.keys()) == ["generation", "reward", "training"]
+
+    # The episodes are sampled at the requested temperature
+    assert rl.agent_step.temperature == 0.75
+    rl.train(epochs=1, n_train_episodes=4, temperature=1.5)
+    assert rl.agent_step.temperature == 1.5
+
+    # An error in the reward function is raised in the training loop
+    def failing_reward(smiles):
+        raise ValueError("Reward failure")
+
+    rl.reward_function = failing_reward
+    try:
+        rl.train(epochs=2, n_train_episodes=4, asynchronous=True)
+        raise Exception
+    except ValueError:
+        pass
+
 def test_rl():
     """
     This test requires RDKit to be installed. It is skipped if RDKit is not installed.
@@ -95,6 +314,11 @@ def test_rl():
                                                            data_handler_file=data_handler_file,
                                                            reward_function=reward_f)
         rl.train(temperature=0.75, epochs=2, n_train_episodes=5, sigma=60)
+        rl.train(temperature=0.75, epochs=2, n_train_episodes=5, sigma=60, batch_size=2)
+        rl.train(temperature=0.75, epochs=3, n_train_episodes=5, sigma=60, asynchronous=True)
+        assert sorted(rl.utilisation.keys()) == ["generation", "reward", "training"]
+        assert all(0 <= fraction <= 1 for fraction in rl.utilisation.values())
+        rl.train(temperature=0.75, epochs=3, n_train_episodes=5, sigma=60, asynchronous=True, max_staleness=0)
         rl.save("rl_model.h5")
         os.remove("temp.h5")
     except ModuleNotFoundError:
@@ -122,9 +346,21 @@ if __name__ == "__main__":
     test_set_tb()
     test_hidden_neurons()
     test_set_dropout()
+    test_stateful_prediction()
+    test_early_termination()
+    test_generate_iter()
+    test_cached_step_models()
+    test_numpy_engine()
+    test_decoding_modes()
+    test_fragments()
+    test_int_input()
+    test_fit_stream()
+    test_length_batcher()
+    test_tokenized_dataset()
     test_resume()
     test_save()
     test_reload_fit()
     test_reload_predict()
+    test_rl_pipeline()
     test_rl()
     test_after_rl()
@@ -0,0 +1,70 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+from molbot import data_processing, smiles_grammar
+import numpy as np
+import os
+
+def _get_data():
+    # Reading the data set
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    data_path = os.path.join(os.path.join(os.path.join(current_dir, ".."), "data"), "example_data_1.csv")
+    in_d = open(data_path, 'r')
+
+    molecules = []
+
+    for line in in_d:
+        line = line.rstrip().split(",")[0]
+        molecules.append(line)
+    return molecules
+
+def test_valid_smiles_allowed():
+    """
+    Testing that the grammar allows every character of valid SMILES strings, including the end character.
+    """
+
+    molecules = _get_data() + ["C[C@@H](N)C(=O)O", "[NH4+].[Cl-]", "C1CC=1"]
+
+    dp = data_processing.Molecules_processing()
+    int_mols = dp.string_to_int(molecules)
+    grammar = smiles_grammar.Smiles_grammar(dp.idx_to_char)
+    rows = np.arange(len(molecules))
+    grammar.start(len(molecules))
+
+    for i in range(1, max(len(mol) for mol in molecules) + 2):
+        grammar.update(rows, int_mols[:, i-1])
+        allowed = grammar.mask(rows)
+        not_finished = np.array([i <= len(mol) + 1 for mol in molecules])
+        assert np.all(allowed[rows[not_finished], int_mols[not_finished, i]])
+
+def test_invalid_smiles_forbidden():
+    """
+    Testing that the grammar forbids characters that would make a SMILES syntactically impossible.
+    """
+
+    dp = data_processing.Molecules_processing()
+    dp.string_to_int(["C1CC(=O)[NH3+]C1", "C"])
+    grammar = smiles_grammar.Smiles_grammar(dp.idx_to_char)
+    c2i = dp.char_to_idx
+
+    # Prefix and character that should not be allowed after it
+    cases = [("", ")"), ("", "="), ("C", ")"), ("C1CC", "E"), ("CC(C", "E"), ("C(", ")"), ("C=", "E"),
+             ("C[", "]"), ("C[NH3", "E"), ("C[NH3", "("), ("CC", "]"), ("", "A"), ("C", "G")]
+
+    for prefix, char in cases:
+        grammar.start(1)
+        for c in "G" + prefix:
+            grammar.update(np.array([0]), np.array([c2i[c]]))
+        assert not grammar.mask(np.array([0]))[0, c2i[char]], (prefix, char)
+
+    # Masked probabilities are renormalised
+    grammar.start(1)
+    grammar.update(np.array([0]), np.array([c2i["G"]]))
+    prob = grammar.apply(np.full((1, len(c2i)), 1.0 / len(c2i)), np.array([0]))
+    assert np.isclose(np.sum(prob), 1)
+    assert prob[0, c2i[")"]] == 0
+
+if __name__ == "__main__":
+    test_valid_smiles_allowed()
+    test_invalid_smiles_forbidden()
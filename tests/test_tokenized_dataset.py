@@ -0,0 +1,127 @@
+# Copyright (c) Michael Mazanetz (NovaData Solutions LTD.), Silvia Amabilino (NovaData Solutions LTD.,
+# University of Bristol), David Glowacki (University of Bristol). All rights reserved.
+# Licensed under the GPL. See LICENSE in the project root for license information.
+
+from molbot import tokenized_dataset, data_processing, utils
+import numpy as np
+import shutil
+import os
+
+smiles = ["CC(=O)NC(CS)C(=O)Oc1ccc(NC(C)=O)cc1", "COc1ccc2CC5C3C=CC(O)C4Oc1c2C34CCN5C", "O=C(C)Oc1ccccc1C(=O)O",
+          "CCO", "c1ccccc1", "CC(C)O", "OCC(O)CO"]
+
+def test_write_read():
+
+    dp = data_processing.Molecules_processing()
+    X = dp.onehot_encode(smiles)
+
+    tokenized_dataset.write_dataset("temp_dataset", iter(smiles), dp, n_samples=len(smiles), chunk_size=3)
+    dataset = tokenized_dataset.Tokenized_dataset("temp_dataset")
+
+    assert len(dataset) == len(smiles)
+    assert isinstance(dataset.tokens, np.memmap)
+    assert dataset.tokens.dtype == np.uint8
+    assert np.all(dataset.lengths == [len(smile) + 2 for smile in smiles])
+    assert dataset.data_handler.char_to_idx == dp.char_to_idx
+
+    # Reading all the SMILES gives back the one-hot encoding of the whole data set
+    X_read, y_read = dataset.get_X_y(slice(None), trim=False)
+    assert np.all(X_read == X)
+    assert np.all(y_read[:, :-1] == X[:, 1:])
+
+    # Reading a few SMILES only pads them to the longest one
+    X_int, y_int = dataset.get_X_y(np.array([3, 5]), one_hot=False)
+    assert X_int.shape == (2, len("CC(C)O") + 2)
+    assert dp.onehot_decode(X_int) == ["CCO", "CC(C)O"]
+
+    del dataset
+    shutil.rmtree("temp_dataset")
+
+def test_batches():
+
+    dp = data_processing.Molecules_processing()
+    dp.onehot_encode(smiles)
+    tokenized_dataset.write_dataset("temp_dataset", smiles, dp)
+    dataset = tokenized_dataset.Tokenized_dataset("temp_dataset")
+
+    batches = dataset.batches(batch_size=3, one_hot=False, random_state=0)
+    assert len(batches) == 3
+
+    decoded = []
+    for X_batch, y_batch in batches.epoch():
+        assert len(X_batch.shape) == 2
+        decoded += dp.onehot_decode(X_batch)
+    assert sorted(decoded) == sorted(smiles)
+
+    del dataset, batches
+    shutil.rmtree("temp_dataset")
+
+def test_skipped_molecules():
+
+    dp = data_processing.Molecules_processing(unknown_chars="skip")
+    dp.build_vocabulary(smiles)
+    tokenized_dataset.write_dataset("temp_dataset", smiles[:3] + ["CC[Xe]"] + smiles[3:], dp, chunk_size=2)
+    dataset = tokenized_dataset.Tokenized_dataset("temp_dataset")
+
+    assert len(dataset) == len(smiles)
+    assert dp.onehot_decode(dataset.get_X_y(slice(None), one_hot=False)[0]) == smiles
+
+    del dataset
+    shutil.rmtree("temp_dataset")
+
+def _write_csv(filename, molecules):
+    with open(filename, "w") as out_file:
+        out_file.write("smiles,value\n")
+        for i, smile in enumerate(molecules):
+            out_file.write("%s,%i\n" % (smile, i))
+
+def test_write_parallel():
+
+    _write_csv("temp_1.csv", smiles * 5)
+    _write_csv("temp_2.csv", smiles[:3] + ["CC[Xe]"] + smiles[3:])
+
+    dp = data_processing.Molecules_processing(unknown_chars="skip")
+    dp.build_vocabulary(smiles)
+    tokenized_dataset.write_dataset("temp_dataset", smiles * 6, dp)
+    expected = tokenized_dataset.Tokenized_dataset("temp_dataset")
+
+    # The small ranges of bytes spread the SMILES over several processes, which skip the unknown SMILES
+    tokenized_dataset.write_dataset_parallel("temp_dataset_parallel", ["temp_1.csv", "temp_2.csv"], dp, n_workers=2,
+                                             chunk_bytes=50, chunk_size=2, header=True)
+    dataset = tokenized_dataset.Tokenized_dataset("temp_dataset_parallel")
+
+    assert len(dataset) == len(expected)
+    assert np.all(dataset.lengths == expected.lengths)
+    assert np.all(dataset.tokens == expected.tokens)
+    assert dataset.data_handler.char_to_idx == dp.char_to_idx
+
+    del dataset, expected
+    shutil.rmtree("temp_dataset")
+    shutil.rmtree("temp_dataset_parallel")
+    os.remove("temp_1.csv")
+    os.remove("temp_2.csv")
+
+def test_errors():
+
+    dp = data_processing.Molecules_processing()
+    try:
+        tokenized_dataset.write_dataset("temp_dataset", smiles, dp)
+        raise AssertionError("An InputError should be raised for an empty data handler.")
+    except utils.InputError:
+        pass
+
+    dp.onehot_encode(smiles)
+    try:
+        tokenized_dataset.write_dataset("temp_dataset", iter(smiles), dp, n_samples=len(smiles) + 1)
+        raise AssertionError("An InputError should be raised when there are fewer SMILES than expected.")
+    except utils.InputError:
+        pass
+
+    shutil.rmtree("temp_dataset")
+
+if __name__ == "__main__":
+    test_write_read()
+    test_batches()
+    test_skipped_molecules()
+    test_write_parallel()
+    test_errors()